@@ -0,0 +1,201 @@
+"""Benchmarks of the hot paths at several database sizes
+
+Times loading the books and logs, streaming the logs, searching per keystroke,
+finding logs, writing changes, queries of the columnar logs and the loan index,
+initializing the recommendation engine from its checkpoint, and without one
+in one and in parallel processes, counting the windowed and trending popularity,
+the first 100 recommendations and switching back to a member's cached recommendations.
+Results are written as JSON so runs on different commits can be compared,
+any benchmark slower than the threshold is flagged as a regression.
+
+Usage: python benchmark.py [--sizes 1000:2500 10000:100000] [--output results.json] [--compare old.json]
+The datasets are made by database.generate and kept in --data to be reused.
+"""
+
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable
+
+import database.database as db
+from database.generate import generate
+
+DATA = f"{db.PATH}bench_data"
+SIZES = ("1000:2500", "10000:100000", "100000:1000000")
+REPEAT = 5
+SAMPLE = 1000 # Number of books or members sampled for the per call benchmarks
+THRESHOLD = 1.25 # A benchmark this many times slower than before is a regression
+
+Result = dict[str, Any]
+
+def measure(func: Callable[[], Any], repeat: int = REPEAT, calls: int = 1, setup: Callable[[], Any] | None = None) -> Result:
+    """Times a function repeatedly.
+
+    calls: How many calls func makes, so the time of a single call is reported.
+    setup: Called before every repeat and not timed.
+    Returns the median and min seconds per call.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) / calls)
+    return {"median": statistics.median(times), "min": min(times), "repeat": repeat, "calls": calls}
+
+def dataset(books: int, logs: int, data: str) -> str:
+    """Return the directory of a dataset, generating it if it does not exist."""
+    directory = f"{data}/{books}_{logs}"
+    if not os.path.exists(f"{directory}/logfile.txt"):
+        os.makedirs(directory, exist_ok=True)
+        generate(directory, books=books, logs=logs, members=max(75, books // 20), seed=books)
+    return directory
+
+def keystrokes(text: str) -> list[str]:
+    """Return the entry text after every keystroke typing text."""
+    return [text[:i] for i in range(1, len(text) + 1)]
+
+def bench(directory: str, repeat: int) -> dict[str, Result]:
+    """Runs every benchmark against a copy of the dataset in the directory."""
+    results: dict[str, Result] = {}
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.use_copy(tmp, directory)
+        # Imported once the database is in use, as the engine initializes on import
+        import booksearch as search
+        import bookcheckout as checkout
+        import bookrecommend as recommend
+        # The modules stay imported between datasets, so forget what they cached of the last one
+        search.clear_cache()
+        recommend.engine_update()
+        recommend.sessions_clear()
+
+        results["load_books"] = measure(db.books, repeat, setup=db._reset)
+        results["load_books"]["rows"] = len(db.books())
+        results["load_logs"] = measure(db.logs, repeat, setup=db._reset)
+        results["load_logs"]["rows"] = len(db.logs())
+        db._reset()
+        results["iter_logs"] = measure(lambda: sum(1 for _ in db.iter_logs()), repeat)
+        results["iter_logs"]["rows"] = results["load_logs"]["rows"]
+        db._reset()
+        books, logs = db.books(), db.logs()
+
+        group = rng.choice(list(db.groups()))
+        typed = keystrokes(f"{group['title']} {group['author']}".lower())
+        results["fuzzy"] = measure(lambda: [list(search.fuzzy(t)) for t in typed], repeat, len(typed), setup=search.clear_cache)
+        results["generate_group"] = measure(lambda: [search.generate_group(t) for t in typed], repeat, len(typed), setup=search.clear_cache)
+        results["generate_group_cached"] = measure(lambda: [search.generate_group(t) for t in typed], repeat, len(typed))
+
+        sample = rng.sample(books, min(SAMPLE, len(books)))
+        lent = [b for b in books if b["member"]][:SAMPLE] or sample
+        results["find_log"] = measure(lambda: [checkout.get_log(b) for b in sample], repeat, len(sample))
+        results["active_log"] = measure(lambda: [checkout.active_log(b) for b in lent], repeat, len(lent))
+
+        results["checkpoint"] = measure(db.checkpoint, repeat)
+        it = iter([b["id"] for b in books if not b["member"]])
+        results["transaction"] = measure(lambda: db.transaction([(next(it), "BNCH")]), repeat)
+
+        import database.columnar as columnar
+        results["columnar_build"] = measure(columnar.build, 1)
+        results["columnar_build"]["rows"] = len(logs)
+        results["columnar_open"] = measure(columnar.columns, repeat, setup=columnar.close)
+        results["reads_per_group"] = measure(columnar.reads_per_group, repeat)
+        results["overdue_at"] = measure(columnar.overdue_at, repeat)
+        columnar.close()
+
+        import database.loans as loans
+        days = [rng.choice(logs)["date_out"] for _ in range(SAMPLE)]
+        results["loans_index"] = measure(loans.index, repeat, setup=lambda: setattr(loans, "__index", None))
+        results["loans_index"]["rows"] = len(logs)
+        results["overdue_count"] = measure(lambda: [loans.overdue_count(d) for d in days], repeat, len(days))
+
+        import database.aggregate as aggregate
+        def uncheckpoint():
+            if os.path.exists(aggregate.filename()):
+                os.remove(aggregate.filename())
+        results["engine_init"] = measure(recommend.engine_update, repeat)
+        results["engine_init_cold"] = measure(lambda: recommend.engine_init(1), repeat, setup=uncheckpoint)
+        results["engine_init_cold"]["rows"] = len(logs)
+        results["engine_init_parallel"] = measure(lambda: recommend.engine_init(recommend.WORKERS), repeat, setup=uncheckpoint)
+        results["engine_init_parallel"]["rows"] = len(logs)
+        results["popularity"] = measure(recommend.popularity, repeat, setup=lambda: setattr(recommend, "__popularity", None))
+        results["popularity"]["rows"] = len(logs)
+        members = rng.sample(sorted(db.members()), min(20, len(db.members())))
+        def first_recommendations():
+            for member in members:
+                for _, _ in zip(recommend.recommendation(member)[2], range(100)):
+                    pass
+        results["recommendation_100"] = measure(first_recommendations, repeat, len(members))
+        def switch_members():
+            for member in members:
+                for _, _ in zip(recommend.iter_session(member), range(100)):
+                    pass
+        switch_members()
+        results["session_switch"] = measure(switch_members, repeat, len(members))
+        db._reset()
+    return results
+
+def compare(old: dict[str, Any], new: dict[str, Any], threshold: float) -> list[str]:
+    """Return a line for every benchmark which is slower than threshold times before."""
+    regressions = []
+    for size, results in new["results"].items():
+        for name, result in results.items():
+            try:
+                before = old["results"][size][name]["median"]
+            except KeyError:
+                continue
+            if before and (ratio := result["median"] / before) > threshold:
+                regressions.append(f"{size} {name}: {before*1000:.3f}ms -> {result['median']*1000:.3f}ms ({ratio:.2f}x)")
+    return regressions
+
+def revision() -> str:
+    """Return the current git commit, if there is one."""
+    try:
+        return subprocess.run(("git", "rev-parse", "--short", "HEAD"), capture_output=True, text=True, cwd=db.PATH, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", default=SIZES, help="Dataset sizes as books:logs")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--data", default=DATA, help="Directory to keep the generated datasets")
+    parser.add_argument("--output", help="File to write the JSON results to")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    output = {
+        "revision": revision(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": {},
+    }
+    for size in args.sizes:
+        books, logs = map(int, size.split(":"))
+        print(f"--- {size} ---\n{'benchmark':<20}{'median us':>14}{'min us':>14}")
+        results = output["results"][size] = bench(dataset(books, logs, args.data), args.repeat)
+        for name, result in results.items():
+            rate = f"{result['rows'] / result['median']:>12.0f} rows/s" if "rows" in result else ""
+            print(f"{name:<20}{result['median']*1e6:>14.1f}{result['min']*1e6:>14.1f}{rate}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as file:
+            json.dump(output, file, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf8") as file:
+            regressions = compare(json.load(file), output, args.threshold)
+        for line in regressions:
+            print("REGRESSION", line)
+        sys.exit(bool(regressions))
@@ -5,21 +5,23 @@ out of the library.
 
 from datetime import date, timedelta
 import database.database as db
+import database.instrument as instrument
 
 def checked_out(book: db.Book) -> bool:
     """Is the book currently checked-out with a member"""
     return bool(book["member"])
 
+@instrument.timed()
 def find_log(book: db.Book) -> db.Log:
     """Find the first log which pertains to this book.
 
-    Matches the book ID's in reverse chronological order.
+    Uses the log index of the database for the most recent log.
     Raises ValueError if a suitable log is not found.
     """
-    for log in reversed(db.logs()):
-        if log["id"] == book["id"]:
-            return log
-    raise ValueError("Book not in logs") from None
+    try:
+        return db.latest_log(book["id"])
+    except KeyError:
+        raise ValueError("Book not in logs") from None
 
 def active_log(book: db.Book) -> db.Log:
     """Return the log for this book that is on loan
@@ -52,20 +54,26 @@ def days(book: db.Book) -> int:
     dt: timedelta = date.today() - active_log(book)["date_out"]
     return abs(dt.days)
 
+def overdue(book: db.Book) -> bool:
+    """Is the book on loan for longer than db.OVERDUE_DAYS
+
+    Propagates the error from active log
+    """
+    return days(book) > db.OVERDUE_DAYS
+
 def checkout(book: db.Book, member: db.Member) -> bool:
     """Checkout the book from the library
 
     Edits the database to add the new member,
     creates a new log with todays date as the checkout.
+    The change is written to the files by db.commit().
 
     Returns False if the book is already checkout
     else return True
     """
     if checked_out(book):
         return False
-    book["member"] = member
-    db.members().add(member)
-    db.logs().append(db.make_log(book["id"], member, date.today(), None))
+    db.lend_book(book, member)
     return True
 
 if __name__ == "__main__":
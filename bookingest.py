@@ -0,0 +1,159 @@
+"""Bulk ingest of new acquisitions into the catalogue
+
+Reads a csv batch of books a chunk at a time, checks every row,
+and adds each chunk with the next IDs in a single commit,
+so the books are appended to the journal rather than the files being rewritten.
+A book joins the group with the same title and author, ignoring case and spacing,
+taking its spelling, otherwise it starts a new group.
+
+The batch has a header of the book fields, FIELD_NAMES_BOOK.
+The title, author and genre are required, the genres are separated by ';'
+and the purchase date defaults to today. The id and member must be empty as they are assigned.
+
+Usage: python bookingest.py <batch.csv> [--chunk n] [--check]
+       python bookingest.py  Checks the ingest on a copy of the database.
+"""
+
+import csv
+import os
+from datetime import date
+from itertools import islice
+from typing import Iterable, Iterator, TextIO, TypeAlias
+
+import database.database as db
+
+CHUNK = 4096 # Books added by each commit
+REQUIRED = ("title", "author", "genre")
+
+Names: TypeAlias = dict[tuple[str, str], tuple[str, str]]
+# The title and author of every group, by their normalised title and author
+
+def normalise(title: str, author: str) -> tuple[str, str]:
+    """Return a title and author lowercase with single spaces, to compare them with the groups."""
+    return " ".join(title.split()).casefold(), " ".join(author.split()).casefold()
+
+def group_names() -> Names:
+    """Return the title and author of every group, by their normalised title and author."""
+    return {normalise(g["title"], g["author"]): (g["title"], g["author"]) for g in db.groups()}
+
+def read_rows(file: TextIO) -> Iterator[tuple[int, dict[str, str]]]:
+    """Iterates over the line number and fields of every row of a batch.
+
+    Raises ValueError if the header has a field which is not a book field, or is missing a required one.
+    """
+    reader = csv.DictReader(file)
+    fields = reader.fieldnames or ()
+    if bad := set(fields).difference(db.FIELD_NAMES_BOOK):
+        raise ValueError(f"Unknown fields: {', '.join(sorted(bad))}")
+    if missing := set(REQUIRED).difference(fields):
+        raise ValueError(f"Missing fields: {', '.join(sorted(missing))}")
+    for row in reader:
+        yield reader.line_num, row
+
+def make_book(row: dict[str, str], names: Names) -> db.Book:
+    """Creates a new book from a row of a batch with the title and author of its group.
+
+    A new group is added to the names.
+    Raises ValueError if the row is not a valid book.
+    """
+    if row.get(None):
+        raise ValueError("More fields than the header")
+    if row.get("id") or row.get("member"):
+        raise ValueError("The id and member are assigned, they must be empty")
+    title, author = (" ".join((row[k] or "").split()) for k in ("title", "author"))
+    genre = tuple(g.strip() for g in (row["genre"] or "").split(";"))
+    book = db.make_book(-1, title, author, genre, (row.get("purchase") or "").strip() or date.today().strftime(db.DATE_FMT), "")
+    db.check_book(book)
+    book["title"], book["author"] = names.setdefault(normalise(title, author), (title, author))
+    return book
+
+def ingest(rows: Iterable[tuple[int, dict[str, str]]], chunk: int = CHUNK, check: bool = False) -> tuple[int, list[tuple[int, str]]]:
+    """Adds the books of the rows to the catalogue a chunk at a time.
+
+    The invalid rows are skipped.
+    check: Only check the rows, without adding any books.
+    Returns how many books were added, and the line number and error of every invalid row.
+    """
+    names, added, errors = group_names(), 0, []
+    rows = iter(rows)
+    while batch := list(islice(rows, chunk)):
+        books = []
+        for line, row in batch:
+            try:
+                books.append(make_book(row, names))
+            except ValueError as e:
+                errors.append((line, str(e)))
+        if books and not check:
+            added += len(db.add_books(books))
+    return added, errors
+
+def self_test():
+    """Checks the ingest on a copy of the database, so the books are not added to it."""
+    import io
+    import tempfile
+
+    tmp = tempfile.TemporaryDirectory()
+    db.use_copy(tmp.name)
+
+    print("Normalise:")
+    assert normalise(" The  Hobbit ", "J.R.R. TOLKIEN") == normalise("the hobbit", "j.r.r. Tolkien"), "Normalise Failure"
+    assert normalise("The Hobbit", "Tolkien") != normalise("The Hobbits", "Tolkien"), "Normalise matched another title"
+    print("Passed")
+    print("Read Rows:")
+    for header in ("title,author,colour\n", "title,genre\n"):
+        try:
+            list(read_rows(io.StringIO(header)))
+            assert False, "Invalid Header"
+        except ValueError:    pass
+    print("Passed")
+    print("Ingest:")
+    group = db.groups()[0]
+    copies, gcount, size = len(db.group_books(group)), len(db.groups()), os.path.getsize(db.DB_FILE)
+    batch = io.StringIO()
+    writer = csv.writer(batch)
+    writer.writerow(("title", "author", "genre", "purchase", "member"))
+    writer.writerow((f" {group['title'].upper()} ", group["author"].lower(), ";".join(group["genre"]), "01/01/2020", ""))
+    writer.writerow(("Ingest  Test", "Ingest Author", "Fiction; Test", "", ""))
+    writer.writerow(("ingest test", "INGEST AUTHOR", "Fiction", "", ""))
+    writer.writerow(("", "No Title", "Fiction", "", "")) # line 5
+    writer.writerow(("Bad Date", "Author", "Fiction", "31/02/2020", "")) # line 6
+    writer.writerow(("On Loan", "Author", "Fiction", "", "ABCD")) # line 7
+    writer.writerow(("Extra", "Author", "Fiction", "", "", "extra")) # line 8
+    batch.seek(0)
+    first = max(b["id"] for b in db.books()) + 1
+    added, errors = ingest(read_rows(batch), chunk=2)
+    assert added == 3 and [line for line, _ in errors] == [5, 6, 7, 8], "Rejected Rows Failure"
+    assert [b["id"] for b in db.books()[-3:]] == [first, first + 1, first + 2], "ID Assignment Failure"
+    assert len(db.group_books(group)) == copies + 1 and db.books()[-3]["title"] == group["title"], "Existing Group Failure"
+    new = db.books()[-2:]
+    assert len(db.groups()) == gcount + 1 and new[1]["title"] == new[0]["title"] == "Ingest Test", "New Group Failure"
+    assert new[0]["genre"] == ("Fiction", "Test") and not any(b["member"] for b in new), "Fields Failure"
+    assert os.path.getsize(db.DB_FILE) == size, "Ingest rewrote the database"
+    batch.seek(0)
+    count = len(db.books())
+    assert ingest(read_rows(batch), check=True) == (0, errors) and len(db.books()) == count, "Check added books"
+    print("Passed")
+    tmp.cleanup()
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("batch", nargs="?", help="csv file of the new books, without one the ingest is checked")
+    parser.add_argument("--chunk", type=int, default=CHUNK, help="Books added by each commit")
+    parser.add_argument("--check", action="store_true", help="Only check the rows, without adding any books")
+    args = parser.parse_args()
+
+    if args.batch is None:
+        self_test()
+        sys.exit()
+    with open(args.batch, encoding="utf8", newline="") as file:
+        try:
+            added, errors = ingest(read_rows(file), args.chunk, args.check)
+        except ValueError as e:
+            sys.exit(f"{args.batch}: {e}")
+    for line, error in errors:
+        print(f"{args.batch}:{line}: {error}", file=sys.stderr)
+    print(f"Added {added} books, {len(errors)} rows were invalid")
+    sys.exit(1 if errors else 0)
@@ -8,92 +8,392 @@ from said genres.
 """
 
 import itertools
-from collections import defaultdict
-from typing import Generator, Iterable, Iterator, Sequence, TypeAlias
+import multiprocessing
+import os
+from bisect import insort
+from collections import OrderedDict, defaultdict, deque
+from datetime import date
+from typing import Any, Callable, Collection, Generator, Iterable, Iterator, Sequence, TypeAlias
 import database.database as db
+import database.aggregate as aggregate
+import database.instrument as instrument
 
-Genre: TypeAlias = str
+# Processes to count the reads in when rebuilding the engine from a large logfile
+WORKERS = int(os.environ.get("LIBRARIAN_WORKERS", 0)) or os.cpu_count() or 1
+PARALLEL_SIZE = 1 << 26 # Bytes of logfile before the reads are counted in parallel
+
+Genre: TypeAlias = db.GenreID
 Recommendation: TypeAlias = tuple[db.GroupHash, int]
 # A GroupHash and its matches
+Session: TypeAlias = dict[str, Any]
+# The recommendations of a member: their "genre_count" and top "genres",
+# the "generator" and the "memory" of the recommendations it has generated so far,
+# along with anything made from them, such as the "plot_reads" of the menu
+
+Popularity: TypeAlias = dict[str, Any]
+# The reads of every group by each ranking but "reads", in "groups" indexed by GroupHash and in "books" by book ID.
+# "counted" is the group each book's reads are counted in, "windows" the (day, book ID) of the reads in each window,
+# "day" the day the windows end on and "ref" the day the trending scores are relative to.
+
+WINDOWS = {"month": 30, "year": 365} # Rankings by the reads in the last so many days
+HALF_LIFE = 90 # Days for a read to count half as much in the trending ranking
+RANKINGS = ("reads", *WINDOWS, "trending")
+
+SESSIONS = 32 # Most members to keep the recommendations of
+SESSION_ITEMS = 1 << 16 # Most recommendations kept in memory over every session
 
-def engine_init() -> tuple[dict[Genre, int], dict[db.GroupHash, int], dict[Genre, set[db.GroupHash]]]:
+@instrument.timed()
+def engine_init(workers: int | None = None) -> tuple[list[int], list[int], list[set[db.GroupHash]], list[int]]:
     """Initializes the recommendation engine by creating global state.
 
+    Genres and groups are counted in arrays indexed by their GenreID and GroupHash.
+    The reads of each book are loaded from the aggregate checkpoint,
+    so only the logs since it are counted.
+    workers: Without a checkpoint, more than 1 counts the reads in that many processes,
+        each over a range of bytes of the logfile, and adds them together.
+        Defaults to WORKERS if the logfile is larger than PARALLEL_SIZE,
+        always 1 in a worker process so they never start workers of their own.
     Returns:
-        The every read genre and the count.
+        The read count of every genre.
         The read count of every group.
         A lookup of genres to the books which contain said genre.
+        The genre bitmask of every group.
     """
-    genres: dict[Genre, int] = defaultdict(int)
-    read: dict[db.GroupHash, int] = defaultdict(int)
-    genre_groups: dict[Genre, set[db.GroupHash]] = defaultdict(set)
+    gtable = db.group_table()
+    read = [0] * db.group_count()
+    # Every genre is added to the vocabulary first, so the arrays are long enough
+    for book in db.books():
+        db.genre_ids(book)
+    genre_groups: list[set[db.GroupHash]] = [set() for _ in range(db.genre_count())]
+    group_masks = [0] * db.group_count()
+    for gh, g in gtable.items():
+        ids = db.genre_ids(g)
+        group_masks[gh] = db.genre_mask(ids)
+        for genre in ids:
+            genre_groups[genre].add(gh)
 
-    for log in reversed(db.logs()):
-        book = db.from_id(log["id"])
-        read[db.hash_group(book)] += 1
-        for genre in book["genre"]:
-            genres[genre] += 1
+    if workers is None:
+        workers = WORKERS if os.path.getsize(db.LOG_FILE) >= PARALLEL_SIZE else 1
+    if multiprocessing.parent_process() is not None:
+        workers = 1
+    counts = aggregate.reads_per_book(workers)
 
-    for gh, g in db.group_table().items():
-        for genre in g["genre"]:
-            genre_groups[genre].add(gh)
+    # The logs of books removed from the catalogue are not counted
+    genres = [0] * db.genre_count()
+    for book in db.books():
+        if book["id"] >= len(counts) or not (n := counts[book["id"]]):
+            continue
+        read[db.hash_group(book)] += n
+        for genre in db.genre_ids(book):
+            genres[genre] += n
 
-    return genres, read, genre_groups
+    return genres, read, genre_groups, group_masks
 
-genres, read, genre_groups = engine_init()
+# Worker processes import the main module again when they are spawned, as on Windows,
+# they only count the logs so do not need an engine of their own
+if multiprocessing.parent_process() is None:
+    genres, read, genre_groups, group_masks = engine_init()
+else:
+    genres, read, genre_groups, group_masks = [], [], [], []
 
-def engine_update():
+def _grow():
+    """Extends the arrays with the genres and groups added since."""
+    genres.extend([0] * (db.genre_count() - len(genres)))
+    genre_groups.extend(set() for _ in range(db.genre_count() - len(genre_groups)))
+    read.extend([0] * (db.group_count() - len(read)))
+    group_masks.extend([0] * (db.group_count() - len(group_masks)))
+
+def engine_update(logs: Iterable[db.Log] | None = None, books: Iterable[db.Book] = ()):
     """Update the global state of the recommendation engine.
 
     Required after the database has been updated.
+    logs: Only the new logs to count, otherwise the engine is rebuilt.
+    books: The changed books, whose groups may have been added, changed or removed.
     """
-    global genres, read, genre_groups
-    genres, read, genre_groups = engine_init()
+    global genres, read, genre_groups, group_masks, __popularity
+    if logs is None:
+        genres, read, genre_groups, group_masks = engine_init()
+        __popularity = None
+        return
+    gtable = db.group_table()
+    for book in books:
+        gh = db.hash_group(book)
+        # A removed group has no genres, and a group which lost a genre
+        # is left in its set but no longer matches its mask
+        ids = db.genre_ids(group) if (group := gtable.get(gh)) is not None else ()
+        _grow()
+        group_masks[gh] = db.genre_mask(ids)
+        for genre in ids:
+            genre_groups[genre].add(gh)
+    for log in logs:
+        try:
+            book = db.from_id(log["id"])
+        except KeyError: # Removed later in the same batch
+            continue
+        ids = db.genre_ids(book)
+        _grow()
+        read[db.hash_group(book)] += 1
+        for genre in ids:
+            genres[genre] += 1
+    popularity_update(logs, books)
+
+# Counts the new logs and the changed groups once every commit
+db.on_commit(lambda books, logs: engine_update(logs, books))
+
+__popularity: Popularity | None = None
+
+def popularity() -> Popularity:
+    """Return the windowed and trending reads of every group.
+
+    They are counted in a single pass over the logs the first time they are used,
+    then kept up to date by every commit.
+    """
+    global __popularity
+    if __popularity is None:
+        today = date.today().toordinal()
+        start = today - max(WINDOWS.values())
+        trend: dict[int, float] = defaultdict(float)
+        recent: list[tuple[int, int]] = []
+        for log in db.iter_logs():
+            day = log["date_out"].toordinal()
+            trend[log["id"]] += 2 ** ((day - today) / HALF_LIFE)
+            if day > start:
+                recent.append((day, log["id"]))
+        recent.sort()
+
+        p: Popularity = {"day": today, "ref": today, "counted": {},
+            "windows": {name: deque(r for r in recent if r[0] > today - days) for name, days in WINDOWS.items()},
+            "books": {name: defaultdict(float) for name in RANKINGS[1:]},
+            "groups": {name: [0.0] * db.group_count() for name in RANKINGS[1:]},
+        }
+        for name, window in p["windows"].items():
+            for _, id in window:
+                _score(p, name, id, 1)
+        for id, value in trend.items():
+            _score(p, "trending", id, value)
+        __popularity = p
+    return __popularity
+
+def _score(p: Popularity, name: str, id: int, value: float):
+    """Adds to the score of a book and its group in a ranking."""
+    if (gh := p["counted"].get(id)) is None:
+        try:
+            gh = p["counted"][id] = db.hash_group(db.from_id(id))
+        except KeyError: # Removed from the catalogue
+            return
+    p["books"][name][id] += value
+    groups = p["groups"][name]
+    if gh >= len(groups):
+        groups.extend([0.0] * (db.group_count() - len(groups)))
+    groups[gh] += value
+
+def _advance(p: Popularity, today: int):
+    """Moves the windows to end on the day, dropping the reads which are now too old.
+
+    The trending scores are rescaled to the day once they are over a half life behind it.
+    """
+    for name, days in WINDOWS.items():
+        window = p["windows"][name]
+        while window and window[0][0] <= today - days:
+            _score(p, name, window.popleft()[1], -1)
+    p["day"] = max(p["day"], today)
+    if today - p["ref"] >= HALF_LIFE:
+        scale = 2 ** ((p["ref"] - today) / HALF_LIFE)
+        books, groups = p["books"]["trending"], p["groups"]["trending"]
+        for id in books:
+            books[id] *= scale
+        groups[:] = [value * scale for value in groups]
+        p["ref"] = today
+
+def popularity_update(logs: Iterable[db.Log], books: Iterable[db.Book] = ()):
+    """Counts new logs in the popularity, moves the reads of books which changed group
+    and takes away the reads of removed books, as engine_init does not count them.
+
+    Only if it has been counted, as otherwise it is counted when first used.
+    """
+    if (p := __popularity) is None:
+        return
+    for book in books:
+        if (old := p["counted"].get(book["id"])) is None:
+            continue
+        try:
+            gh = db.hash_group(db.from_id(book["id"]))
+        except KeyError: # Removed from the catalogue
+            gh = None
+        if old != gh:
+            values = {name: p["books"][name].pop(book["id"], 0.0) for name in RANKINGS[1:]}
+            del p["counted"][book["id"]]
+            for name, value in values.items():
+                p["groups"][name][old] -= value
+                if gh is not None:
+                    _score(p, name, book["id"], value)
+    for log in logs:
+        day = log["date_out"].toordinal()
+        for name, days in WINDOWS.items():
+            if day > p["day"] - days:
+                # Logs arrive in date order, so only an older one is inserted in place
+                if not (window := p["windows"][name]) or day >= window[-1][0]:
+                    window.append((day, log["id"]))
+                else:
+                    insort(window, (day, log["id"]))
+                _score(p, name, log["id"], 1)
+        _score(p, "trending", log["id"], 2 ** ((day - p["ref"]) / HALF_LIFE))
+
+def ranking_key(ranking: str = "reads") -> Callable[[db.GroupHash], float]:
+    """Return a function to give the popularity of a group by one of the RANKINGS.
 
-def recommendation(member: db.Member) -> tuple[dict[Genre, int], Iterable[Genre], Generator[Recommendation, None, None]]:
+    "reads" ranks by every read, the windows by the reads in their last days,
+    and "trending" by every read halving in value every HALF_LIFE days.
+    """
+    if ranking == "reads":
+        return lambda gh: read[gh]
+    if ranking not in RANKINGS:
+        raise ValueError(f"Ranking must be one of {', '.join(RANKINGS)}")
+    p = popularity()
+    _advance(p, date.today().toordinal())
+    scores = p["groups"][ranking]
+    return lambda gh: scores[gh] if gh < len(scores) else 0.0
+
+__sessions: OrderedDict[tuple[db.Member, str], Session] = OrderedDict() # Least recently used first
+__session_items = 0 # Recommendations remembered by the cached sessions
+
+def _forget(key: tuple[db.Member, str]):
+    """Forgets a cached session."""
+    global __session_items
+    __session_items -= len(__sessions.pop(key)["memory"])
+
+def _trim(keep: tuple[db.Member, str]):
+    """Forgets the least recently used sessions but keep while there are more than SESSIONS,
+    or they remember more than SESSION_ITEMS recommendations between them.
+
+    keep is forgotten as well if it remembers too many on its own,
+    its iterators carry on but it is started again when next used.
+    """
+    for key in list(__sessions):
+        if len(__sessions) <= SESSIONS and __session_items <= SESSION_ITEMS:
+            return
+        if key != keep:
+            _forget(key)
+    if keep in __sessions and __session_items > SESSION_ITEMS:
+        _forget(keep)
+
+def sessions_clear():
+    """Forgets every session."""
+    global __session_items
+    __sessions.clear()
+    __session_items = 0
+
+def session(member: db.Member, ranking: str = "reads") -> Session:
+    """Return the recommendation session of a member, starting one if it is not cached.
+
+    Switching back to a member continues from the recommendations already generated.
+    The least recently used sessions are forgotten once there are more than SESSIONS,
+    or they remember more than SESSION_ITEMS recommendations between them.
+    ranking: See ranking_key, each ranking has its own session.
+    """
+    if (s := __sessions.get((member, ranking))) is not None:
+        __sessions.move_to_end((member, ranking))
+        return s
+    genre_count, genres, gen = recommendation(member, ranking)
+    s = __sessions[member, ranking] = {"genre_count": genre_count, "genres": genres, "generator": gen, "memory": []}
+    _trim((member, ranking))
+    return s
+
+def iter_session(member: db.Member, ranking: str = "reads") -> Iterator[Recommendation]:
+    """Iterates over the recommendations of a member,
+    the ones remembered by their session first.
+
+    Every recommendation generated counts towards SESSION_ITEMS while the session is cached.
+    """
+    global __session_items
+    s = session(member, ranking)
+    memory, i = s["memory"], 0
+    while True:
+        # Another iterator of the session may have generated more since
+        if i == len(memory):
+            try:
+                memory.append(next(s["generator"]))
+            except StopIteration:
+                return
+            if __sessions.get((member, ranking)) is s:
+                __session_items += 1
+                if __session_items > SESSION_ITEMS:
+                    _trim((member, ranking))
+        yield memory[i]
+        i += 1
+
+def sessions_update(books: Iterable[db.Book], logs: Iterable[db.Log] | None):
+    """Forgets the sessions which may be out of date after a commit.
+
+    Those of the members with new logs, or every session if a group was removed
+    or the database was reloaded.
+    """
+    gtable = db.group_table()
+    if logs is None or any(db.hash_group(book) not in gtable for book in books):
+        sessions_clear()
+        return
+    members = {log["member"] for log in logs}
+    for key in [key for key in __sessions if key[0] in members]:
+        _forget(key)
+
+db.on_commit(sessions_update)
+
+def recommendation(member: db.Member, ranking: str = "reads") -> tuple[list[int], Iterable[Genre], Generator[Recommendation, None, None]]:
     """Generates Recommendations for a member.
 
+    ranking: How the popularity of the books is ranked, see ranking_key.
     Returns:
-        The read genre counts - Number of times each genre was read by this member.
+        The read genre counts - Number of times each genre was read by this member, indexed by GenreID.
         An Iterable of the top genres used in the recommendation system.
         The Recommendation Generator object.
     """
-    member_genres: dict[Genre, int] = defaultdict(int)
-    member_books = [db.from_id(log["id"]) | log for log in reversed(db.logs()) if log["member"] == member]
+    member_books: list[db.Book] = []
+    for log in reversed(db.logs()):
+        if log["member"] == member:
+            try:
+                member_books.append(db.from_id(log["id"]))
+            except KeyError:    pass # Removed from the catalogue
+    member_ids = [db.genre_ids(book) for book in member_books]
+    _grow()
 
-    for book in member_books:
-        for genre in book["genre"]:
+    member_genres = [0] * db.genre_count()
+    for ids in member_ids:
+        for genre in ids:
             member_genres[genre] += 1
 
     member_read = {db.hash_group(book) for book in member_books}
 
     genre_counts: dict[int, list[Genre]] = defaultdict(list)
-    for genre, count in member_genres.items():
-        genre_counts[count].append(genre)
+    for genre, count in enumerate(member_genres):
+        if count:
+            genre_counts[count].append(genre)
 
     counts = sorted(genre_counts, reverse=True)
 
     top_genre_groups = [genre_counts[count] for count, _ in zip(counts, range(5))]
     top_genres = [j for i in top_genre_groups for j in i]
 
-    return member_genres, top_genres, (gh for gh in generate_recommendations(top_genre_groups) if gh[0] not in member_read)
+    key = ranking_key(ranking)
+    return member_genres, top_genres, (gh for gh in generate_recommendations(top_genre_groups, key) if gh[0] not in member_read)
 
-def generate_recommendations(genre_seq: Sequence[Sequence[Genre]]) -> Generator[Recommendation, None, None]:
+def generate_recommendations(genre_seq: Sequence[Sequence[Genre]], key: Callable[[db.GroupHash], float] | None = None) -> Generator[Recommendation, None, None]:
     """Generates Recommendations from groups of genres.
 
     Produces unique Book Group recommendations using the genres,
-    yielding the highest matching to the genres and most read first.
+    yielding the highest matching to the genres and most popular first.
+    key: The popularity of a group, defaults to its reads.
     """
+    key = key or ranking_key()
     done: set[db.GroupHash] = {None}
     for perm_group in combine_permutations(genre_seq):
         head, tail = perm_group[:-1], perm_group[-1]
         genres = {g for gs in head for g in gs} # Flattern the genre groups
-        iterators = [compatible_books(genres.union(g)) for g in tail]
+        iterators = [compatible_books(genres.union(g), key) for g in tail]
 
         # Evenly exhausts the iterators as so no genre combination gets priority
         for groups in (filter(None, tup) for tup in itertools.zip_longest(*iterators)):
-            # sorted by number of global reads
-            for group, matches in sorted(groups, key=lambda x: read[x[0]], reverse=True):
+            # sorted by popularity
+            for group, matches in sorted(groups, key=lambda x: key(x[0]), reverse=True):
                 if group not in done:
                     done.add(group)
                     yield (group, matches)
@@ -125,25 +425,95 @@ def permutation_groups(genres: Sequence[Genre]) -> Generator[Iterator[Sequence[G
     for size in reversed(range(1, len(genres))):
         yield itertools.combinations(genres, size)
 
-def compatible_books(genres: Sequence[Genre]) -> Generator[Recommendation, None, None]:
+def compatible_books(genres: Collection[Genre], key: Callable[[db.GroupHash], float] | None = None) -> Generator[Recommendation, None, None]:
     """Generates Recommendations which have all of the genres.
 
     A recommendation has the GroupHash and the number of genres.
     The number of genres is important for match %.
     """
-    it = iter(genres)
     size = len(genres)
-    return ((i, size) for i in generate_compatible(it, genre_groups[next(it)].copy()))
+    return ((i, size) for i in generate_compatible(genres, key))
 
-def generate_compatible(genres: Iterator[Genre], compat: set[db.GroupHash]) -> Iterable[db.GroupHash]:
+@instrument.timed()
+def generate_compatible(genres: Collection[Genre], key: Callable[[db.GroupHash], float] | None = None) -> Iterable[db.GroupHash]:
     """Return an Iterable of GroupHashes in which
-    a group must contain every genere in the Iterator genres
-    """
-    try:
-        # Take intersection of previous BookGroups and this genres
-        compat &= genre_groups[next(genres)]
-        return generate_compatible(genres, compat)
-    except StopIteration:
-        gtable = db.group_table()
-        # Sort by the most read
-        return sorted(compat, key=lambda gh: (read[gh], gtable[gh]["title"]), reverse=True)
+    a group must contain every genere in genres
+
+    key: The popularity of a group to sort by, defaults to its reads.
+    """
+    key = key or ranking_key()
+    # Only the groups of the rarest genre are checked against the bitmask of the rest
+    mask = db.genre_mask(genres)
+    gtable = db.group_table()
+    compat = [gh for gh in min((genre_groups[g] for g in genres), key=len) if group_masks[gh] & mask == mask and gh in gtable]
+    # Sort by the most popular
+    return sorted(compat, key=lambda gh: (key(gh), gtable[gh]["title"]), reverse=True)
+
+if __name__ == "__main__":
+    import tempfile
+
+    # Works on a copy so the transactions are not written to the database
+    tmp = tempfile.TemporaryDirectory()
+    db.use_copy(tmp.name)
+    engine_update()
+    members = sorted(db.members())
+
+    print("Sessions:")
+    SESSIONS, SESSION_ITEMS = 3, 12
+    for m in members[:4]:
+        assert list(itertools.islice(iter_session(m), 3)) == list(itertools.islice(recommendation(m)[2], 3)), "Session Failure"
+    assert list(__sessions) == [(m, "reads") for m in members[1:4]], "Session Count Failure"
+    session(members[1])
+    assert list(__sessions) == [(m, "reads") for m in (members[2], members[3], members[1])], "Session LRU Failure"
+    list(itertools.islice(iter_session(members[2]), 8))
+    assert list(__sessions) == [(m, "reads") for m in (members[1], members[2])], "Session Eviction Failure"
+    assert __session_items == sum(len(s["memory"]) for s in __sessions.values()) <= SESSION_ITEMS, "Session Items Failure"
+    recs = list(itertools.islice(iter_session(members[0]), SESSION_ITEMS + 1))
+    assert recs == list(itertools.islice(recommendation(members[0])[2], len(recs))) and len(recs) > SESSION_ITEMS, "Session Overflow Failure"
+    assert __session_items <= SESSION_ITEMS and (members[0], "reads") not in __sessions, "Session Bound Failure"
+    session(members[2])
+    stock = next(b for b in db.books() if not b["member"])
+    db.transaction([(stock["id"], members[1])])
+    assert list(__sessions) == [(members[2], "reads")], "Session Invalidation Failure"
+    print("Passed")
+
+    def check_popularity():
+        """Compares the rankings against a pass over the logs of the books in the catalogue."""
+        today = date.today().toordinal()
+        expect: dict[str, dict[db.GroupHash, float]] = {name: defaultdict(float) for name in RANKINGS[1:]}
+        for log in db.logs():
+            try:
+                gh = db.hash_group(db.from_id(log["id"]))
+            except KeyError:
+                continue
+            day = log["date_out"].toordinal()
+            for name, days in WINDOWS.items():
+                if day > today - days:
+                    expect[name][gh] += 1
+            expect["trending"][gh] += 2 ** ((day - today) / HALF_LIFE)
+        for name in RANKINGS[1:]:
+            key = ranking_key(name)
+            for gh in db.group_table():
+                assert abs(key(gh) - expect[name][gh]) <= 1e-9 * max(1, expect[name][gh]), f"{name.title()} Popularity Failure"
+
+    print("Popularity:")
+    check_popularity()
+    lent = [b for b in db.books() if b["member"]][:2]
+    stock = [b for b in db.books() if not b["member"]][:3]
+    db.transaction([(b["id"], "POPS") for b in stock], [b["id"] for b in lent])
+    db.transaction(returns=[stock[0]["id"]])
+    check_popularity()
+    # A log older than the last in the windows
+    db.transaction([(next(b["id"] for b in db.books() if not b["member"]), "POPS")], day=date.fromordinal(date.today().toordinal() - 10))
+    check_popularity()
+    assert all(list(w) == sorted(w, key=lambda r: r[0]) for w in popularity()["windows"].values()), "Popularity Window Order Failure"
+    db.remove_book(stock[0]["id"])
+    check_popularity()
+    # A batch with a new log of a book and then its removal
+    counts = read[:], genres[:]
+    engine_update([db.make_log(stock[0]["id"], "POPS", date.today(), "")], [stock[0]])
+    assert (read[:], genres[:]) == counts, "Removed Book Read Failure"
+    check_popularity()
+    assert __popularity is not None, "Update recounted the popularity"
+    print("Passed")
+    tmp.cleanup()
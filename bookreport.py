@@ -0,0 +1,236 @@
+"""Circulation reports for audits and capacity planning
+
+Answers which books were on loan or overdue on any day
+from the interval index of the loans, without a pass over the logs.
+
+The monthly reports are made in a single pass over a stream of the logs,
+only the totals of each member, genre or month are kept in memory,
+and are written as csv or JSON lines a row at a time.
+
+Usage: python bookreport.py asof [day] [--overdue]  Books on loan at the end of a day, defaults to today.
+       python bookreport.py range <start> <end>      Loans and checkouts from the start to the end day.
+       python bookreport.py members|genres|months|overdue [--format csv|jsonl] [--output file]
+       python bookreport.py                          Checks the reports against the logs.
+Days are in ISO format, e.g. 2021-12-31.
+"""
+
+import csv
+import json
+from collections import defaultdict
+from datetime import date
+from typing import Any, Callable, Iterable, Iterator, TextIO, TypeAlias
+
+import database.database as db
+import database.loans as loans
+
+Row: TypeAlias = dict[str, Any]
+# A row of a report, the keys are the columns
+
+def fmt_loan(log: db.Log, day: date) -> str:
+    """Return a line for a loan with how many days it had been out on the day."""
+    try:
+        title = db.from_id(log["id"])["title"]
+    except KeyError: # Removed from the catalogue
+        title = ""
+    return f"{db.fmt_id(log['id'])}  {log['member']:<6}  {log['date_out'].isoformat()}  {(day - log['date_out']).days:>5}  {title}"
+
+def report_asof(day: date, only_overdue: bool = False) -> Iterator[str]:
+    """Return the lines of the report of the books on loan at the end of a day."""
+    yield f"On loan at the end of {day.isoformat()}: {loans.on_loan_count(day)}"
+    yield f"Overdue: {loans.overdue_count(day)}"
+    yield f"{'id':<{len(db.fmt_id(0))}}  {'member':<6}  {'date out':<10}  {'days':>5}  title"
+    yield from (fmt_loan(log, day) for log in (loans.overdue(day) if only_overdue else loans.on_loan(day)))
+
+def report_range(start: date, end: date) -> Iterator[str]:
+    """Return the lines of the report of the loans from the start to the end day."""
+    yield f"From {start.isoformat()} to {end.isoformat()}"
+    yield f"Loans: {loans.loans_between(start, end)}"
+    yield f"Checkouts: {loans.checkouts_between(start, end)}"
+    yield f"On loan at the start: {loans.on_loan_count(start)}, at the end: {loans.on_loan_count(end)}"
+    yield f"Overdue at the start: {loans.overdue_count(start)}, at the end: {loans.overdue_count(end)}"
+
+def show(lines: Iterable[str]):
+    """Prints the lines of a report."""
+    for line in lines:
+        print(line)
+
+# --- Streamed Reports --- #
+def is_on_loan(log: db.Log, day: date) -> bool:
+    """Was the book of the log on loan at the end of a day."""
+    return log["date_out"] <= day and (not log["date_in"] or log["date_in"] > day)
+
+def is_overdue(log: db.Log, day: date) -> bool:
+    """Was the book of the log on loan for longer than OVERDUE_DAYS at the end of a day."""
+    return is_on_loan(log, day) and (day - log["date_out"]).days > db.OVERDUE_DAYS
+
+MEMBER_FIELDS = ("member", "loans", "on_loan", "overdue")
+GENRE_FIELDS = ("genre", "loans")
+MONTH_FIELDS = ("month", "checkouts", "returns")
+OVERDUE_FIELDS = ("id", "member", "date_out", "days")
+
+def loans_per_member(logs: Iterable[db.Log], day: date) -> Iterator[Row]:
+    """Return the loans of every member up to the day, how many were on loan and overdue at the end of it."""
+    counts: dict[db.Member, list[int]] = defaultdict(lambda: [0, 0, 0])
+    for log in logs:
+        if log["date_out"] > day:
+            continue
+        count = counts[log["member"]]
+        count[0] += 1
+        if is_on_loan(log, day):
+            count[1] += 1
+        if is_overdue(log, day):
+            count[2] += 1
+    for member in sorted(counts):
+        yield dict(zip(MEMBER_FIELDS, (member, *counts[member])))
+
+def loans_per_genre(logs: Iterable[db.Log], books: Iterable[db.Book]) -> Iterator[Row]:
+    """Return the loans of every genre, most read first.
+
+    Only the genres of each book are kept from the catalogue, as IDs.
+    """
+    genres = {book["id"]: db.genre_ids(book) for book in books}
+    counts: dict[db.GenreID, int] = defaultdict(int)
+    removed = 0
+    for log in logs:
+        if (ids := genres.get(log["id"])) is None:
+            removed += 1
+        for genre in ids or ():
+            counts[genre] += 1
+    for genre, n in sorted(counts.items(), key=lambda i: (-i[1], db.genre_name(i[0]))):
+        yield dict(zip(GENRE_FIELDS, (db.genre_name(genre), n)))
+    if removed:
+        yield dict(zip(GENRE_FIELDS, ("", removed))) # Books removed from the catalogue
+
+def loans_per_month(logs: Iterable[db.Log]) -> Iterator[Row]:
+    """Return the checkouts and returns of every month in order."""
+    counts: dict[str, list[int]] = defaultdict(lambda: [0, 0])
+    for log in logs:
+        counts[log["date_out"].strftime("%Y-%m")][0] += 1
+        if log["date_in"]:
+            counts[log["date_in"].strftime("%Y-%m")][1] += 1
+    for month in sorted(counts):
+        yield dict(zip(MONTH_FIELDS, (month, *counts[month])))
+
+def overdue_list(logs: Iterable[db.Log], day: date) -> Iterator[Row]:
+    """Return every loan which was overdue at the end of the day, as they are found."""
+    for log in logs:
+        if is_overdue(log, day):
+            yield dict(zip(OVERDUE_FIELDS, (log["id"], log["member"], log["date_out"], (day - log["date_out"]).days)))
+
+def write_csv(rows: Iterable[Row], fields: Iterable[str], file: TextIO):
+    """Writes the rows as csv with a header of the fields, a row at a time.
+
+    The header is written even if there are no rows.
+    """
+    writer = csv.DictWriter(file, fieldnames=list(fields))
+    writer.writeheader()
+    writer.writerows(rows)
+
+def write_jsonl(rows: Iterable[Row], fields: Iterable[str], file: TextIO):
+    """Writes every row as a line of JSON, dates are in ISO format.
+
+    fields: Not written, as every line has the names of its fields.
+    """
+    for row in rows:
+        file.write(json.dumps(row, default=date.isoformat) + "\n")
+
+# The fields and the rows of every report on a day
+REPORTS: dict[str, tuple[tuple[str, ...], Callable[[date], Iterator[Row]]]] = {
+    "members": (MEMBER_FIELDS, lambda day: loans_per_member(db.iter_logs(), day)),
+    "genres": (GENRE_FIELDS, lambda day: loans_per_genre(db.iter_logs(), db.iter_books())),
+    "months": (MONTH_FIELDS, lambda day: loans_per_month(db.iter_logs())),
+    "overdue": (OVERDUE_FIELDS, lambda day: overdue_list(db.iter_logs(), day)),
+}
+WRITERS = {
+    "csv": write_csv,
+    "jsonl": write_jsonl,
+}
+
+def self_test():
+    """Checks the streamed reports against a pass over the loaded logs."""
+    import io
+    from collections import Counter
+
+    logs, day = db.logs(), date.today()
+    print("Members:")
+    for d in (day, logs[len(logs) // 2]["date_out"]):
+        past = [log for log in logs if log["date_out"] <= d]
+        expect = {m: [0, 0, 0] for m in {log["member"] for log in past}}
+        for log in past:
+            counts = expect[log["member"]]
+            out = not log["date_in"] or log["date_in"] > d
+            counts[0] += 1
+            counts[1] += out
+            counts[2] += out and (d - log["date_out"]).days > db.OVERDUE_DAYS
+        rows = list(loans_per_member(db.iter_logs(), d))
+        assert [r["member"] for r in rows] == sorted(expect), "Members Order Failure"
+        assert all([r["loans"], r["on_loan"], r["overdue"]] == expect[r["member"]] for r in rows), "Members Failure"
+        assert all(r["overdue"] <= r["on_loan"] for r in rows), "Members Overdue Failure"
+    print("Passed")
+    print("Genres:")
+    genres = Counter(g for log in logs if log["id"] in db._book_index() for g in db.from_id(log["id"])["genre"])
+    removed = sum(log["id"] not in db._book_index() for log in logs)
+    rows = list(loans_per_genre(db.iter_logs(), db.iter_books()))
+    assert {r["genre"]: r["loans"] for r in rows if r["genre"]} == genres, "Genres Failure"
+    assert sum(r["loans"] for r in rows if not r["genre"]) == removed, "Genres Removed Failure"
+    assert [r["loans"] for r in rows if r["genre"]] == sorted(genres.values(), reverse=True), "Genres Order Failure"
+    print("Passed")
+    print("Months:")
+    out = Counter(log["date_out"].strftime("%Y-%m") for log in logs)
+    back = Counter(log["date_in"].strftime("%Y-%m") for log in logs if log["date_in"])
+    rows = list(loans_per_month(db.iter_logs()))
+    assert [r["month"] for r in rows] == sorted(out | back), "Months Order Failure"
+    assert all(r["checkouts"] == out[r["month"]] and r["returns"] == back[r["month"]] for r in rows), "Months Failure"
+    print("Passed")
+    print("Overdue:")
+    for d in (day, logs[len(logs) // 2]["date_out"]):
+        late = [log for log in logs if log["date_out"] <= d and (not log["date_in"] or log["date_in"] > d)
+            and (d - log["date_out"]).days > db.OVERDUE_DAYS]
+        rows = list(overdue_list(db.iter_logs(), d))
+        assert [(r["id"], r["member"], r["date_out"]) for r in rows] == [(log["id"], log["member"], log["date_out"]) for log in late], "Overdue Failure"
+    print("Passed")
+    print("Writers:")
+    for name, (fields, report) in REPORTS.items():
+        file = io.StringIO()
+        write_csv(report(day), fields, file)
+        assert file.getvalue().splitlines()[0] == ",".join(fields), f"{name.title()} Header Failure"
+    file = io.StringIO()
+    write_csv(iter(()), OVERDUE_FIELDS, file)
+    assert file.getvalue().strip() == ",".join(OVERDUE_FIELDS), "Empty Report Header Failure"
+    file = io.StringIO()
+    write_jsonl(loans_per_month(db.iter_logs()), MONTH_FIELDS, file)
+    assert [json.loads(line) for line in file.getvalue().splitlines()] == list(loans_per_month(db.iter_logs())), "JSON Lines Failure"
+    print("Passed")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command")
+    asof = commands.add_parser("asof", help="Books on loan at the end of a day")
+    asof.add_argument("day", nargs="?", type=date.fromisoformat, default=date.today())
+    asof.add_argument("--overdue", action="store_true", help="Only list the overdue books")
+    between = commands.add_parser("range", help="Loans from the start to the end day")
+    between.add_argument("start", type=date.fromisoformat)
+    between.add_argument("end", type=date.fromisoformat)
+    for name, help in (("members", "Loans per member"), ("genres", "Loans per genre"), ("months", "Loans per month"), ("overdue", "Every overdue loan")):
+        export = commands.add_parser(name, help=help)
+        export.add_argument("--format", choices=WRITERS, default="csv")
+        export.add_argument("--output", help="File to write to, defaults to the standard output")
+        export.add_argument("--day", type=date.fromisoformat, default=date.today(), help="Day the loans are overdue on")
+    args = parser.parse_args()
+
+    if args.command is None:
+        self_test()
+    elif args.command == "asof":
+        show(report_asof(args.day, args.overdue))
+    elif args.command == "range":
+        show(report_range(args.start, args.end))
+    elif args.output:
+        fields, report = REPORTS[args.command]
+        with open(args.output, "w", encoding="utf8", newline="") as file:
+            WRITERS[args.format](report(args.day), fields, file)
+    else:
+        import sys
+        fields, report = REPORTS[args.command]
+        WRITERS[args.format](report(args.day), fields, sys.stdout)
@@ -1,8 +1,7 @@
 """The module handles returning a book back to the library"""
 
-from datetime import date
 import database.database as db
-from bookcheckout import active_log, days
+from bookcheckout import days
 
 def submit(book: db.Book) -> int:
     """Return the book to the library
@@ -10,9 +9,9 @@ def submit(book: db.Book) -> int:
 
     Edits the logs to add today's date as the return date
     Edits the book to remove the member from the database
+    The change is written to the files by db.commit()
     Will propegate the active_log error
     """
-    log = active_log(book)
-    log["date_in"] = date.today()
-    book["member"] = ""
-    return days(book)
+    d = days(book)
+    db.return_book(book)
+    return d
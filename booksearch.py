@@ -1,10 +1,15 @@
 """Searching for books and groups
 using a set of search terms.
 Uses generators to reduce extra time spent computing values
+
+The results of the recent searches are cached until the catalogue changes,
+the hits and misses are counted in database.instrument.
 """
 
-from typing import Generator, Iterable, Iterator
+from collections import OrderedDict
+from typing import Any, Callable, Generator, Iterable, Iterator
 import database.database as db
+import database.instrument as instrument
 
 def is_in(book: dict[str, str], area: str, terms: Iterable[str]) -> Generator[bool, None, None]:
     """Return an Iterator of bools for each term in terms whether it is found in any of the areas of book
@@ -20,34 +25,70 @@ def find_in(book: dict[str, str], terms: Iterable[str], *areas: str) -> bool:
     """
     return all(map(any, zip(*map(lambda area: is_in(book, area, terms), areas))))
 
+CACHE_SIZE = 256 # Most searches remembered
+
+# IDs found by the recent searches by kind and terms, with the catalogue revision they were found at
+__cache: OrderedDict[tuple[str, tuple[str, ...]], tuple[int, list[Any]]] = OrderedDict() # Least recently used first
+
+def normalise(term: str) -> tuple[str, ...]:
+    """Return the search terms of a query, lowercase, in order and without repeats,
+    so queries with the same terms share a result.
+    """
+    return tuple(sorted(set(term.strip().lower().split())))
+
+def cached(kind: str, terms: tuple[str, ...], find: Callable[[list[str]], Iterable[Any]]) -> list[Any]:
+    """Return the IDs found by a search, from the cache if the catalogue has not changed since.
+
+    find: Finds the IDs for the terms on a miss.
+    The least recently used search is forgotten once there are more than CACHE_SIZE.
+    """
+    key, rev = (kind, terms), db.catalogue_revision()
+    if (hit := __cache.get(key)) is not None and hit[0] == rev:
+        __cache.move_to_end(key)
+        instrument.count("search.cache_hits")
+        return hit[1]
+    instrument.count("search.cache_misses")
+    ids = list(find(list(terms)))
+    __cache[key] = (rev, ids)
+    __cache.move_to_end(key)
+    while len(__cache) > CACHE_SIZE:
+        __cache.popitem(last=False)
+    return ids
+
+def cache_info() -> dict[str, float]:
+    """Return the hits, misses and hit rate of the search cache, and how many searches it holds."""
+    hits, misses = instrument.counters.get("search.cache_hits", 0), instrument.counters.get("search.cache_misses", 0)
+    return {"hits": hits, "misses": misses, "rate": hits / (hits + misses or 1), "size": len(__cache)}
+
+def clear_cache():
+    """Forgets every cached search."""
+    __cache.clear()
+
 def search(title: str) -> list[db.Book]:
     """Return all books with an exactly matching title"""
     return [b for b in db.books() if title == b["title"]]
 
+@instrument.timed()
 def fuzzy(term: str) -> Generator[db.Book, None, None]:
     """Performs a fuzzy search over the id, title, and author
 
     The term is split over the spaces and provides the required terms.
-    Generator of Books as they are needed.
+    Generator of Books as they are needed, the IDs found are cached.
     """
-    terms = term.strip().lower().split()
-    return (b for b in db.books() if find_in(b, terms, "id", "title", "author"))
+    ids = cached("fuzzy", normalise(term), lambda terms: (b["id"] for b in db.books() if find_in(b, terms, "id", "title", "author")))
+    return (db.from_id(id) for id in ids)
 
 def fuzzy_id(id: str) -> Iterator[db.Book]:
     """Return books with a partial id number match"""
     return (book for book in db.books() if id in str(book["id"]))
 
-active_groups: list[db.Group] = []
-
 def generate_group(term: str) -> list[db.Group]:
     """Return list of groups which match the search terms
 
-    It also caches the result in the active_groups variable.
+    The GroupHashes found are cached.
     """
-    global active_groups
-    terms = term.strip().lower().split()
-    active_groups = [g for g in db.groups() if find_in(g, terms, "title", "author")]
-    return active_groups
+    gtable = db.group_table()
+    return [gtable[gh] for gh in cached("groups", normalise(term), lambda terms: (db.hash_group(g) for g in db.groups() if find_in(g, terms, "title", "author")))]
 
 if __name__ == "__main__":
 
@@ -66,3 +107,16 @@ if __name__ == "__main__":
     print("Fuzzy:")
     assert sum(1 for _ in fuzzy("19 Orw")) == len(orwell) + 1, "Should find only 1984 and 1 animal farm"
     print("Passed")
+    print("Cache:")
+    clear_cache()
+    groups = generate_group("orwell")
+    info = cache_info()
+    assert generate_group(" Orwell  ORWELL") == groups and cache_info()["hits"] == info["hits"] + 1, "Cache Hit Failure"
+    assert list(fuzzy("Orw 19")) == list(fuzzy("19 Orw")), "Cache Terms Failure"
+    info = cache_info()
+    db._reset()
+    assert generate_group("orwell") == groups and cache_info()["misses"] == info["misses"] + 1, "Cache Invalidation Failure"
+    for i in range(CACHE_SIZE + 1):
+        generate_group(str(i))
+    assert cache_info()["size"] == CACHE_SIZE, "Cache Size Failure"
+    print("Passed")
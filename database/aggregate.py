@@ -0,0 +1,285 @@
+"""Checkpoints of how many times every book has been read, so they are not recounted every start.
+
+The counts of the logs in the logfile are saved as JSON next to it,
+along with how many logs were counted and where the last of them is in the logfile.
+Only the logs after that are read when loading them, without parsing the rest of the logfile.
+A checkpoint of the database rewrites the logfile, which keeps the order of the logs
+but moves them as returned logs get longer. The last log counted is then found again
+by counting the lines before it, and the checkpoint is only used if it and the first log are unchanged.
+
+Usage: python -m database.aggregate  Checks the counts against the logs.
+"""
+
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Any, BinaryIO, TypeAlias
+
+import database.database as db
+
+VERSION = 2
+EVERY = 1 << 14 # Logs read after the checkpoint before a new one is saved
+
+Checkpoint: TypeAlias = dict[str, Any]
+# "rows" logs counted, "offset" of the last of them in the logfile, the "first" and "last" of their fields
+# and the "reads" of every book. "moved" once loaded if the logs have moved since it was saved.
+
+def filename() -> str:
+    """Return the checkpoint file of the logfile in use."""
+    return f"{os.path.splitext(db.LOG_FILE)[0]}.agg.json"
+
+def _fields(line: bytes) -> list[str]:
+    """Return the fields of a line of the logfile which never change,
+    the book, member and checkout date. Every field of the header line.
+    """
+    return line.rstrip(b"\r\n").decode("utf8").split(",")[:3]
+
+def _find_line(file: BinaryIO, n: int) -> int | None:
+    """Return the position of line n of the file, the header is line 0.
+
+    The lines are counted a block at a time without being read one by one.
+    None if the file has fewer lines.
+    """
+    file.seek(0)
+    pos = 0
+    while n and (data := file.read(1 << 20)):
+        if (count := data.count(b"\n")) < n:
+            n -= count
+            pos += len(data)
+            continue
+        i = -1
+        for _ in range(n):
+            i = data.index(b"\n", i + 1)
+        return pos + i + 1
+    return None if n else 0
+
+def _load(file: BinaryIO) -> Checkpoint | None:
+    """Return the checkpoint if it still matches the logfile,
+    leaving the file at the first log after it.
+    """
+    try:
+        with open(filename(), encoding="utf8") as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if checkpoint.get("version") != VERSION:
+        return None
+    file.seek(0)
+    file.readline() # Header
+    if checkpoint["rows"] and _fields(file.readline()) != checkpoint["first"]:
+        return None
+    file.seek(checkpoint["offset"])
+    if _fields(file.readline()) != checkpoint["last"]:
+        # The logfile has been rewritten, the logs are in the same order
+        if (offset := _find_line(file, checkpoint["rows"])) is None:
+            return None
+        file.seek(offset)
+        if _fields(file.readline()) != checkpoint["last"]:
+            return None
+        checkpoint["offset"], checkpoint["moved"] = offset, True
+    return checkpoint
+
+def _last_line(file: BinaryIO) -> tuple[int, bytes]:
+    """Return the position and contents of the last line of the file."""
+    end = file.seek(0, os.SEEK_END)
+    pos, data = end, b""
+    while pos and data.rstrip(b"\r\n").count(b"\n") == 0:
+        pos = max(0, pos - 4096)
+        file.seek(pos)
+        data = file.read(end - pos)
+    start = data.rfind(b"\n", 0, len(data.rstrip(b"\r\n"))) + 1
+    return pos + start, data[start:]
+
+def save(reads: list[int], rows: int, file: BinaryIO):
+    """Writes a checkpoint of the reads of the rows logs in the logfile, which are all of its logs.
+
+    file: The logfile, to find the first and last of the logs in.
+    """
+    file.seek(0)
+    file.readline() # Header
+    first = file.readline()
+    offset, last = _last_line(file)
+    name = filename()
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(name) or ".", suffix=".tmp")
+    with open(fd, "w", encoding="utf8") as f:
+        json.dump({"version": VERSION, "rows": rows, "offset": offset, "first": _fields(first), "last": _fields(last), "reads": reads}, f)
+    os.replace(tmp, name)
+
+def _add(counts: list[int], id: int):
+    """Counts a read of a book, extending the counts to its ID."""
+    if id >= len(counts):
+        counts.extend([0] * (id + 1 - len(counts)))
+    counts[id] += 1
+
+def _sum(total: list[int], counts: list[int]) -> list[int]:
+    """Adds counts indexed by book ID to the total, which is extended if it is shorter."""
+    if len(total) < len(counts):
+        total, counts = counts, total
+    for id, n in enumerate(counts):
+        total[id] += n
+    return total
+
+def _count(file: BinaryIO, start: int, stop: int) -> tuple[list[int], int]:
+    """Counts the book IDs of the logs which start in a range of bytes of the logfile.
+
+    start: After the header, so the line before it can be skipped.
+    Returns the counts indexed by book ID and the number of logs.
+    """
+    reads: list[int] = []
+    file.seek(start - 1)
+    file.readline() # The rest of a log which started before the range
+    pos, rows = file.tell(), 0
+    while pos < stop and (lines := file.readlines(min(1 << 20, stop - pos))):
+        for line in lines:
+            _add(reads, int(line[:line.index(b",")]))
+        rows += len(lines)
+        pos += sum(map(len, lines))
+    return reads, rows
+
+def _stat(fileno: int) -> tuple[int, int, int]:
+    """Return the inode, size and modification time of the logfile, which a checkpoint changes."""
+    st = os.fstat(fileno)
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+def _count_range(name: str, stat: tuple[int, int, int], start: int, stop: int) -> tuple[list[int], int] | None:
+    """Counts a range of bytes of the logfile in a worker process.
+
+    Returns None if the logfile has been rewritten since it was split.
+    """
+    with open(name, "rb") as file:
+        if _stat(file.fileno()) != stat:
+            return None
+        return _count(file, start, stop)
+
+def _count_parallel(file: BinaryIO, workers: int) -> tuple[list[int], int]:
+    """Counts the logs from the position of the file to its end,
+    split into a range of bytes for each worker process.
+
+    A range is counted here instead if the logfile was rewritten before its worker opened it.
+    Returns the counts indexed by book ID and the number of logs.
+    """
+    begin, end = file.tell(), file.seek(0, os.SEEK_END)
+    size = max(1, -(-(end - begin) // workers))
+    ranges = [(i, min(i + size, end)) for i in range(begin, end, size)]
+    reads, rows = [], 0
+    if not ranges:
+        return reads, rows
+    with ProcessPoolExecutor(len(ranges)) as pool:
+        results = pool.map(_count_range, repeat(file.name), repeat(_stat(file.fileno())), *zip(*ranges))
+        for (start, stop), result in zip(ranges, results):
+            counts, n = _count(file, start, stop) if result is None else result
+            reads = _sum(reads, counts)
+            rows += n
+    return reads, rows
+
+def reads_per_book(workers: int = 1) -> list[int]:
+    """Return the number of times every book has been checked-out, indexed by book ID.
+
+    Starts from the checkpoint and reads only the logs after it, and those in the journal.
+    A new checkpoint is saved if there was none, the logs have moved or more than EVERY logs were read.
+    The database loads the changes of other processes first, so exactly the logs it has loaded are counted
+    and the next refresh only passes the logs after them to the commit callbacks.
+    workers: Without a checkpoint the logfile is split into this many ranges of bytes,
+        each counted in its own process, if more than 1.
+    """
+    with db.lock():
+        db.books()
+        db.refresh()
+        file = open(db.LOG_FILE, "rb")
+        records = db._read_journal()[0]
+    with file:
+        checkpoint = _load(file)
+        if checkpoint is not None:
+            reads, rows, start = checkpoint["reads"], checkpoint["rows"], checkpoint["rows"]
+        else:
+            file.seek(0)
+            file.readline() # Header
+            reads, rows, start = [], 0, 0
+            if workers > 1:
+                reads, rows = _count_parallel(file, workers)
+        while line := file.readline():
+            _add(reads, int(line[:line.index(b",")]))
+            rows += 1
+        if checkpoint is None or checkpoint.get("moved") or rows - start >= EVERY:
+            save(reads, rows, file)
+    # Logs in the journal after the end of the logfile, each is written again when returned
+    for id in {int(r[1]): int(r[2]) for r in records if r[0] == "L" and int(r[1]) >= rows}.values():
+        _add(reads, id)
+    return reads
+
+if __name__ == "__main__":
+    from collections import Counter
+    from datetime import date
+
+    # Run from the top directory so the database package can be imported
+    # Works on a copy so the checkpoint is not left next to the database
+    tmp = tempfile.TemporaryDirectory()
+    db.use_copy(tmp.name, db.PATH)
+
+    def check(workers: int = 1):
+        """Compares the counts against the logs."""
+        reads = reads_per_book(workers)
+        counts = Counter(log["id"] for log in db.logs())
+        assert {id: n for id, n in enumerate(reads) if n} == counts, "Reads per Book Failure"
+
+    print("Save:")
+    assert not os.path.exists(filename())
+    check()
+    with open(filename(), encoding="utf8") as f:
+        assert json.load(f)["rows"] == len(db.logs()), "Save Failure"
+    print("Passed")
+    print("Load:")
+    with open(db.LOG_FILE, "rb") as f:
+        assert _load(f) is not None and not f.read(), "Load Failure"
+    lent = [b for b in db.books() if b["member"]][:2]
+    stock = [b for b in db.books() if not b["member"]][:2]
+    db.transaction([(b["id"], "AGGR") for b in stock], [b["id"] for b in lent])
+    db.transaction(returns=[stock[0]["id"]])
+    check()
+    print("Passed")
+    print("Refresh:")
+    seen: list[db.Log] = []
+    db.on_commit(lambda books, logs: seen.extend(logs or ()))
+    book = next(b for b in db.books() if not b["member"])
+    # A checkout by another process, which has not been loaded yet
+    db._journal((("B", *db.str_book(book | {"member": "OTHR"})),
+        ("L", str(len(db.logs())), *db.str_log(db.make_log(book["id"], "OTHR", date.today(), None)))))
+    reads = reads_per_book()
+    seen.clear()
+    db.refresh()
+    for log in seen:
+        _add(reads, log["id"])
+    assert {id: n for id, n in enumerate(reads) if n} == Counter(log["id"] for log in db.logs()), "Refresh counted a log twice"
+    print("Passed")
+    print("Checkpoint:")
+    db.checkpoint()
+    with open(db.LOG_FILE, "rb") as f:
+        assert _load(f)["moved"], "Moved Logs Failure"
+    check()
+    with open(db.LOG_FILE, "rb") as f:
+        assert "moved" not in _load(f), "Moved Logs Save Failure"
+    print("Passed")
+    print("Parallel:")
+    with open(db.LOG_FILE, "rb") as f:
+        f.readline()
+        header, end = f.tell(), f.seek(0, os.SEEK_END)
+        whole = _count(f, header, end)[0]
+        assert _sum(_count(f, header, header + 100)[0], _count(f, header + 100, end)[0]) == whole, "Range Failure"
+        # Ranges which split logs, and which end on or start at a line break
+        assert sum(_count(f, i, i + 7)[1] for i in range(header, end, 7)) == len(db.logs()), "Range Rows Failure"
+    os.remove(filename())
+    check(3)
+    with open(db.LOG_FILE, "rb") as f:
+        assert _load(f)["rows"] == len(db.logs()), "Parallel Save Failure"
+    print("Passed")
+    print("Resave:")
+    with open(db.LOG_FILE, "a", encoding="utf8", newline="") as f:
+        f.writelines(f"{db.books()[i % len(db.books())]['id']},AGGR,01/01/2000,02/01/2000\r\n" for i in range(EVERY))
+    db._reset()
+    check()
+    with open(filename(), encoding="utf8") as f:
+        assert json.load(f)["rows"] == len(db.logs()), "Resave Failure"
+    print("Passed")
+    tmp.cleanup()
@@ -0,0 +1,461 @@
+"""Memory-mapped columnar copy of the logfile for analytics over the full history.
+
+Only the id, member, date_out and date_in of each log are kept,
+as fixed width columns in a binary file next to the logfile:
+uint32 book IDs, uint32 member codes and int32 day ordinals, 0 if not returned.
+The file is memory-mapped, so opening it takes the same time however long
+the history is and only the pages a query reads are loaded.
+
+Queries are vectorised with numpy if it is installed,
+otherwise they loop over memoryviews of the columns.
+Counting the reads of every book can be split over worker processes,
+which each map the file and count a range of its rows.
+
+When a checkpoint rewrites the logfile the file is extended with the new logs
+and the return dates of the logs on loan, the rest of the logs are not parsed again.
+The few logs in the journal since then are applied on top of it.
+
+Usage: python -m database.columnar  Checks the columns against the logs.
+"""
+
+import csv
+import io
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from functools import lru_cache
+from itertools import islice, repeat
+from typing import Any, BinaryIO, Sequence, TypeAlias
+
+import database.database as db
+
+try:
+    import numpy as np
+except ImportError: # Falls back to looping over the memoryviews
+    np = None
+
+MAGIC = b"LIBCOL1\n"
+# Magic, rows, logfile size and modification time, length of the member table
+HEADER = struct.Struct("=8sQqqQ")
+# Name and array type code of each column
+FIELDS = (("id", "I"), ("member", "I"), ("date_out", "i"), ("date_in", "i"))
+
+Columns: TypeAlias = dict[str, Any]
+# The open file: "parts" is a list of column dicts, the mapped file then the logs in the journal,
+# "members" the member of each code, "codes" the code of each member,
+# "header" the header of the file and "offsets" where each column starts in it.
+
+def filename() -> str:
+    """Return the columnar file of the logfile in use."""
+    return f"{os.path.splitext(db.LOG_FILE)[0]}.col"
+
+def _log_stat(fileno: int | None = None) -> tuple[int, int]:
+    """Return the size and modification time of the logfile,
+    which change whenever a checkpoint rewrites it.
+    """
+    st = os.stat(db.LOG_FILE) if fileno is None else os.fstat(fileno)
+    return st.st_size, st.st_mtime_ns
+
+@lru_cache(maxsize=1 << 16)
+def _ordinal(s: str) -> int:
+    """Converts a date from a csv row into a day ordinal, 0 if empty."""
+    return d.toordinal() if (d := db._date(s)) else 0
+
+def _encode(rows: list[list[str]], codes: dict[db.Member, int]) -> tuple[array, ...]:
+    """Converts a chunk of csv rows of the logfile into arrays of each column.
+
+    codes: The code of every member seen so far, new members are added.
+    """
+    ids, members, date_outs, date_ins = zip(*rows, strict=True)
+    members = map(db._member, members)
+    return (
+        array("I", map(int, ids)),
+        array("I", [codes.setdefault(m, len(codes)) for m in members]),
+        array("i", map(_ordinal, date_outs)),
+        array("i", map(_ordinal, date_ins)),
+    )
+
+def _pad(file):
+    """Pads the file with zeros up to a multiple of 8 bytes, so every column is aligned."""
+    file.write(bytes(-file.tell() % 8))
+
+def _save(name: str, rows: int, stat: tuple[int, int], codes: dict[db.Member, int], columns: Sequence[BinaryIO]):
+    """Writes the columnar file from a temporary file of each column.
+
+    stat: Of the logfile the rows are from.
+    """
+    table = "\n".join(codes).encode("utf8")
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(name) or ".", suffix=".tmp")
+    with open(fd, "wb") as file:
+        file.write(HEADER.pack(MAGIC, rows, *stat, len(table)))
+        file.write(table)
+        for column in columns:
+            _pad(file)
+            column.seek(0)
+            while data := column.read(1 << 20):
+                file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, name)
+
+def build(name: str | None = None) -> int:
+    """Writes the columnar file from the logfile.
+
+    The logfile is streamed a chunk at a time into a temporary file for each column,
+    so memory use does not depend on the number of logs.
+    Returns the number of rows.
+    """
+    name = name or filename()
+    codes: dict[db.Member, int] = {}
+    rows = 0
+    with db.lock():
+        logfile = open(db.LOG_FILE, encoding="utf8", newline="")
+    with logfile, tempfile.TemporaryFile() as ids, tempfile.TemporaryFile() as members, \
+            tempfile.TemporaryFile() as date_outs, tempfile.TemporaryFile() as date_ins:
+        stat = _log_stat(logfile.fileno())
+        columns = (ids, members, date_outs, date_ins)
+        for chunk in db._chunks(logfile, lambda rows: _encode(rows, codes)):
+            for file, values in zip(columns, chunk):
+                values.tofile(file)
+            rows += len(chunk[0])
+        _save(name, rows, stat, codes, columns)
+    return rows
+
+def extend(name: str | None = None) -> bool:
+    """Brings the columnar file up to date with a logfile rewritten by a checkpoint.
+
+    A checkpoint only adds logs and fills in the return date of those on loan,
+    so only the new logs and the return dates of the rows on loan are parsed,
+    the other lines are only checked to have the same book ID.
+    Returns False if there is no file or the logfile is not the logs in it followed by new ones,
+    it must then be built.
+    """
+    name = name or filename()
+    if (header := _header(name)) is None:
+        return False
+    _, old, _, _, size = header
+    offsets = _offsets(header)
+    with db.lock():
+        logfile = open(db.LOG_FILE, "rb")
+    with logfile, tempfile.TemporaryFile() as ids, tempfile.TemporaryFile() as members, \
+            tempfile.TemporaryFile() as date_outs, tempfile.TemporaryFile() as date_ins:
+        stat = _log_stat(logfile.fileno())
+        columns = (ids, members, date_outs, date_ins)
+        with open(name, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            codes = {m: i for i, m in enumerate(mm[HEADER.size:HEADER.size + size].decode("utf8").split("\n"))} if size else {}
+            returns = array("i", mm[offsets["date_in"]:offsets["date_in"] + 4 * old])
+            on_loan = {i for i, day in enumerate(returns) if not day}
+            logfile.readline() # Header
+            rows = 0
+            with memoryview(mm)[offsets["id"]:offsets["id"] + 4 * old].cast("I") as old_ids:
+                for i, (id, line) in enumerate(zip(old_ids, logfile)):
+                    if int(line[:line.index(b",")]) != id:
+                        return False
+                    if i in on_loan:
+                        returns[i] = _ordinal(line.rstrip(b"\r\n").rsplit(b",", 1)[1].decode("utf8"))
+                    rows += 1
+            if rows < old:
+                return False
+            for (field, _), column in zip(FIELDS, columns):
+                if field == "date_in":
+                    returns.tofile(column)
+                else:
+                    column.write(mm[offsets[field]:offsets[field] + 4 * old])
+        # The new logs after them
+        reader = csv.reader(io.TextIOWrapper(logfile, encoding="utf8", newline=""))
+        while chunk := list(islice(reader, db.CHUNK)):
+            for column, values in zip(columns, _encode(chunk, codes)):
+                values.tofile(column)
+            rows += len(chunk)
+        _save(name, rows, stat, codes, columns)
+    return True
+
+def _header(name: str) -> tuple | None:
+    """Return the header of a columnar file, None if it is missing or not one."""
+    try:
+        with open(name, "rb") as file:
+            header = HEADER.unpack(file.read(HEADER.size))
+    except (FileNotFoundError, struct.error):
+        return None
+    return header if header[0] == MAGIC else None
+
+def _column(values: Sequence[int], typecode: str) -> Any:
+    """Return the values as a numpy array or an array of the typecode."""
+    if np is not None:
+        return np.array(values, dtype=typecode)
+    return array(typecode, values)
+
+def _offsets(header: tuple) -> dict[str, int]:
+    """Return where each column starts in a columnar file, they are aligned to 8 bytes."""
+    _, rows, _, _, size = header
+    pos = HEADER.size + size
+    offsets = {}
+    for field, _ in FIELDS:
+        pos += -pos % 8
+        offsets[field] = pos
+        pos += 4 * rows
+    return offsets
+
+def _open() -> Columns:
+    """Maps the columnar file, extending or rebuilding it first if it is out of date,
+    and applies the logs committed to the journal since the last checkpoint.
+    """
+    name = filename()
+    while True:
+        with db.lock():
+            if (header := _header(name)) is not None and header[2:4] == _log_stat():
+                file = open(name, "rb")
+                records = db._read_journal()[0]
+                stat = (_log_stat(), db._journal_stat())
+                break
+        if not extend(name):
+            build(name)
+
+    with file:
+        # Private copy on write, so the journal can be applied to the mapped columns
+        mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    _, rows, _, _, size = header
+    members = mm[HEADER.size:HEADER.size + size].decode("utf8").split("\n") if size else []
+    offsets = _offsets(header)
+    part = {}
+    for field, typecode in FIELDS:
+        pos = offsets[field]
+        if np is not None:
+            part[field] = np.frombuffer(mm, dtype=typecode, count=rows, offset=pos)
+        else:
+            part[field] = memoryview(mm)[pos:pos + 4 * rows].cast(typecode)
+
+    codes = {m: i for i, m in enumerate(members)}
+    tail: dict[str, list[int]] = {field: [] for field, _ in FIELDS}
+    for record in records:
+        if record[0] != "L":
+            continue
+        i, log = int(record[1]), db._make_log_from_csv(*record[2:])
+        values = (log["id"], codes.setdefault(log["member"], len(codes)),
+            log["date_out"].toordinal(), log["date_in"].toordinal() if log["date_in"] else 0)
+        if len(members) < len(codes):
+            members.append(log["member"])
+        if i < rows:
+            for (field, _), v in zip(FIELDS, values):
+                part[field][i] = v
+        elif i == rows + len(tail["id"]):
+            for (field, _), v in zip(FIELDS, values):
+                tail[field].append(v)
+
+    return {
+        "mmap": mm,
+        "parts": [part, {field: _column(tail[field], typecode) for field, typecode in FIELDS}],
+        "members": members,
+        "codes": codes,
+        "stat": stat,
+        "header": header,
+        "offsets": offsets,
+    }
+
+__columns: Columns | None = None
+def columns() -> Columns:
+    """Return the open columnar file.
+
+    The file is a singleton, opened the first time it is used.
+    """
+    global __columns
+    if __columns is None:
+        __columns = _open()
+    return __columns
+
+def close():
+    """Forgets the open columns, so they are opened again when next used."""
+    global __columns
+    __columns = None
+
+def refresh() -> bool:
+    """Closes the columns if the logfile or the journal has changed,
+    so they are opened again with the changes when next used.
+
+    Returns whether they were closed.
+    """
+    if __columns is not None and __columns["stat"] != (_log_stat(), db._journal_stat()):
+        close()
+        return True
+    return False
+
+def rows() -> int:
+    """Return the number of logs."""
+    return sum(len(part["id"]) for part in columns()["parts"])
+
+# --- Queries --- #
+def _bincount(parts: list[Any]) -> list[int]:
+    """Counts how many times each value appears in the columns, indexed by the value."""
+    parts = [c for c in parts if len(c)]
+    if np is not None:
+        size = max((int(c.max()) + 1 for c in parts), default=0)
+        return sum((np.bincount(c, minlength=size) for c in parts), np.zeros(size, np.int64)).tolist()
+    counts: Counter[int] = Counter()
+    for c in parts:
+        counts.update(c)
+    result = [0] * (max(counts, default=-1) + 1)
+    for value, n in counts.items():
+        result[value] = n
+    return result
+
+def _count(field: str) -> list[int]:
+    """Counts how many times each value appears in a column, indexed by the value."""
+    return _bincount([part[field] for part in columns()["parts"]])
+
+def _add(total: list[int], counts: list[int]) -> list[int]:
+    """Adds counts indexed by value to the total, which is extended if it is shorter."""
+    if len(total) < len(counts):
+        total, counts = counts, total
+    for value, n in enumerate(counts):
+        total[value] += n
+    return total
+
+def _count_ids(name: str, header: tuple, offset: int, start: int, stop: int) -> list[int] | None:
+    """Counts the book IDs in a range of rows of a columnar file, run in a worker process.
+
+    The worker maps the file itself so the column is never copied between processes.
+    Returns None if the file has been rebuilt since it was opened.
+    """
+    with open(name, "rb") as file:
+        if file.read(HEADER.size) != HEADER.pack(*header):
+            return None
+        mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    with mm:
+        ids = memoryview(mm)[offset + 4 * start:offset + 4 * stop].cast("I")
+        if np is not None:
+            ids = np.frombuffer(ids, dtype="I")
+        counts = _bincount([ids])
+        del ids # Releases the buffer so the map can be closed
+    return counts
+
+def reads_per_book(workers: int = 1) -> list[int]:
+    """Return the number of times every book has been checked-out, indexed by book ID.
+
+    workers: How many processes to split the rows of the file between,
+        the counts of each are added together.
+    """
+    if workers <= 1:
+        return _count("id")
+    cols = columns()
+    part, tail = cols["parts"]
+    size = max(1, -(-len(part["id"]) // workers))
+    ranges = [(i, min(i + size, len(part["id"]))) for i in range(0, len(part["id"]), size)]
+    counts = _bincount([tail["id"]])
+    if not ranges:
+        return counts
+    with ProcessPoolExecutor(len(ranges)) as pool:
+        results = pool.map(_count_ids, repeat(filename()), repeat(cols["header"]), repeat(cols["offsets"]["id"]), *zip(*ranges))
+        for (start, stop), result in zip(ranges, results):
+            # The rows of a rebuilt file are counted from the map opened here instead
+            counts = _add(counts, _bincount([part["id"][start:stop]]) if result is None else result)
+    return counts
+
+def reads_per_group() -> dict[db.GroupHash, int]:
+    """Return the number of times every group has been checked-out."""
+    counts = reads_per_book()
+    read: dict[db.GroupHash, int] = defaultdict(int)
+    for book in db.books():
+        if book["id"] < len(counts) and (n := counts[book["id"]]):
+            read[db.hash_group(book)] += n
+    return read
+
+def loans_per_member() -> dict[db.Member, int]:
+    """Return the number of times every member has checked-out a book."""
+    return {m: n for m, n in zip(columns()["members"], _count("member")) if n}
+
+def member_books(member: db.Member) -> list[int]:
+    """Return the book IDs checked-out by a member, oldest first."""
+    if (code := columns()["codes"].get(member)) is None:
+        return []
+    ids: list[int] = []
+    for part in columns()["parts"]:
+        if np is not None:
+            ids.extend(part["id"][part["member"] == code].tolist())
+        else:
+            ids.extend(i for i, m in zip(part["id"], part["member"]) if m == code)
+    return ids
+
+def _on_loan(day: int, out_by: int) -> list[int]:
+    """Return the book IDs which were checked-out on or before out_by
+    and not yet returned on the day.
+    """
+    ids: list[int] = []
+    for part in columns()["parts"]:
+        if np is not None:
+            date_in = part["date_in"]
+            ids.extend(part["id"][(part["date_out"] <= out_by) & ((date_in == 0) | (date_in > day))].tolist())
+        else:
+            ids.extend(i for i, o, n in zip(part["id"], part["date_out"], part["date_in"]) if o <= out_by and (n == 0 or n > day))
+    return ids
+
+def on_loan_at(day: date | None = None) -> list[int]:
+    """Return the book IDs on loan at the end of a day, defaults to today."""
+    d = (day or date.today()).toordinal()
+    return _on_loan(d, d)
+
+def overdue_at(day: date | None = None) -> list[int]:
+    """Return the book IDs which were overdue on a day, defaults to today."""
+    d = (day or date.today()).toordinal()
+    return _on_loan(d, d - db.OVERDUE_DAYS - 1)
+
+if __name__ == "__main__":
+    import random
+
+    # Run from the top directory so the database package can be imported
+    # Works on a copy so the columnar file is not left next to the database
+    tmp = tempfile.TemporaryDirectory()
+    db.use_copy(tmp.name, db.PATH)
+
+    def check():
+        """Compares every query against the logs."""
+        logs = db.logs()
+        assert rows() == len(logs), "Rows Failure"
+        read = Counter(db.hash_group(db.from_id(log["id"])) for log in logs)
+        assert reads_per_group() == read, "Reads per Group Failure"
+        assert reads_per_book(3) == reads_per_book(), "Parallel Reads per Book Failure"
+        assert loans_per_member() == Counter(log["member"] for log in logs), "Loans per Member Failure"
+        member = random.choice(logs)["member"]
+        assert member_books(member) == [log["id"] for log in logs if log["member"] == member], "Member Books Failure"
+        for day in (date.today(), logs[len(logs) // 2]["date_out"]):
+            on_loan = lambda log, by: log["date_out"] <= by and (not log["date_in"] or log["date_in"] > day)
+            assert sorted(on_loan_at(day)) == sorted(log["id"] for log in logs if on_loan(log, day)), "On Loan Failure"
+            cutoff = date.fromordinal(day.toordinal() - db.OVERDUE_DAYS - 1)
+            assert sorted(overdue_at(day)) == sorted(log["id"] for log in logs if on_loan(log, cutoff)), "Overdue Failure"
+
+    print("Vectorised with numpy:", np is not None)
+    print("Build:")
+    assert not os.path.exists(filename())
+    check()
+    assert _header(filename())[1] == len(db.logs()), "Build Failure"
+    print("Passed")
+    print("Journal:")
+    lent = [b for b in db.books() if b["member"]][:2]
+    stock = [b for b in db.books() if not b["member"]][:2]
+    db.transaction([(b["id"], "COLS") for b in stock], [b["id"] for b in lent])
+    assert refresh() and not refresh(), "Refresh Failure"
+    assert len(columns()["parts"][1]["id"]) == 2, "Journal Tail Failure"
+    check()
+    print("Passed")
+    print("Checkpoint:")
+    db.checkpoint()
+    assert extend() and _header(filename())[2:4] == _log_stat(), "Extend Failure"
+    refresh()
+    assert len(columns()["parts"][1]["id"]) == 0, "Checkpoint Extend Failure"
+    check()
+    with open(db.LOG_FILE, "rb") as f:
+        saved = f.read()
+    db._write(db.LOG_FILE, db.str_log, db.FIELD_NAMES_LOG, db.logs()[1:])
+    assert not extend(), "Extended with other logs"
+    db._write(db.LOG_FILE, db.str_log, db.FIELD_NAMES_LOG, db.logs()[:-1])
+    assert not extend(), "Extended with fewer logs"
+    with open(db.LOG_FILE, "wb") as f:
+        f.write(saved)
+    close()
+    check()
+    print("Passed")
+    tmp.cleanup()
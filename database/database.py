@@ -5,17 +5,31 @@ being cached.
 """
 
 import csv
+import io
 import os
+import shutil
 import string
 import sys
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
 from datetime import date, datetime
-from typing import Callable, Generator, Iterable, TypeAlias, TypeVar
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Callable, Generator, Iterable, Iterator, TextIO, TypeAlias, TypeVar
 
 # Computes the exact path of the entry point file e.g. menu.py directory
 PATH = (os.path.dirname(os.path.abspath(sys.argv[0]))+"/").replace("\\", "/")
 
 DB_FILE = f"{PATH}database/database.txt"
 LOG_FILE = f"{PATH}database/logfile.txt"
+JOURNAL_FILE = f"{PATH}database/journal.txt"
+LOCK_FILE = f"{PATH}database/database.lock"
+GROUP_FILE = f"{PATH}database/groups.txt"
+
+# Number of records in the journal before a checkpoint rewrites the files
+JOURNAL_LIMIT = 1024
+# Number of csv rows converted at once when reading a file
+CHUNK = 1 << 16
 
 #Field names: keys required in a dict for it to be a part of that 'type'
 FIELD_NAMES_BOOK = ("id", "title", "author", "genre", "purchase", "member")
@@ -25,12 +39,14 @@ FIELD_VISUAL_GROUP = ("title", "author")
 FIELD_NAMES_LOG = ("id", "member", "date_out", "date_in")
 
 DATE_FMT = "%d/%m/%Y"
+OVERDUE_DAYS = 60 # A book on loan for longer than this is overdue
 
 # Type Aliases for type hints to make them readable
 Member: TypeAlias = str # so a Member type, is just a string
 Book: TypeAlias = dict[str, int | str | tuple[str, ...] | Member]
 Group: TypeAlias = dict[str, str | tuple[str, ...]]
-GroupHash: TypeAlias = int
+GroupHash: TypeAlias = int # Stable ID of a group, the same in every process
+GenreID: TypeAlias = int # Position of a genre in the vocabulary
 Log: TypeAlias = dict[str, int | Member | date]
 
 T = TypeVar("T", Book, Log)
@@ -48,6 +64,45 @@ def _make_log_from_csv(book: str, member: str, do: str, di: str) -> Log:
     """Creates a Log type from the string data in a csv row."""
     return make_log(int(book), member, datetime.strptime(do, DATE_FMT).date(), datetime.strptime(di, DATE_FMT).date() if di else None)
 
+
+@lru_cache(maxsize=1 << 16)
+def _date(s: str) -> date | str:
+    """Parses a date from a csv row, an empty string stays empty.
+
+    Cached as the same days appear in many rows.
+    """
+    return datetime.strptime(s, DATE_FMT).date() if s else ""
+@lru_cache(maxsize=1 << 16)
+def _genre(s: str) -> tuple[str, ...]:
+    """Splits the genres from a csv row, so every copy of a book shares the same tuple."""
+    return tuple(sys.intern(g) for g in s.split(";"))
+@lru_cache(maxsize=1 << 16)
+def _member(s: str) -> Member:
+    """Uppercases and interns a member from a csv row."""
+    return sys.intern(s.upper())
+
+def _make_books_from_csv(rows: list[list[str]]) -> list[Book]:
+    """Creates Books from a chunk of csv rows.
+
+    Each column is converted at once and repeated strings are interned,
+    rather than building every Book one row at a time.
+    """
+    ids, titles, authors, genres, purchases, members = zip(*rows, strict=True)
+    return [{"id": i, "title": t, "author": a, "genre": g, "purchase": p, "member": m} for i, t, a, g, p, m in zip(
+        map(int, ids), map(sys.intern, titles), map(sys.intern, authors),
+        map(_genre, genres), map(sys.intern, purchases), map(sys.intern, members),
+    )]
+def _make_logs_from_csv(rows: list[list[str]]) -> list[Log]:
+    """Creates Logs from a chunk of csv rows.
+
+    Each column is converted at once, members and dates are
+    shared between the rows rather than parsed for each one.
+    """
+    ids, members, date_outs, date_ins = zip(*rows, strict=True)
+    return [{"id": i, "member": m, "date_out": o, "date_in": n} for i, m, o, n in zip(
+        map(int, ids), map(_member, members), map(_date, date_outs), map(_date, date_ins),
+    )]
+
 def make_group(title: str, author: str, genre: tuple[str, ...]) -> Group:
     """Creates a Group type from the fields required."""
     return dict(zip(FIELD_NAMES_GROUP, (title, author, genre)))
@@ -67,28 +122,185 @@ def str_log(log: Log) -> Iterable[str]:
         l[k] = v.strftime(DATE_FMT) if (v := log[k]) else ""
     return map(str, (l[i] for i in FIELD_NAMES_LOG))
 
-def _read(filename: str, make_func: Callable[..., T]) -> Generator[T, None, None]:
-    """Wrapper around csv reader to strip first header line and make each row into type T.
+def _chunks(file: TextIO, make_func: Callable[[list[list[str]]], list[T]]) -> Generator[list[T], None, None]:
+    """Wrapper around csv reader to strip first header line and make the rows into type T.
+
+    The rows are converted CHUNK at a time.
+    make_func: A function to convert a list of rows into a list of type T
+    """
+    it = csv.reader(file)
+    next(it, None) # Skip the first line as it's just headers
+    while rows := list(islice(it, CHUNK)):
+        yield make_func(rows)
+
+def _read(filename: str, make_func: Callable[[list[list[str]]], list[T]]) -> list[T]:
+    """Reads every row of a csv file into a list of type T.
 
-    make_func: A function to convert the row into a type T
+    make_func: A function to convert a list of rows into a list of type T
     """
-    with open(filename, encoding="utf8") as file:
-        it = csv.reader(file)
-        next(it) # Skip the first line as it's just headers
-        yield from map(lambda i: make_func(*i), it)
+    items: list[T] = []
+    with open(filename, encoding="utf8", newline="") as file:
+        for chunk in _chunks(file, make_func):
+            items.extend(chunk)
+    return items
 
 def _write(filename: str, str_func: Callable[[T], Iterable[str]], fieldnames: Iterable[str], it: Iterable[T]):
     """Wrapper around csv write to add the header lines and repopulate the file with rows.
 
+    The rows are written to a temporary file which then replaces the original,
+    so a crash part way through never leaves a truncated file.
+
     str_func: A function to convert type T into a csv row.
     fieldnames: To be inserted at the top of the file.
     it: An iterable of data of type T that will be written to the file.
     """
-    with open(filename, "w", newline="", encoding="utf8") as file:
+    tmp = f"{filename}.tmp"
+    with open(tmp, "w", newline="", encoding="utf8") as file:
         csvw = csv.writer(file)
         csvw.writerow(map(str.title, fieldnames))
         for r in it:
             csvw.writerow(str_func(r))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, filename)
+
+def _read_journal(filename: str | None = None, start: int = 0) -> tuple[list[list[str]], int]:
+    """Return every record in the journal from complete commits
+    and the position in bytes of the end of those commits.
+
+    A commit is only complete once its "C" record has been written,
+    anything after the last one is from a crash part way through a commit.
+    start: The position in bytes to start reading from.
+    """
+    try:
+        with open(filename or JOURNAL_FILE, "rb") as file:
+            file.seek(start)
+            data = file.read()
+    except FileNotFoundError:
+        return [], start
+    pos = start
+    def lines() -> Iterator[str]:
+        """Decodes the complete lines, counting the bytes read by the csv reader."""
+        nonlocal pos
+        for line in io.BytesIO(data):
+            if not line.endswith(b"\n"):
+                return # Torn write
+            pos += len(line)
+            yield line.decode("utf8")
+
+    records: list[list[str]] = []
+    batch: list[list[str]] = []
+    size = start
+    # A quoted field can span lines, so a single reader parses all of them
+    for row in csv.reader(lines()):
+        if row == ["C"]:
+            records.extend(batch)
+            batch = []
+            size = pos
+        else:
+            batch.append(row)
+    return records, size
+
+def _journal(rows: Iterable[Iterable[str]], filename: str | None = None) -> int:
+    """Appends the records to the journal followed by a commit record.
+
+    The journal is flushed to the disk before returning.
+    Returns the size of the journal.
+    """
+    with open(filename or JOURNAL_FILE, "a", newline="", encoding="utf8") as file:
+        csvw = csv.writer(file, lineterminator="\n")
+        csvw.writerows(rows)
+        csvw.writerow(("C",))
+        file.flush()
+        os.fsync(file.fileno())
+        return file.tell()
+
+def _generation(filename: str | None = None) -> int:
+    """Return the generation of the journal from its first record.
+
+    Every checkpoint starts a new journal with the next generation.
+    """
+    try:
+        with open(filename or JOURNAL_FILE, encoding="utf8") as file:
+            record = next(csv.reader((file.readline(),)), [])
+    except FileNotFoundError:
+        return 0
+    return int(record[1]) if record[:1] == ["G"] else 0
+
+def _journal_stat() -> tuple[int, int, int] | None:
+    """Return the inode, size and modification time of the journal.
+
+    Any commit or checkpoint by another process changes this.
+    """
+    try:
+        st = os.stat(JOURNAL_FILE)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+# How much of the journal has been loaded
+__journal_gen: int = 0
+__journal_pos: int | None = None
+__journal_stat: tuple[int, int, int] | None = None
+
+def _recover() -> list[list[str]]:
+    """Return the records in the journal since the last checkpoint.
+
+    Removes a torn commit from the end of the journal,
+    otherwise the next commit would be appended to the broken record.
+    Must be called with the lock held.
+    """
+    global __journal_gen, __journal_pos, __journal_stat, __journalled
+    records, size = _read_journal()
+    try:
+        if os.path.getsize(JOURNAL_FILE) != size:
+            os.truncate(JOURNAL_FILE, size)
+    except FileNotFoundError:    pass
+    if __journal_pos is None:
+        __journal_gen, __journal_pos, __journal_stat = _generation(), size, _journal_stat()
+        __journalled = len(records)
+    return records
+
+try:
+    import fcntl
+    def _lock_file(file):
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+    def _unlock_file(file):
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+except ImportError: # Windows
+    import msvcrt
+    def _lock_file(file):
+        file.seek(0)
+        while True:
+            try:
+                return msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+            except OSError:    pass # Gives up after 10 seconds, so try again
+    def _unlock_file(file):
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+__lock_file = None
+__lock_depth = 0
+@contextmanager
+def lock():
+    """Holds the advisory lock over the database files.
+
+    Processes sharing the database wait for each other
+    before reading or writing the journal.
+    Locking again inside the same process does not wait.
+    """
+    global __lock_file, __lock_depth
+    if __lock_depth == 0:
+        __lock_file = open(LOCK_FILE, "a+b")
+        _lock_file(__lock_file)
+    __lock_depth += 1
+    try:
+        yield
+    finally:
+        __lock_depth -= 1
+        if __lock_depth == 0:
+            _unlock_file(__lock_file)
+            __lock_file.close()
 
 __books: list[Book] | None = None
 def books() -> list[Book]:
@@ -99,11 +311,60 @@ def books() -> list[Book]:
     global __books
     # global so it conforms with singleton pattern
     if __books is None:
-        __books = list(_read(DB_FILE, _make_book_from_csv))
+        with lock():
+            __books = _read(DB_FILE, _make_books_from_csv)
+            # Replay the changes made since the last checkpoint
+            index = {book["id"]: i for i, book in enumerate(__books)}
+            removed: set[int] = set()
+            for record in _recover():
+                if record[0] == "B":
+                    book = _make_book_from_csv(*record[1:])
+                    removed.discard(book["id"])
+                    if (i := index.get(book["id"])) is None:
+                        index[book["id"]] = len(__books)
+                        __books.append(book)
+                    else:
+                        __books[i] = book
+                elif record[0] == "D":
+                    removed.add(int(record[1]))
+            if removed:
+                __books = [book for book in __books if book["id"] not in removed]
+            _register_groups(__books)
     return __books
 
-def save():
-    """Writes the books back to the database"""
+def iter_books() -> Iterator[Book]:
+    """Iterates over every book without loading them all.
+
+    For tools which only need a single pass over the catalogue,
+    only CHUNK rows are in memory at once however long the catalogue is.
+    Uses the books if they are already loaded.
+    """
+    if __books is not None:
+        yield from __books
+        return
+    # The catalogue and the journal are opened together so they match
+    with lock():
+        file = open(DB_FILE, encoding="utf8", newline="")
+        changed: dict[int, Book | None] = {} # None if it was removed
+        for r in _read_journal()[0]:
+            if r[0] == "B":
+                changed[int(r[1])] = _make_book_from_csv(*r[1:])
+            elif r[0] == "D":
+                changed[int(r[1])] = None
+    with file:
+        for chunk in _chunks(file, _make_books_from_csv):
+            for book in chunk:
+                if book["id"] in changed and (book := changed.pop(book["id"])) is None:
+                    continue
+                yield book
+    # Books added since the last checkpoint
+    yield from (book for book in changed.values() if book is not None)
+
+def _save():
+    """Writes the books back to the database.
+
+    Only by a checkpoint with the lock held, which then starts a new journal.
+    """
     _write(DB_FILE, str_book, FIELD_NAMES_BOOK, books())
 
 __log: list[Log] | None = None
@@ -115,19 +376,539 @@ def logs() -> list[Log]:
     global __log
     # global so it conforms with singleton pattern
     if __log is None:
-        __log = list(_read(LOG_FILE, _make_log_from_csv))
+        with lock():
+            __log = _read(LOG_FILE, _make_logs_from_csv)
+            # Replay the changes made since the last checkpoint
+            for record in _recover():
+                if record[0] == "L":
+                    i, log = int(record[1]), _make_log_from_csv(*record[2:])
+                    if i < len(__log):
+                        __log[i] = log
+                    elif i == len(__log):
+                        __log.append(log)
     return __log
 
-def checkout():
-    """Writes the logs back to the logfile"""
+def iter_logs() -> Iterator[Log]:
+    """Iterates over every log without loading them all.
+
+    For tools which only need a single pass over the logs,
+    only CHUNK rows are in memory at once however long the logfile is.
+    Uses the logs if they are already loaded.
+    """
+    if __log is not None:
+        yield from __log
+        return
+    # The logfile and the journal are opened together so they match
+    with lock():
+        file = open(LOG_FILE, encoding="utf8", newline="")
+        changed = {int(r[1]): _make_log_from_csv(*r[2:]) for r in _read_journal()[0] if r[0] == "L"}
+    pos = 0
+    with file:
+        for chunk in _chunks(file, _make_logs_from_csv):
+            for i in [i for i in changed if pos <= i < pos + len(chunk)]:
+                chunk[i - pos] = changed.pop(i)
+            pos += len(chunk)
+            yield from chunk
+    # Logs added since the last checkpoint
+    while pos in changed:
+        yield changed.pop(pos)
+        pos += 1
+
+def _checkout():
+    """Writes the logs back to the logfile.
+
+    Only by a checkpoint with the lock held, which then starts a new journal.
+    """
     _write(LOG_FILE, str_log, FIELD_NAMES_LOG, logs())
 
+__log_index: dict[int, int] | None = None
+def _log_index() -> dict[int, int]:
+    """Return a map of book IDs to the position of their latest log.
+
+    The map is cached
+    so finding the log of a book does not scan every log."""
+    global __log_index
+    if __log_index is None:
+        __log_index = {log["id"]: i for i, log in enumerate(logs())}
+    return __log_index
+
+def latest_log(id: int) -> Log:
+    """Returns the most recent log of a book ID.
+
+    Raises KeyError if the book has never been checked-out.
+    """
+    return logs()[_log_index()[id]]
+
+# Changes which have not been written to the journal yet
+__changed_books: dict[int, Book] = {}
+__changed_logs: set[int] = set()
+__new_logs: list[Log] = []
+__removed_books: dict[int, Book] = {}
+__journalled: int = 0
+
+def append_log(log: Log) -> Log:
+    """Adds a new log to the end of the logs.
+
+    Keeps the log index and the members up to date.
+    """
+    logs().append(log)
+    _log_index()[log["id"]] = len(logs()) - 1
+    _add_member(log["member"])
+    __changed_logs.add(len(logs()) - 1)
+    __new_logs.append(log)
+    return log
+
+def lend_book(book: Book, member: Member, day: date | None = None) -> Log:
+    """Puts the book on loan to the member and logs it.
+
+    day: The checkout date, defaults to today.
+    """
+    book["member"] = member
+    __changed_books[book["id"]] = book
+    _touch(book["id"])
+    log = append_log(make_log(book["id"], member, day or date.today(), None))
+    _sync_loan(book)
+    return log
+
+def return_book(book: Book, day: date | None = None) -> Log:
+    """Takes the book back from its member and closes its log.
+
+    day: The return date, defaults to today.
+    """
+    log = latest_log(book["id"])
+    log["date_in"] = day or date.today()
+    book["member"] = ""
+    __changed_books[book["id"]] = book
+    _touch(book["id"])
+    __changed_logs.add(_log_index()[book["id"]])
+    _sync_loan(book)
+    return log
+
+__next_id: int | None = None
+def _next_id() -> int:
+    """Return the ID for a new book.
+
+    It is after every book and every log,
+    so the logs of a removed book are never given to a new book.
+    """
+    global __next_id
+    if __next_id is None:
+        __next_id = max(max(_book_index(), default=-1), max(_log_index(), default=-1)) + 1
+    return __next_id
+
+def _put_book(book: Book) -> Book:
+    """Adds a new book, or updates the loaded book with the same ID in place.
+
+    Keeps the ID index and the groups up to date.
+    The group of the book must have been registered first.
+    Returns the loaded book.
+    """
+    global __next_id
+    index = _book_index()
+    if (b := index.get(book["id"])) is None:
+        index[book["id"]] = b = book
+        books().append(book)
+        _group_add(book)
+        if __next_id is not None and book["id"] >= __next_id:
+            __next_id = book["id"] + 1
+        _resize_ids()
+        _touch_catalogue()
+    else:
+        moved = (b["title"], b["author"]) != (book["title"], book["author"])
+        if moved:
+            _group_remove(b)
+        b.update(book)
+        if moved:
+            _group_add(b)
+            _touch_catalogue()
+        elif __groups is not None:
+            __groups[hash_group(b)]["genre"] = b["genre"]
+    _sync_loan(b)
+    _touch(b["id"])
+    return b
+
+def _drop_book(id: int) -> Book | None:
+    """Removes a book from the loaded books, keeping the ID index and the groups up to date.
+
+    Returns the removed book, None if it was not loaded.
+    """
+    if (book := _book_index().pop(id, None)) is not None:
+        bs = books()
+        del bs[next(i for i, b in enumerate(bs) if b is book)]
+        _group_remove(book)
+        _unloan(id)
+        _touch(id)
+        _resize_ids()
+        _touch_catalogue()
+    return book
+
+def check_book(book: Book):
+    """Raises ValueError if the book can not be written to the database."""
+    if not book["title"] or not book["author"]:
+        raise ValueError("A book must have a title and an author")
+    if any(c in field for field in (book["title"], book["author"], *book["genre"]) for c in "\r\n"):
+        raise ValueError("A book can not have a line break in its fields")
+    if not book["genre"] or any(not g or ";" in g for g in book["genre"]):
+        raise ValueError("A book must have genres which are not empty and do not contain ';'")
+    datetime.strptime(book["purchase"], DATE_FMT)
+
+def add_book(title: str, author: str, genre: Iterable[str], purchase: str | None = None) -> Book:
+    """Adds a new copy of a book to the catalogue with the next ID and commits it.
+
+    purchase: The purchase date, defaults to today.
+    Raises ValueError if any of the fields are invalid.
+    """
+    book = make_book(-1, title, author, tuple(genre), purchase or date.today().strftime(DATE_FMT), "")
+    check_book(book)
+    with lock():
+        refresh()
+        book["id"] = _next_id()
+        book["genre"] = _genre(";".join(book["genre"]))
+        _register_groups((book,))
+        _put_book(book)
+        __changed_books[book["id"]] = book
+        commit()
+    return book
+
+def add_books(new: Iterable[Book]) -> list[Book]:
+    """Adds new copies of many books to the catalogue with the next IDs and commits them together.
+
+    Their IDs are assigned and any member is ignored.
+    The books are appended to the journal without a checkpoint however many there are,
+    so a large batch does not rewrite the files, the next commit after it does.
+    Raises ValueError if any of the fields of a book are invalid, then none are added.
+    """
+    new = [book | {"member": ""} for book in new]
+    for book in new:
+        book["genre"] = tuple(book["genre"])
+        check_book(book)
+    with lock():
+        refresh()
+        # Every new group is added to the group file at once
+        _register_groups(new)
+        for book in new:
+            book["id"] = _next_id()
+            book["genre"] = _genre(";".join(book["genre"]))
+            _put_book(book)
+            __changed_books[book["id"]] = book
+        commit(rewrite=False)
+    return new
+
+def update_book(id: int, **fields: Any) -> Book:
+    """Changes the title, author, genre or purchase date of a book and commits it.
+
+    Raises KeyError if the ID does not exist
+    and ValueError if the fields can not be changed.
+    """
+    if bad := set(fields).difference(("title", "author", "genre", "purchase")):
+        raise ValueError(f"Can not update the {', '.join(sorted(bad))} of a book")
+    with lock():
+        refresh()
+        book = from_id(id) | fields
+        book["genre"] = tuple(book["genre"])
+        check_book(book)
+        book["genre"] = _genre(";".join(book["genre"]))
+        _register_groups((book,))
+        book = _put_book(book)
+        __changed_books[id] = book
+        commit()
+    return book
+
+def remove_book(id: int) -> Book:
+    """Removes a book from the catalogue and commits it.
+
+    Its logs are kept, so the history of the library does not change.
+    Raises KeyError if the ID does not exist
+    and ValueError if the book is checked-out.
+    """
+    with lock():
+        refresh()
+        book = from_id(id)
+        if book["member"]:
+            raise ValueError(f"Book {fmt_id(id)} is checked-out")
+        _drop_book(id)
+        __changed_books.pop(id, None)
+        __removed_books[id] = book
+        commit()
+    return book
+
+# Callbacks to execute after changes have been written to the files
+commit_callbacks: list[Callable[[list[Book], list[Log] | None], Any]] = []
+def on_commit(func: Callable[[list[Book], list[Log] | None], Any]):
+    """Append function to callbacks such that it will be executed
+    with the changed books and the new logs after every commit.
+
+    When everything had to be loaded again, the new logs are None.
+    """
+    commit_callbacks.append(func)
+
+def commit(rewrite: bool = True):
+    """Writes the changes since the last commit to the journal
+    and then executes all the commit callbacks.
+
+    Only the changed books and logs are written, the files are
+    rewritten by a checkpoint once the journal is large enough.
+    Changes by other processes are loaded first.
+    The removed books are passed to the callbacks with the changed books.
+    rewrite: Whether a checkpoint may be made, otherwise the journal is only appended to.
+    """
+    global __changed_books, __changed_logs, __new_logs, __removed_books, __journalled, __journal_pos, __journal_stat
+    with lock():
+        refresh()
+        changed, new = list(__changed_books.values()), __new_logs
+        rows = [("B", *str_book(book)) for book in changed]
+        rows.extend(("L", str(i), *str_log(logs()[i])) for i in sorted(__changed_logs))
+        rows.extend(("D", str(id)) for id in __removed_books)
+        changed.extend(__removed_books.values())
+        __changed_books, __changed_logs, __new_logs, __removed_books = {}, set(), [], {}
+        if rows:
+            __journal_pos = _journal(rows)
+            __journal_stat = _journal_stat()
+            __journalled += len(rows)
+            if rewrite and __journalled >= JOURNAL_LIMIT:
+                checkpoint()
+    for cb in commit_callbacks:
+        cb(changed, new)
+
+def checkpoint():
+    """Rewrites the books and logs files and starts a new journal.
+
+    The previous journal is kept, so other processes
+    can still read the records they have not loaded yet.
+    """
+    global __journal_gen, __journal_pos, __journal_stat, __journalled
+    with lock():
+        refresh()
+        _save()
+        _checkout()
+        tmp = f"{JOURNAL_FILE}.tmp"
+        open(tmp, "w").close()
+        size = _journal((("G", str(__journal_gen + 1)),), tmp)
+        if os.path.exists(JOURNAL_FILE):
+            os.replace(JOURNAL_FILE, f"{JOURNAL_FILE}.old")
+        os.replace(tmp, JOURNAL_FILE)
+        __journal_gen, __journal_pos, __journal_stat = __journal_gen + 1, size, _journal_stat()
+        __journalled = 0
+
+def _apply(records: Iterable[list[str]]) -> tuple[list[Book], list[Log]]:
+    """Applies journal records to the books and logs which are loaded.
+
+    Existing books and logs are updated in place
+    so any references to them stay valid.
+    Returns the changed and removed books and the new logs.
+    """
+    changed: dict[int, Book] = {}
+    new: list[Log] = []
+    records = list(records)
+    if __books is not None:
+        _register_groups(make_group(r[2], r[3], ()) for r in records if r[0] == "B")
+    for record in records:
+        if record[0] == "B" and __books is not None:
+            b = _put_book(_make_book_from_csv(*record[1:]))
+            changed[b["id"]] = b
+        elif record[0] == "D" and __books is not None:
+            if (b := _drop_book(int(record[1]))) is not None:
+                changed[b["id"]] = b
+        elif record[0] == "L" and __log is not None:
+            i, log = int(record[1]), _make_log_from_csv(*record[2:])
+            if i < len(__log):
+                __log[i].update(log)
+            elif i == len(__log):
+                __log.append(log)
+                new.append(log)
+                if __log_index is not None:
+                    __log_index[log["id"]] = i
+                if __members is not None:
+                    _add_member(log["member"])
+    # The logs of a book are read after it, so its loan is only known once they all have been
+    for b in changed.values():
+        if b["id"] in _book_index():
+            _sync_loan(b)
+    return list(changed.values()), new
+
+def refresh() -> bool:
+    """Loads the changes committed by other processes.
+
+    Only the records added to the journal since it was last read are loaded.
+    If there has been more than one checkpoint since,
+    everything is loaded again from the files.
+    Returns whether anything changed, after executing the commit callbacks.
+    """
+    global __journal_gen, __journal_pos, __journal_stat, __journalled
+    if __journal_pos is None or _journal_stat() == __journal_stat:
+        return False
+    with lock():
+        gen = _generation()
+        if gen == __journal_gen:
+            records, pos = _read_journal(start=__journal_pos)
+            __journalled += len(records)
+        elif gen == __journal_gen + 1:
+            records, _ = _read_journal(f"{JOURNAL_FILE}.old", __journal_pos)
+            current, pos = _read_journal()
+            records += current
+            __journalled = len(current)
+        else:
+            _reset()
+            records = None
+        if records is not None:
+            __journal_gen, __journal_pos, __journal_stat = gen, pos, _journal_stat()
+    if records is None:
+        for cb in commit_callbacks:
+            cb(books(), None)
+        return True
+    changed, new = _apply(records)
+    if not (changed or new):
+        return False
+    for cb in commit_callbacks:
+        cb(changed, new)
+    return True
+
+def transaction(checkouts: Iterable[tuple[int, Member]] = (), returns: Iterable[int] = (), day: date | None = None) -> tuple[list[Log], list[Log]]:
+    """Checks-out and returns many books with a single commit.
+
+    Every operation is validated before any are applied,
+    so either all of them happen or none do.
+    Returns happen first so a book can be returned and checked-out again.
+    Raises KeyError if an ID does not exist
+    and ValueError if a book can not be checked-out or returned.
+
+    Returns:
+        The new logs of the checked-out books.
+        The closed logs of the returned books.
+    """
+    with lock():
+        refresh()
+        return _transaction(checkouts, returns, day)
+
+def _transaction(checkouts: Iterable[tuple[int, Member]], returns: Iterable[int], day: date | None) -> tuple[list[Log], list[Log]]:
+    """Validates and applies a transaction with the lock held."""
+    returns = [from_id(id) for id in returns]
+    checkouts = [(from_id(id), member) for id, member in checkouts]
+
+    returning: set[int] = set()
+    for book in returns:
+        if book["id"] in returning:
+            raise ValueError(f"Book {fmt_id(book['id'])} is returned twice")
+        if not book["member"] or latest_log(book["id"])["date_in"]:
+            raise ValueError(f"Book {fmt_id(book['id'])} is not checked-out")
+        returning.add(book["id"])
+    lending: set[int] = set()
+    for book, member in checkouts:
+        if not valid_member(member):
+            raise ValueError(f"Member {member!r} is not valid")
+        if book["id"] in lending or (book["member"] and book["id"] not in returning):
+            raise ValueError(f"Book {fmt_id(book['id'])} is already checked-out")
+        lending.add(book["id"])
+
+    closed = [return_book(book, day) for book in returns]
+    new = [lend_book(book, member, day) for book, member in checkouts]
+    commit()
+    return new, closed
+
+def _reset():
+    """Forgets every cached value and any uncommitted changes
+    so everything is loaded from the files again.
+    """
+    global __books, __log, __log_index, __book_index, __next_id, __members, __groups, __group_loans, __changed_books, __changed_logs, __new_logs, __removed_books, __journalled, __journal_pos, __journal_stat, __group_pos, __member_list, __member_suffixes, __id_width, __revision_base, __catalogue_revision
+    __books = __log = __log_index = __book_index = __next_id = __members = __member_list = __member_suffixes = __groups = __group_loans = __journal_pos = __journal_stat = __id_width = None
+    __revision_base = __catalogue_revision = _revise()
+    __revisions.clear()
+    __group_ids.clear()
+    __group_pos = 0
+    __journalled = 0
+    __changed_books, __changed_logs, __new_logs, __removed_books = {}, set(), [], {}
+
+def use(directory: str):
+    """Points the database at the files in a directory and forgets everything loaded."""
+    global DB_FILE, LOG_FILE, JOURNAL_FILE, LOCK_FILE, GROUP_FILE
+    DB_FILE = f"{directory}/database.txt"
+    LOG_FILE = f"{directory}/logfile.txt"
+    JOURNAL_FILE = f"{directory}/journal.txt"
+    LOCK_FILE = f"{directory}/database.lock"
+    GROUP_FILE = f"{directory}/groups.txt"
+    _reset()
+
+def use_copy(directory: str, source: str | None = None):
+    """Copies the books, logs and group IDs into a directory and uses the copy,
+    so the changes and any files made next to them are not left beside the originals.
+
+    source: Directory of the files to copy, defaults to those in use.
+    """
+    files = {"database.txt": DB_FILE, "logfile.txt": LOG_FILE, "groups.txt": GROUP_FILE}
+    for name, file in files.items():
+        file = os.path.join(source, name) if source else file
+        if name != "groups.txt" or os.path.exists(file):
+            shutil.copy(file, f"{directory}/{name}")
+    use(directory)
+
+__id_width: int | None = None
 def fmt_id(id: int) -> str:
     """Format an ID with leading 0s and a hash
 
-    Uses the size of the database to work out the required number of 0s.
+    Uses the size of the database to work out the required number of 0s,
+    which is cached until a book is added or removed.
+    """
+    global __id_width
+    if __id_width is None:
+        __id_width = len(str(len(books())))
+    return f"#{id:0{__id_width}d}"
+
+def _resize_ids():
+    """Forgets the width of the IDs if the number of books now has a different number of digits.
+
+    Every book is then formatted differently, so all of them are revised.
     """
-    return f"#{id:0{len(str(len(books())))}d}"
+    global __id_width, __revision_base
+    if __id_width is not None and len(str(len(books()))) != __id_width:
+        __id_width = None
+        __revision_base = _revise()
+
+# Revisions of the books, so anything made from a book can tell when it has to be made again
+__revision: int = 0 # Goes up with every change to a book
+__revision_base: int = 0 # Revision of every book which has not changed since everything was loaded
+__revisions: dict[int, int] = {}
+def _revise() -> int:
+    """Return the next revision."""
+    global __revision
+    __revision += 1
+    return __revision
+
+def _touch(id: int):
+    """Gives a book the next revision after it is lent, returned, changed or removed."""
+    __revisions[id] = _revise()
+
+__catalogue_revision: int = 0 # Revision of the last book added, removed or retitled
+def _touch_catalogue():
+    """Revises the catalogue after a book is added, removed or has a new title or author."""
+    global __catalogue_revision
+    __catalogue_revision = _revise()
+
+def catalogue_revision() -> int:
+    """Return the revision of the catalogue,
+    which only goes up when what a search of the books or groups finds may have changed.
+    """
+    return __catalogue_revision
+
+def revision() -> int:
+    """Return the revision of the database, which goes up whenever a book changes."""
+    return __revision
+
+def book_revision(id: int) -> int:
+    """Return the revision of a book, which goes up whenever the book changes,
+    or everything is loaded again.
+    """
+    return max(__revisions.get(id, 0), __revision_base)
+
+__book_index: dict[int, Book] | None = None
+def _book_index() -> dict[int, Book]:
+    """Return a map of book IDs to the books.
+
+    The map is cached and kept up to date as books are added and removed.
+    """
+    global __book_index
+    if __book_index is None:
+        __book_index = {book["id"]: book for book in books()}
+    return __book_index
 
 def from_id(id: int) -> Book:
     """Returns book object from a book ID.
@@ -136,14 +917,9 @@ def from_id(id: int) -> Book:
     Raises KeyError if the ID is not in the database.
     """
     try:
-        book = books()[id]
-        if book["id"] == id:
-            return book
-    except IndexError:    pass
-    for book in books():
-        if book["id"] == id:
-            return book
-    raise KeyError("ID does not exist")
+        return _book_index()[id]
+    except KeyError:
+        raise KeyError("ID does not exist") from None
 
 def valid_member(member: Member) -> bool:
     """Checks if a member is a valid format.
@@ -164,36 +940,284 @@ def members() -> set[Member]:
         __members = {log["member"] for log in logs()}
     return __members
 
+# The members in order, and every suffix after the first character of each with its member in order,
+# so the members containing a term are next to each other, as those starting with it are
+__member_list: list[Member] | None = None
+__member_suffixes: list[tuple[str, Member]] | None = None
+def _member_index() -> tuple[list[Member], list[tuple[str, Member]]]:
+    """Return the sorted members and their sorted suffixes, built the first time they are used."""
+    global __member_list, __member_suffixes
+    if __member_list is None or __member_suffixes is None:
+        __member_list = sorted(members())
+        __member_suffixes = sorted((m[i:], m) for m in __member_list for i in range(1, len(m)))
+    return __member_list, __member_suffixes
+
+def _add_member(member: Member):
+    """Adds a member if they are new, keeping the member index in order."""
+    if member in members():
+        return
+    members().add(member)
+    if __member_list is not None and __member_suffixes is not None:
+        insort(__member_list, member)
+        for i in range(1, len(member)):
+            insort(__member_suffixes, (member[i:], member))
+
+def find_members(term: str, limit: int | None = None) -> list[Member]:
+    """Return the members starting with the term in order,
+    then those containing it elsewhere, in order of what follows the term.
+
+    Each is found with a binary search of the member index,
+    so only the members returned are looked at.
+    limit: The most members to return.
+    """
+    ordered, suffixes = _member_index()
+    limit = len(ordered) if limit is None else limit
+    found: dict[Member, None] = {}
+    i = bisect_left(ordered, term)
+    while i < len(ordered) and len(found) < limit and ordered[i].startswith(term):
+        found[ordered[i]] = None
+        i += 1
+    i = bisect_left(suffixes, (term,))
+    while i < len(suffixes) and len(found) < limit and suffixes[i][0].startswith(term):
+        found[suffixes[i][1]] = None
+        i += 1
+    return list(found)
+
+# Stable IDs of the groups, which are kept in the group file
+# so every process and every run gives a group the same ID
+__group_ids: dict[tuple[str, str], GroupHash] = {}
+__group_pos: int = 0 # How much of the group file has been read
+
+def _read_groups():
+    """Loads the group IDs added to the group file since it was last read.
+
+    Must be called with the lock held.
+    """
+    global __group_pos
+    try:
+        with open(GROUP_FILE, "rb") as file:
+            file.seek(__group_pos)
+            data = file.read()
+    except FileNotFoundError:
+        return
+    for line in data.splitlines(keepends=True):
+        if not line.endswith(b"\n"):
+            break # Torn write
+        if __group_pos:
+            id, title, author = next(csv.reader((line.decode("utf8"),)))
+            __group_ids[(title, author)] = int(id)
+        __group_pos += len(line)
+
+def _register_groups(items: Iterable[Book | Group]):
+    """Gives every new group the next ID, appending them to the group file.
+
+    Other processes may have given them an ID already,
+    so the file is read again under the lock before any are added.
+    """
+    new = {key: None for item in items if (key := (item["title"], item["author"])) not in __group_ids}
+    if not new:
+        return
+    with lock():
+        _read_groups()
+        rows = []
+        for key in new:
+            if key not in __group_ids:
+                __group_ids[key] = len(__group_ids)
+                rows.append((__group_ids[key], *key))
+        if rows:
+            global __group_pos
+            with open(GROUP_FILE, "a", newline="", encoding="utf8") as file:
+                csvw = csv.writer(file, lineterminator="\n")
+                if file.tell() == 0:
+                    csvw.writerow(("Id", "Title", "Author"))
+                csvw.writerows(rows)
+                file.flush()
+                os.fsync(file.fileno())
+                __group_pos = file.tell()
+
 def hash_group(group: Group | Book) -> GroupHash:
-    """A hash function for groups.
+    """Return the ID of a group.
 
     Can hash the books as a group is just a book with less detail.
+    The IDs are dense, so they can index an array.
+    Raises KeyError for a group which has never had any books.
     """
-    return hash((group["title"], group["author"]))
+    return __group_ids[(group["title"], group["author"])]
+
+def group_count() -> int:
+    """Return the number of group IDs, the length of an array indexed by GroupHash."""
+    books()
+    return len(__group_ids)
 
 __groups: dict[GroupHash, Group] | None = None
+__group_list: list[Group] = [] # In title order
+__group_titles: list[str] = [] # Title of each group in the list, to bisect
+__group_books: dict[GroupHash, list[Book]] = {} # Copies of each group in ID order
 def group_table() -> dict[GroupHash, Group]:
     """Return a map of GroupHashes to Groups.
 
     The result is cached as to not need to traverse over
-    the entire database every time.
+    the entire database every time, and is kept up to date
+    as books are added, changed and removed.
     """
-    global __groups
+    global __groups, __group_list, __group_titles, __group_books
     if __groups is None:
-        gs = list({hash_group(g := make_group_book(book)) : g for book in books()}.values())
-        gs.sort(key=lambda g: g["title"])
-        __groups = {hash_group(g): g for g in gs}
+        table: dict[GroupHash, Group] = {}
+        copies: dict[GroupHash, list[Book]] = {}
+        for book in sorted(books(), key=lambda b: b["id"]):
+            gh = hash_group(book)
+            table[gh] = make_group_book(book)
+            copies.setdefault(gh, []).append(book)
+        __group_list = sorted(table.values(), key=lambda g: g["title"])
+        __group_titles = [g["title"] for g in __group_list]
+        __group_books = copies
+        __groups = {hash_group(g): g for g in __group_list}
     return __groups
 
-def groups() -> Iterable[Group]:
-    """Returns an Iterable of every group."""
-    return group_table().values()
+def groups() -> list[Group]:
+    """Returns every group in title order."""
+    group_table()
+    return __group_list
+
+def group_books(group: Group | Book) -> list[Book]:
+    """Return every copy of a group in ID order."""
+    group_table()
+    try:
+        return __group_books.get(hash_group(group), [])
+    except KeyError:
+        return []
+
+def _group_add(book: Book):
+    """Adds a copy of a book to its group, adding the group in title order if it is new."""
+    if __groups is None:
+        return
+    gh = hash_group(book)
+    insort(__group_books.setdefault(gh, []), book, key=lambda b: b["id"])
+    if (group := __groups.get(gh)) is None:
+        group = __groups[gh] = make_group_book(book)
+        i = bisect_right(__group_titles, group["title"])
+        __group_titles.insert(i, group["title"])
+        __group_list.insert(i, group)
+    else:
+        group["genre"] = book["genre"]
+
+def _group_remove(book: Book):
+    """Removes a copy of a book from its group, removing the group once it has no copies."""
+    if __groups is None:
+        return
+    gh = hash_group(book)
+    copies = __group_books[gh]
+    del copies[next(i for i, b in enumerate(copies) if b is book)]
+    if not copies:
+        del __group_books[gh]
+        group = __groups.pop(gh)
+        i = bisect_left(__group_titles, group["title"])
+        while __group_list[i] is not group:
+            i += 1
+        del __group_titles[i], __group_list[i]
+
+__group_loans: dict[GroupHash, list[int]] | None = None # Checkout dates of the copies on loan
+__loan_dates: dict[int, tuple[GroupHash, int]] = {} # Where each book on loan is in the above
+def _loans() -> dict[GroupHash, list[int]]:
+    """Return the sorted checkout dates, as day ordinals, of the copies on loan of each group.
+
+    Built from the latest logs when first used and kept up to date
+    as books are lent, returned, changed and removed.
+    """
+    global __group_loans
+    if __group_loans is None:
+        __group_loans = {}
+        __loan_dates.clear()
+        for book in books():
+            if book["member"]:
+                _sync_loan(book)
+    return __group_loans
+
+def _unloan(id: int):
+    """Removes the checkout date of a book from the loans of its group."""
+    if __group_loans is not None and (old := __loan_dates.pop(id, None)) is not None:
+        gh, day = old
+        loans = __group_loans[gh]
+        del loans[bisect_left(loans, day)]
+
+def _sync_loan(book: Book):
+    """Moves the checkout date of a book in the loans of its group
+    after it has been lent, returned or changed group.
+    """
+    if __group_loans is None:
+        return
+    _unloan(book["id"])
+    if book["member"]:
+        try:
+            log = latest_log(book["id"])
+            day = (date.today() if log["date_in"] else log["date_out"]).toordinal()
+        except KeyError:
+            day = date.today().toordinal()
+        gh = hash_group(book)
+        insort(__group_loans.setdefault(gh, []), day)
+        __loan_dates[book["id"]] = (gh, day)
+
+def availability(group: Group | Book, day: date | None = None) -> tuple[int, int, int]:
+    """Return how many copies of a group are in stock, on loan and overdue.
+
+    The overdue copies are also counted as on loan.
+    day: The day to count the overdue copies on, defaults to today.
+    """
+    if not (copies := len(group_books(group))):
+        return 0, 0, 0
+    loans = _loans().get(hash_group(group), ())
+    overdue = bisect_left(loans, (day or date.today()).toordinal() - OVERDUE_DAYS)
+    return copies - len(loans), len(loans), overdue
+
+# The genre vocabulary, which only ever grows so the IDs never change
+__genre_names: list[str] = []
+__genre_lookup: dict[str, GenreID] = {}
+__genre_ids: dict[tuple[str, ...], tuple[GenreID, ...]] = {}
+def genre_id(genre: str) -> GenreID:
+    """Return the ID of a genre, adding it to the vocabulary if it is new."""
+    if (id := __genre_lookup.get(genre)) is None:
+        id = __genre_lookup[genre] = len(__genre_names)
+        __genre_names.append(genre)
+    return id
+
+def genre_ids(item: Book | Group) -> tuple[GenreID, ...]:
+    """Return the genre IDs of a book or group.
+
+    Cached by the genre tuple, which is shared by every copy of a book.
+    """
+    genres = item["genre"]
+    if (ids := __genre_ids.get(genres)) is None:
+        ids = __genre_ids[genres] = tuple(map(genre_id, genres))
+    return ids
+
+def genre_name(id: GenreID) -> str:
+    """Return the name of a genre from its ID."""
+    return __genre_names[id]
+
+def genre_count() -> int:
+    """Return the number of genres in the vocabulary,
+    the length of an array indexed by GenreID.
+    """
+    return len(__genre_names)
+
+def genre_mask(ids: Iterable[GenreID]) -> int:
+    """Return a bitmask with the bit of every genre ID set.
+
+    A group has all of the genres in a mask if group_mask & mask == mask.
+    """
+    mask = 0
+    for id in ids:
+        mask |= 1 << id
+    return mask
 
 if __name__ == "__main__":
     import random
 
     DB_FILE = f"{PATH}database.txt"
     LOG_FILE = f"{PATH}logfile.txt"
+    JOURNAL_FILE = f"{PATH}journal.txt"
+    LOCK_FILE = f"{PATH}database.lock"
+    GROUP_FILE = f"{PATH}groups.txt"
 
     # Loads all values from the database
     print("Books:", len(books()))
@@ -201,18 +1225,184 @@ if __name__ == "__main__":
     print("Groups:", len(groups()))
     print("Members:", len(members()))
 
+    print("Find Members:")
+    m = random.choice(list(members()))
+    for term in ("", m[:1], m[1:3], m[2:], m):
+        expect = sorted(x for x in members() if term in x)
+        found = find_members(term)
+        assert sorted(found) == expect, "Find Members Failure"
+        assert found == sorted(found, key=lambda x: not x.startswith(term)), "Find Members Order Failure"
+        assert find_members(term, 3) == found[:3], "Find Members Limit Failure"
+    print("Passed")
+
     print("Hash Group & Make Group:")
     b = random.choice(books())
     assert hash_group(b) == hash_group(make_group_book(b)), "Make Group Failure"
+    assert sorted(hash_group(g) for g in groups()) == list(range(len(groups()))), "Group IDs are not dense"
+    try:
+        hash_group(make_group("No Such Title", "No Such Author", ()))
+        assert False, "Unknown Group Failure"
+    except KeyError:    pass
+    assert group_books(make_group("No Such Title", "No Such Author", ())) == [], "Unknown Group Books Failure"
     print("Passed")
     print("From ID:")
     try:    from_id(-1)
     except KeyError:    pass
     assert from_id(b["id"]) == b, "From ID Failure"
     print("Passed")
+    print("Genres:")
+    assert [genre_name(g) for g in genre_ids(b)] == list(b["genre"]), "Genre ID Failure"
+    assert genre_ids(b) is genre_ids(make_group_book(b)), "Genre ID Cache Failure"
+    assert genre_mask(genre_ids(b)) & (m := genre_mask(genre_ids(b)[:1])) == m, "Genre Mask Failure"
+    print("Passed")
+    print("Latest Log:")
+    l = random.choice(logs())
+    assert latest_log(l["id"])["id"] == l["id"], "Latest Log Failure"
+    assert latest_log(l["id"]) is [i for i in logs() if i["id"] == l["id"]][-1], "Latest Log not the most recent"
+    print("Passed")
+
+    print("Read:")
+    with open(DB_FILE, encoding="utf8") as f:
+        assert books() == [_make_book_from_csv(*r) for r in list(csv.reader(f))[1:]], "Read Books Failure"
+    with open(LOG_FILE, encoding="utf8") as f:
+        assert logs() == [_make_log_from_csv(*r) for r in list(csv.reader(f))[1:]], "Read Logs Failure"
+    print("Passed")
+    print("Availability:")
+    def check_availability():
+        """Compares the availability of every group to counting its copies."""
+        copies: dict[GroupHash, list[Book]] = {}
+        for b in books():
+            copies.setdefault(hash_group(b), []).append(b)
+        for gh, group in group_table().items():
+            bs = sorted(copies[gh], key=lambda b: b["id"])
+            assert group_books(group) == bs, "Group Books Failure"
+            out = [b for b in bs if b["member"]]
+            late = [b for b in out if (date.today() - latest_log(b["id"])["date_out"]).days > OVERDUE_DAYS]
+            assert availability(group) == (len(bs) - len(out), len(out), len(late)), "Availability Failure"
+    check_availability()
+    print("Passed")
 
-    # Saves Database
-    save()
-    checkout()
+    # Transactions are written to a temporary copy of the database
+    import tempfile
+    tmp = tempfile.TemporaryDirectory()
+    use_copy(tmp.name)
+
+    print("Transaction:")
+    out = [b for b in books() if b["member"]][:3]
+    stock = [b for b in books() if not b["member"]][:3]
+    try:
+        transaction(returns=[stock[0]["id"]])
+        assert False, "Transaction returned a book in stock"
+    except ValueError:    pass
+    try:
+        transaction(checkouts=[(b["id"], "TEST") for b in stock] + [(out[0]["id"], "TEST")])
+        assert False, "Transaction checked-out a book on loan"
+    except ValueError:    pass
+    assert not any(b["member"] for b in stock), "Failed Transaction was not atomic"
+    count, rev = len(logs()), revision()
+    new, closed = transaction([(b["id"], "TEST") for b in stock + out[:1]], [b["id"] for b in out])
+    assert all(b["member"] == "TEST" for b in stock + out[:1]), "Transaction Checkout Failure"
+    assert all(not b["member"] for b in out[1:]), "Transaction Return Failure"
+    assert all(log["date_in"] for log in closed) and len(new) == 4, "Transaction Log Failure"
+    assert latest_log(out[0]["id"]) is new[-1], "Transaction Log Index Failure"
+    assert book_revision(out[0]["id"]) == revision() and book_revision(stock[0]["id"]) > rev, "Book Revision Failure"
+    assert "TEST" in find_members("TE") and "TEST" in find_members("ES"), "Transaction Member Index Failure"
+    print("Passed")
+    print("Catalogue:")
+    gcount = len(groups())
+    added = add_book("Test Book", "Test Author", ("Fiction", "Test"))
+    assert from_id(added["id"]) is added and added["id"] == max(b["id"] for b in books()), "Add Book Failure"
+    assert group_table()[hash_group(added)] in groups() and len(groups()) == gcount + 1, "Add Book Group Failure"
+    rev = catalogue_revision()
+    update_book(added["id"], title="Test Book Renamed")
+    assert catalogue_revision() > rev, "Catalogue Revision Failure"
+    assert added["title"] == "Test Book Renamed" and len(groups()) == gcount + 1, "Update Book Failure"
+    assert [g["title"] for g in groups()] == sorted(g["title"] for g in groups()), "Groups are not in title order"
+    for bad in (lambda: update_book(added["id"], member="TEST"), lambda: add_book("", "Test", ("Fiction",)),
+            lambda: remove_book(out[0]["id"]), lambda: add_book("Line\nBreak", "Test", ("Fiction",))):
+        try:
+            bad()
+            assert False, "Invalid Catalogue Change"
+        except ValueError:    pass
+    remove_book(added["id"])
+    assert len(groups()) == gcount and hash_group(added) not in group_table(), "Remove Book Failure"
+    try:
+        from_id(added["id"])
+        assert False, "Removed Book Exists"
+    except KeyError:    pass
+    assert add_book("Test Book", "Test Author", ("Fiction",))["id"] == added["id"] + 1, "Removed ID was reused"
+    batch = [make_book(-1, b["title"], b["author"], b["genre"], b["purchase"], "") for b in (books() * 2)[:JOURNAL_LIMIT]]
+    for i, b in enumerate(batch[:3]):
+        b["title"] = f"Batch Book {i}"
+    size = os.path.getsize(DB_FILE)
+    fsync, synced = os.fsync, []
+    os.fsync = lambda fd: synced.append(fd) or fsync(fd)
+    many = add_books(batch)
+    os.fsync = fsync
+    assert len(synced) == 2, "Add Books wrote the group file for each book"
+    assert [b["id"] for b in many] == list(range(many[0]["id"], many[0]["id"] + len(batch))), "Add Books ID Failure"
+    assert all(from_id(b["id"]) is b for b in many) and len(groups()) == gcount + 4, "Add Books Group Failure"
+    assert os.path.getsize(DB_FILE) == size and __journalled >= JOURNAL_LIMIT, "Add Books rewrote the files"
+    try:
+        add_books([batch[0] | {"title": ""}, batch[1]])
+        assert False, "Invalid Book Added"
+    except ValueError:    pass
+    assert len(books()) == len(set(_book_index())) and books()[-1] is many[-1], "Add Books was not atomic"
+    check_availability()
+    print("Passed")
+    print("Journal:")
+    with open(DB_FILE, "rb") as f:
+        saved = f.read()
+    _reset()
+    streamed = list(iter_logs())
+    streamed_books = list(iter_books())
+    assert from_id(out[0]["id"])["member"] == "TEST" and latest_log(out[0]["id"]) == new[-1], "Journal Replay Failure"
+    assert len(logs()) == count + len(new), "Journal Replay Log Failure"
+    assert streamed == logs(), "Iter Logs Journal Failure"
+    assert streamed_books == books(), "Iter Books Journal Failure"
+    assert len(groups()) == gcount + 4 and added["id"] not in _book_index(), "Journal Replay Catalogue Failure"
+    with open(JOURNAL_FILE, "a", encoding="utf8") as f:
+        f.write("B,0,Torn")
+    _reset()
+    assert from_id(out[0]["id"])["member"] == "TEST", "Journal Torn Commit Failure"
+    quoted = f"{tmp.name}/quoted.txt"
+    rows = [["B", "1", 'Line\nBreak, "Quoted"', "Someone", "Fiction", "01/01/2020", ""], ["D", "2"]]
+    size = _journal(rows, quoted)
+    with open(quoted, "a", encoding="utf8") as f:
+        f.write('B,3,"Torn\nLine')
+    assert _read_journal(quoted) == (rows, size), "Journal Quoted Field Failure"
+    with open(DB_FILE, "rb") as f:
+        assert f.read() == saved, "Journal rewrote the database"
+    checkpoint()
+    assert _read_journal()[0] == [["G", "1"]], "Checkpoint did not start a new journal"
+    _reset()
+    assert from_id(out[0]["id"])["member"] == "TEST" and latest_log(out[0]["id"]) == new[-1], "Checkpoint Failure"
+    print("Passed")
+    print("Refresh:")
+    import subprocess
+    def other(code: str):
+        """Runs code in another process sharing the temporary database."""
+        subprocess.run((sys.executable, "-c", f"""import database.database as db
+db.DB_FILE, db.LOG_FILE, db.JOURNAL_FILE, db.LOCK_FILE, db.GROUP_FILE = {DB_FILE!r}, {LOG_FILE!r}, {JOURNAL_FILE!r}, {LOCK_FILE!r}, {GROUP_FILE!r}
+{code}"""), cwd=f"{PATH}..", check=True)
+    book = next(b for b in books() if not b["member"])
+    other(f"assert db.hash_group(db.from_id({book['id']})) == {hash_group(book)}, 'Group ID Failure'")
+    count = len(logs())
+    assert not refresh(), "Refresh found changes that were not made"
+    other(f"db.transaction([({book['id']}, 'OTHR')])")
+    assert refresh() and book["member"] == "OTHR" and len(logs()) == count + 1, "Refresh Failure"
+    assert latest_log(book["id"])["member"] == "OTHR", "Refresh Log Index Failure"
+    assert find_members("OTHR") == ["OTHR"], "Refresh Member Index Failure"
+    check_availability()
+    other("db.add_book('Other Book', 'Other Author', ('Fiction',))")
+    assert refresh() and any(g["title"] == "Other Book" for g in groups()), "Refresh Add Book Failure"
+    other(f"db.transaction(returns=[{book['id']}]); db.checkpoint()")
+    assert refresh() and not book["member"] and latest_log(book["id"])["date_in"], "Refresh Checkpoint Failure"
+    try:
+        transaction(returns=[book["id"]])
+        assert False, "Transaction returned a book returned by another process"
+    except ValueError:    pass
+    print("Passed")
+    tmp.cleanup()
 
     # No runtime errors
@@ -0,0 +1,239 @@
+"""Generates synthetic databases at production scale.
+
+Writes a catalogue and a logfile in the same csv format as the database,
+with a controllable number of books, logs and members.
+Both files are streamed out row by row, only a few numbers per book
+are held in memory so the number of logs does not affect memory use.
+
+Usage: python -m database.generate <directory> [--books 1000000] [--logs 50000000] ...
+"""
+
+import csv
+import os
+import random
+import string
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from itertools import accumulate
+from typing import Iterator
+
+import database.database as db
+
+# Genres of the shipped database, most common first
+GENRES = (
+    "Fiction", "Classics", "Fantasy", "Young Adult", "Childrens", "Science Fiction", "Dystopia",
+    "Academic", "School", "Literature", "Historical", "Historical Fiction", "Romance", "Nonfiction",
+    "Read For School", "Novels", "Physics", "Science", "Astronomy", "History", "High School",
+    "Picture Books", "Holocaust", "World War II", "Politics", "Mystery", "Poetry", "War", "American",
+    "Epic Fantasy", "Humor", "Horror", "Drama", "Plays", "Thriller", "Contemporary", "Crime",
+    "Philosophy", "Economics", "Christmas", "Holiday", "Kids", "Adventure", "Audiobook",
+    "Magic", "Young Adult Fantasy", "Animals", "Christian", "Reference", "Religion", "Spirituality",
+)
+WORDS = (
+    "Little", "House", "Night", "Shadow", "River", "Garden", "Winter", "Stone", "Silent", "Crown",
+    "Secret", "Dark", "Glass", "Iron", "Lost", "City", "Sea", "Fire", "Star", "Forest", "Golden",
+    "Last", "Road", "Girl", "King", "Wolf", "Song", "Storm", "Summer", "Island", "Heart", "Tower",
+)
+NAMES = (
+    "Jane", "John", "Mary", "George", "Emily", "Charles", "Ann", "Mark", "Lewis", "Ray", "Toni",
+    "Austen", "Orwell", "Bronte", "Dickens", "Twain", "Carroll", "Bradbury", "Morrison", "Tolkien",
+)
+
+def member_code(index: int) -> db.Member:
+    """Returns the 4 letter code of the index-th member."""
+    letters = string.ascii_uppercase
+    return "".join(letters[index // 26 ** p % 26] for p in reversed(range(4)))
+
+def zipf(size: int, skew: float) -> array:
+    """Return the cumulative weights of a Zipf distribution over size items.
+
+    Item 0 is the most likely, skew 0 makes them all equally likely.
+    """
+    return array("d", accumulate(1 / (rank ** skew) for rank in range(1, size + 1)))
+
+def pick(rng: random.Random, cumulative: array, limit: int | None = None) -> int:
+    """Picks an item from cumulative weights.
+
+    limit: Only pick from the first limit items.
+    """
+    limit = len(cumulative) if limit is None else limit
+    return bisect_right(cumulative, rng.random() * cumulative[limit - 1], 0, limit - 1)
+
+def make_group(seed: int, group: int, authors: int, genre_weights: array) -> tuple[str, str, tuple[str, ...]]:
+    """Returns the title, author and genres of a group.
+
+    Each group has its own random generator
+    so it can be made again without being stored.
+    """
+    rng = random.Random(seed * 1_000_003 + group)
+    title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 3))) + f" {group}"
+    author = rng.randrange(authors)
+    author = f"{NAMES[author % len(NAMES)]} {NAMES[author // len(NAMES) % len(NAMES)]} {author}"
+    genres = {genre_name(pick(rng, genre_weights)) for _ in range(rng.randint(1, 6))}
+    return title, author, tuple(sorted(genres))
+
+def genre_name(index: int) -> str:
+    """Returns the name of a genre, using the shipped genres first."""
+    return GENRES[index] if index < len(GENRES) else f"Genre {index}"
+
+def generate(
+    directory: str,
+    books: int = 1000,
+    logs: int = 2500,
+    members: int = 75,
+    copies: float = 17,
+    genres: int = len(GENRES),
+    genre_skew: float = 1,
+    popularity: float = 1,
+    member_skew: float = 0.5,
+    active: float = 0.2,
+    overdue: float = 0.3,
+    start: date = date(2000, 1, 1),
+    end: date | None = None,
+    seed: int = 0,
+) -> tuple[int, int]:
+    """Writes a new database.txt and logfile.txt into the directory.
+
+    copies: The average number of copies in each book group.
+    genres: The number of different genres.
+    genre_skew, popularity, member_skew: Zipf skew of how often the genres,
+        groups and members are picked, 0 is uniform.
+    active: The fraction of books on loan on the end date.
+    overdue: The fraction of books on loan which are overdue.
+    start, end: The dates of the first log and the last, end defaults to today.
+
+    Every book is bought within the first half of the dates.
+    A journal or group file in the directory is deleted as it was for the previous database.
+    Returns the number of books and the number of logs written.
+    """
+    rng = random.Random(seed)
+    first, last = start.toordinal(), (end or date.today()).toordinal()
+    span = last - first
+    groups = max(1, min(books, round(books / copies)))
+    authors = max(1, groups // 3)
+    genre_weights = zipf(genres, genre_skew)
+    group_weights = zipf(groups, popularity)
+    member_weights = zipf(members, member_skew)
+
+    # Book i is a copy of group i, so every group has a copy,
+    # the rest are copies of popular groups.
+    book_group = array("I", range(min(books, groups)))
+    book_group.extend(pick(rng, group_weights) for _ in range(books - groups))
+    # Book IDs of every group: ids[offset[g]:offset[g+1]]
+    offset = array("I", [0]) * (groups + 1)
+    for g in book_group:
+        offset[g + 1] += 1
+    offset = array("I", accumulate(offset))
+    ids = array("I", [0]) * books
+    end_of = offset[:-1]
+    for id, g in enumerate(book_group):
+        ids[end_of[g]] = id
+        end_of[g] += 1
+    del end_of
+
+    def purchase(id: int) -> int:
+        """Purchase date of a book."""
+        return first + id * (span // 2) // max(1, books)
+
+    # Books on loan at the end are decided first, so no loan overlaps them
+    final_out = array("i", [0]) * books
+    final_member = array("I", [0]) * books
+    for id in rng.sample(range(books), round(books * active)):
+        if rng.random() < overdue:
+            final_out[id] = last - rng.randint(db.OVERDUE_DAYS + 1, 365)
+        else:
+            final_out[id] = last - rng.randint(0, db.OVERDUE_DAYS)
+        final_out[id] = max(final_out[id], purchase(id))
+        final_member[id] = pick(rng, member_weights)
+    finals = sorted((final_out[id], id) for id in range(books) if final_out[id])
+
+    dates: dict[int, str] = {}
+    def fmt(day: int) -> str:
+        """Formats a date ordinal, caching as there are few different days."""
+        if (s := dates.get(day)) is None:
+            s = dates[day] = date.fromordinal(day).strftime(db.DATE_FMT)
+        return s
+
+    codes = [member_code(m) for m in range(members)]
+    def rows() -> Iterator[tuple]:
+        """Generates the log rows in order of checkout date."""
+        free = array("i", [0]) * books
+        rand = rng.random
+        f = 0
+        for k in range(logs):
+            day = first + k * span // max(1, logs)
+            while f < len(finals) and finals[f][0] <= day:
+                out, id = finals[f]
+                yield id, codes[final_member[id]], fmt(out), ""
+                f += 1
+            # Only groups with a copy bought by today
+            bought = min(books, (day - first) * books // max(1, span // 2) + 1)
+            for _ in range(10):
+                g = pick(rng, group_weights, min(groups, bought))
+                lo = offset[g]
+                hi = bisect_left(ids, bought, lo, offset[g + 1])
+                if hi <= lo:
+                    continue
+                id = ids[lo + int(rand() * (hi - lo))]
+                # A few loans are returned late
+                returned = day + 1 + int(rand() * (db.OVERDUE_DAYS if rand() < 0.9 else 2 * db.OVERDUE_DAYS))
+                returned = min(returned, last - 1)
+                if free[id] <= day and returned > day and (not final_out[id] or returned <= final_out[id]):
+                    free[id] = returned
+                    yield id, codes[pick(rng, member_weights)], fmt(day), fmt(returned)
+                    break
+        for out, id in finals[f:]:
+            yield id, codes[final_member[id]], fmt(out), ""
+
+    for name in ("journal.txt", "journal.txt.old", "groups.txt", "logfile.agg.json"):
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:    pass
+
+    count = 0
+    with open(os.path.join(directory, "logfile.txt"), "w", newline="", encoding="utf8") as file:
+        csvw = csv.writer(file)
+        csvw.writerow(map(str.title, db.FIELD_NAMES_LOG))
+        for row in rows():
+            csvw.writerow(row)
+            count += 1
+
+    with open(os.path.join(directory, "database.txt"), "w", newline="", encoding="utf8") as file:
+        csvw = csv.writer(file)
+        csvw.writerow(map(str.title, db.FIELD_NAMES_BOOK))
+        group = None
+        for id in range(books):
+            if book_group[id] != group:
+                group = book_group[id]
+                title, author, genre = make_group(seed, group, authors, genre_weights)
+            member = codes[final_member[id]] if final_out[id] else ""
+            csvw.writerow((id, title, author, ";".join(genre), fmt(purchase(id)), member))
+    return books, count
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", help="Where to write database.txt and logfile.txt")
+    parser.add_argument("--books", type=int, default=1000)
+    parser.add_argument("--logs", type=int, default=2500)
+    parser.add_argument("--members", type=int, default=75, help=f"At most {26**4}")
+    parser.add_argument("--copies", type=float, default=17, help="Average copies in each book group")
+    parser.add_argument("--genres", type=int, default=len(GENRES), help="Number of different genres")
+    parser.add_argument("--genre-skew", type=float, default=1, help="Zipf skew of the genres")
+    parser.add_argument("--popularity", type=float, default=1, help="Zipf skew of the book groups")
+    parser.add_argument("--member-skew", type=float, default=0.5, help="Zipf skew of the members")
+    parser.add_argument("--active", type=float, default=0.2, help="Fraction of books on loan")
+    parser.add_argument("--overdue", type=float, default=0.3, help="Fraction of loans which are overdue")
+    parser.add_argument("--start", type=lambda s: date.fromisoformat(s), default=date(2000, 1, 1), help="YYYY-MM-DD")
+    parser.add_argument("--end", type=lambda s: date.fromisoformat(s), default=None, help="YYYY-MM-DD")
+    parser.add_argument("--seed", type=int, default=0)
+    args = vars(parser.parse_args())
+    if not 0 < args["members"] <= 26 ** 4:
+        parser.error(f"--members must be between 1 and {26**4}")
+
+    t = time.perf_counter()
+    books, logs = generate(**args)
+    print(f"Wrote {books} books and {logs} logs in {time.perf_counter() - t:.1f}s")
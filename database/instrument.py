@@ -0,0 +1,165 @@
+"""Counters and timing histograms for the hot paths.
+
+Only active when the LIBRARIAN_STATS environment variable is set,
+otherwise timed() returns the functions unchanged so there is no cost.
+If LIBRARIAN_STATS is a filename ending in .json or .prom
+the statistics are written to it when the program exits.
+
+The functions of the database module are timed on import,
+the other modules time their own with the timed() decorator.
+
+Usage: python -m database.instrument <stats.json>  Prints a saved dump as a table.
+"""
+
+import atexit
+import functools
+import json
+import os
+from bisect import bisect_left
+from time import perf_counter
+from types import GeneratorType
+from typing import Any, Callable, Iterator, TypeVar
+
+import database.database as db
+
+SETTING = os.environ.get("LIBRARIAN_STATS", "")
+ENABLED = SETTING not in ("", "0")
+
+# Upper bounds in seconds of the histogram buckets, from 1us to 4s
+BUCKETS = tuple(1e-6 * 4 ** i for i in range(12))
+
+counters: dict[str, int] = {}
+timings: dict[str, dict[str, Any]] = {}
+
+def count(name: str, n: int = 1):
+    """Adds n to a counter."""
+    counters[name] = counters.get(name, 0) + n
+
+def observe(name: str, seconds: float):
+    """Records a duration in the histogram of name."""
+    if (t := timings.get(name)) is None:
+        t = timings[name] = {"buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0, "count": 0}
+    t["buckets"][bisect_left(BUCKETS, seconds)] += 1
+    t["sum"] += seconds
+    t["count"] += 1
+
+def _timed_iter(name: str, it: Iterator, elapsed: float) -> Iterator:
+    """Passes through the items of an iterator, timing only the work done to produce them.
+
+    The total is recorded once the iterator is exhausted or discarded.
+    """
+    try:
+        while True:
+            start = perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                elapsed += perf_counter() - start
+            yield item
+    finally:
+        observe(name, elapsed)
+
+F = TypeVar("F", bound=Callable)
+def timed(name: str | None = None) -> Callable[[F], F]:
+    """Decorator to count and time every call of a function.
+
+    If the function returns a generator, the time to exhaust it is included.
+    Recursive calls are only timed once, as part of the outermost call.
+    name: Defaults to the module and name of the function.
+    """
+    def decorator(func: F) -> F:
+        if not ENABLED:
+            return func
+        key = name or f"{func.__module__.split('.')[-1]}.{func.__name__}"
+        running = False
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            nonlocal running
+            if running:
+                return func(*args, **kwargs)
+            running = True
+            start = perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                observe(key, perf_counter() - start)
+                raise
+            finally:
+                running = False
+            if isinstance(result, GeneratorType):
+                return _timed_iter(key, result, perf_counter() - start)
+            observe(key, perf_counter() - start)
+            return result
+        return wrapper
+    return decorator
+
+def reset():
+    """Clears every counter and histogram."""
+    counters.clear()
+    timings.clear()
+
+def stats() -> dict[str, Any]:
+    """Return all the counters and histograms."""
+    return {"buckets": BUCKETS, "counters": dict(counters), "timings": {k: dict(v) for k, v in timings.items()}}
+
+def to_json() -> str:
+    """Return the statistics as JSON."""
+    return json.dumps(stats(), indent=2)
+
+def to_prometheus() -> str:
+    """Return the statistics in the Prometheus text format."""
+    metric = lambda name: "librarian_" + "".join(c if c.isalnum() else "_" for c in name)
+    lines = []
+    for name, value in sorted(counters.items()):
+        lines += (f"# TYPE {metric(name)}_total counter", f"{metric(name)}_total {value}")
+    for name, t in sorted(timings.items()):
+        m = f"{metric(name)}_seconds"
+        lines.append(f"# TYPE {m} histogram")
+        total = 0
+        for bound, n in zip((*map(repr, BUCKETS), "+Inf"), t["buckets"]):
+            total += n
+            lines.append(f'{m}_bucket{{le="{bound}"}} {total}')
+        lines += (f"{m}_sum {t['sum']!r}", f"{m}_count {t['count']}")
+    return "\n".join(lines) + "\n"
+
+def quantile(t: dict[str, Any], q: float) -> float:
+    """Estimates a quantile of a histogram from the upper bound of its bucket."""
+    target, total = q * t["count"], 0
+    for bound, n in zip((*BUCKETS, float("inf")), t["buckets"]):
+        total += n
+        if total >= target:
+            return bound
+    return float("inf")
+
+def table(data: dict[str, Any] | None = None) -> str:
+    """Return the statistics as a table of text."""
+    data = stats() if data is None else data
+    lines = [f"{'timing':<36}{'calls':>9}{'total ms':>11}{'mean us':>10}{'p50 <=us':>10}{'p99 <=us':>10}"]
+    for name, t in sorted(data["timings"].items(), key=lambda i: -i[1]["sum"]):
+        lines.append(f"{name:<36}{t['count']:>9}{t['sum']*1e3:>11.1f}{t['sum']/t['count']*1e6:>10.1f}"
+            f"{quantile(t, 0.5)*1e6:>10.0f}{quantile(t, 0.99)*1e6:>10.0f}")
+    if data["counters"]:
+        lines.append(f"\n{'counter':<36}{'value':>9}")
+        lines += (f"{name:<36}{value:>9}" for name, value in sorted(data["counters"].items()))
+    return "\n".join(lines)
+
+def dump(filename: str):
+    """Writes the statistics to a file, as Prometheus text if it ends with .prom otherwise JSON."""
+    with open(filename, "w", encoding="utf8") as file:
+        file.write(to_prometheus() if filename.endswith(".prom") else to_json())
+
+if ENABLED:
+    for _name in ("_read", "_write", "iter_logs", "from_id"):
+        setattr(db, _name, timed(f"database.{_name}")(getattr(db, _name)))
+    if SETTING.endswith((".json", ".prom")):
+        atexit.register(dump, SETTING)
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 2:
+        sys.exit(__doc__.splitlines()[-1])
+    with open(sys.argv[1], encoding="utf8") as file:
+        print(table(json.load(file)))
@@ -0,0 +1,216 @@
+"""Interval index of the loans, to count the books on loan or overdue on any day.
+
+Each loan is the days from its checkout until its return.
+Fenwick trees over the days count how many loans had started and ended by a day,
+so the number on loan or overdue on a day, or during a range of days,
+takes logarithmic time instead of a pass over every log.
+The loans are also kept sorted by their checkout date to list those on loan on a day.
+
+The index is built from the logs the first time it is used
+and kept up to date by every commit.
+
+Usage: python -m database.loans  Checks the index against the logs.
+"""
+
+from bisect import bisect_right
+from datetime import date
+from typing import Any, TypeAlias
+
+import database.database as db
+
+Index: TypeAlias = dict[str, Any]
+# "base" the day before the first position of the trees and the Fenwick trees indexed by day of
+# the "starts" and "ends" of the loans, and when they start and stop being overdue, "late" and "late_ends".
+# "days" the checkout day of each of the "loans" in order, "open" the open loan of every book
+# and "longest" the most days a returned book was on loan.
+
+MARGIN = 366 # Days after today the trees have room for before they are rebuilt
+TREES = ("starts", "ends", "late", "late_ends")
+
+def _add(tree: list[int], i: int, n: int = 1):
+    """Adds n to position i of a Fenwick tree, the first position is 1."""
+    while i < len(tree):
+        tree[i] += n
+        i += i & -i
+
+def _sum(tree: list[int], i: int) -> int:
+    """Return the total of positions 1 to i of a Fenwick tree."""
+    i, total = min(i, len(tree) - 1), 0
+    while i > 0:
+        total += tree[i]
+        i -= i & -i
+    return total
+
+def _fenwick(counts: list[int]) -> list[int]:
+    """Converts counts by position into a Fenwick tree in place."""
+    for i in range(1, len(counts)):
+        if (j := i + (i & -i)) < len(counts):
+            counts[j] += counts[i]
+    return counts
+
+def _days(log: db.Log) -> list[tuple[str, int]]:
+    """Return the tree and day of every count of a loan.
+
+    A book is on loan from the day it is checked-out until the day before it is returned,
+    and overdue from OVERDUE_DAYS after it was checked-out.
+    """
+    out = log["date_out"].toordinal()
+    late = out + db.OVERDUE_DAYS + 1
+    if not log["date_in"]:
+        return [("starts", out), ("late", late)]
+    back = log["date_in"].toordinal()
+    return [("starts", out), ("late", late), ("ends", max(back, out)), ("late_ends", max(back, late))]
+
+def _build() -> Index:
+    """Return the index of every loan in the logs."""
+    logs = db.logs()
+    counted = [(log, _days(log)) for log in logs]
+    today = date.today().toordinal()
+    base = min((d for _, days in counted for _, d in days), default=today) - 1
+    size = max([today, *(d for _, days in counted for _, d in days)]) + MARGIN - base
+    trees = {name: [0] * size for name in TREES}
+    for _, days in counted:
+        for name, d in days:
+            trees[name][d - base] += 1
+
+    for tree in trees.values():
+        _fenwick(tree)
+
+    loans = sorted(logs, key=lambda log: log["date_out"])
+    return trees | {
+        "base": base,
+        "loans": loans,
+        "days": [log["date_out"].toordinal() for log in loans],
+        "open": {log["id"]: log for log in logs if not log["date_in"]},
+        "longest": max((log["date_in"].toordinal() - log["date_out"].toordinal() for log in logs if log["date_in"]), default=0),
+    }
+
+__index: Index | None = None
+def index() -> Index:
+    """Return the index of the loans, built the first time it is used."""
+    global __index
+    if __index is None:
+        __index = _build()
+    return __index
+
+def _count(idx: Index, days: list[tuple[str, int]]) -> bool:
+    """Counts the days in the trees, returns False if the trees are too small for them."""
+    if any(not 0 < d - idx["base"] < len(idx[name]) for name, d in days):
+        return False
+    for name, d in days:
+        _add(idx[name], d - idx["base"])
+    return True
+
+def _update(books: list[db.Book], logs: list[db.Log] | None):
+    """Adds the returned books and the new logs to the index.
+
+    Forgets it if everything was loaded again,
+    or a day does not fit in the trees, so it is built again when next used.
+    """
+    global __index
+    if (idx := __index) is None:
+        return
+    if logs is None:
+        __index = None
+        return
+    # The returns first, a book returned and checked-out again has a new open log
+    for book in books:
+        if (log := idx["open"].get(book["id"])) is not None and log["date_in"]:
+            del idx["open"][book["id"]]
+            if not _count(idx, _days(log)[2:]):
+                __index = None
+                return
+            idx["longest"] = max(idx["longest"], log["date_in"].toordinal() - log["date_out"].toordinal())
+    for log in logs:
+        if not _count(idx, _days(log)):
+            __index = None
+            return
+        i = bisect_right(idx["days"], day := log["date_out"].toordinal())
+        idx["days"].insert(i, day)
+        idx["loans"].insert(i, log)
+        if log["date_in"]:
+            idx["longest"] = max(idx["longest"], log["date_in"].toordinal() - day)
+        else:
+            idx["open"][log["id"]] = log
+
+db.on_commit(_update)
+
+def _ordinal(day: date | None) -> int:
+    """Return the day ordinal of a date, defaults to today."""
+    return (day or date.today()).toordinal()
+
+def on_loan_count(day: date | None = None) -> int:
+    """Return how many books were on loan at the end of a day, defaults to today."""
+    idx, d = index(), _ordinal(day)
+    return _sum(idx["starts"], d - idx["base"]) - _sum(idx["ends"], d - idx["base"])
+
+def overdue_count(day: date | None = None) -> int:
+    """Return how many books were overdue on a day, defaults to today."""
+    idx, d = index(), _ordinal(day)
+    return _sum(idx["late"], d - idx["base"]) - _sum(idx["late_ends"], d - idx["base"])
+
+def loans_between(start: date, end: date) -> int:
+    """Return how many loans there were at any time from the start to the end day."""
+    idx = index()
+    return _sum(idx["starts"], end.toordinal() - idx["base"]) - _sum(idx["ends"], start.toordinal() - idx["base"])
+
+def checkouts_between(start: date, end: date) -> int:
+    """Return how many books were checked-out from the start to the end day."""
+    idx = index()
+    return _sum(idx["starts"], end.toordinal() - idx["base"]) - _sum(idx["starts"], start.toordinal() - 1 - idx["base"])
+
+def on_loan(day: date | None = None) -> list[db.Log]:
+    """Return the logs of the books on loan at the end of a day, defaults to today, in checkout order.
+
+    Only the loans checked-out within the longest loan before the day are checked,
+    along with those not yet returned.
+    """
+    idx, d = index(), _ordinal(day)
+    lo, hi = bisect_right(idx["days"], d - idx["longest"]), bisect_right(idx["days"], d)
+    logs = [log for log in idx["loans"][lo:hi] if log["date_in"] and log["date_in"].toordinal() > d]
+    logs.extend(log for log in idx["open"].values() if log["date_out"].toordinal() <= d)
+    return sorted(logs, key=lambda log: log["date_out"])
+
+def overdue(day: date | None = None) -> list[db.Log]:
+    """Return the logs of the books which were overdue on a day, defaults to today, in checkout order."""
+    cutoff = _ordinal(day) - db.OVERDUE_DAYS - 1
+    return [log for log in on_loan(day) if log["date_out"].toordinal() <= cutoff]
+
+if __name__ == "__main__":
+    import random
+    import tempfile
+
+    # Run from the top directory so the database package can be imported
+    # Works on a copy so the transactions are not written to the database
+    tmp = tempfile.TemporaryDirectory()
+    db.use_copy(tmp.name, db.PATH)
+
+    def check():
+        """Compares the index against a pass over the logs on some days."""
+        logs = db.logs()
+        loaned = lambda log, day: log["date_out"] <= day and (not log["date_in"] or log["date_in"] > day)
+        days = [date.today(), *(random.choice(logs)["date_out"] for _ in range(20))]
+        for day in days:
+            expect = [log for log in logs if loaned(log, day)]
+            assert on_loan_count(day) == len(expect), "On Loan Count Failure"
+            assert sorted(map(id, on_loan(day))) == sorted(map(id, expect)), "On Loan Failure"
+            late = [log for log in expect if (day - log["date_out"]).days > db.OVERDUE_DAYS]
+            assert overdue_count(day) == len(late) and len(overdue(day)) == len(late), "Overdue Failure"
+        start, end = sorted(days[1:3])
+        during = [log for log in logs if log["date_out"] <= end and (not log["date_in"] or log["date_in"] > start)]
+        assert loans_between(start, end) == len(during), "Loans Between Failure"
+        assert checkouts_between(start, end) == sum(start <= log["date_out"] <= end for log in logs), "Checkouts Between Failure"
+
+    print("Build:")
+    check()
+    print("Passed")
+    print("Update:")
+    lent = [b for b in db.books() if b["member"]][:2]
+    stock = [b for b in db.books() if not b["member"]][:2]
+    db.transaction([(b["id"], "LOAN") for b in stock], [b["id"] for b in lent])
+    db.transaction(returns=[stock[0]["id"]])
+    db.transaction([(stock[1]["id"], "AGIN")], [stock[1]["id"]])
+    assert __index is not None, "Update rebuilt the index"
+    check()
+    print("Passed")
+    tmp.cleanup()
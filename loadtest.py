@@ -0,0 +1,98 @@
+"""Load test for the local HTTP server
+
+Opens a pool of keep-alive connections to the server
+and sends a mix of requests through them as fast as they are answered.
+Reports the latency percentiles of every endpoint.
+
+Usage: python loadtest.py [--connections 16] [--requests 2000] [--writes 0]
+Start the server first with: python server.py
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from typing import Any
+
+TERMS = ("harry", "potter", "the", "lord rings", "austen", "orwell", "1984", "king", "hobbit", "z")
+
+async def request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, method: str, target: str, body: Any = None) -> tuple[int, Any]:
+    """Sends one request over a kept-alive connection and reads the response."""
+    data = b"" if body is None else json.dumps(body).encode("utf8")
+    writer.write(
+        f"{method} {target} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(data)}\r\n\r\n".encode("latin1") + data
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers: dict[str, str] = {}
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        key, _, value = line.decode("latin1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    return status, json.loads(await reader.readexactly(int(headers["content-length"])))
+
+def choose(books: int, members: list[str], writes: float) -> tuple[str, str, str, Any]:
+    """Picks a random request from the mix.
+
+    Returns the name to report it under, the method, target and body.
+    """
+    if random.random() < writes:
+        id = random.randrange(books)
+        return "write", "POST", random.choice(("/checkout", "/return")), {"id": id, "member": random.choice(members)}
+    kind = random.choice(("search", "groups", "books", "recommend"))
+    if kind == "books":
+        return kind, "GET", f"/books/{random.randrange(books)}", None
+    if kind == "recommend":
+        return kind, "GET", f"/recommend/{random.choice(members)}?n=20", None
+    return kind, "GET", f"/{kind}?q={random.choice(TERMS).replace(' ', '+')}&limit=50", None
+
+async def client(host: str, port: int, count: int, books: int, members: list[str], writes: float, latency: dict[str, list[float]]):
+    """Sends count requests one after another over a single connection."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(count):
+            name, method, target, body = choose(books, members, writes)
+            start = time.perf_counter()
+            await request(reader, writer, method, target, body)
+            latency[name].append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+def percentile(values: list[float], p: float) -> float:
+    """Return the p-th percentile of sorted values."""
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+async def main(host: str, port: int, connections: int, requests: int, writes: float):
+    """Runs the load test and prints the latencies in milliseconds."""
+    # Discover valid book IDs and members through the server itself
+    reader, writer = await asyncio.open_connection(host, port)
+    _, found = await request(reader, writer, "GET", "/search?q=&limit=1000000")
+    writer.close()
+    books = max(book["id"] for book in found) + 1
+    members = sorted({b["log"]["member"] for b in found if b["log"]}) or ["AAAA"]
+
+    latency: dict[str, list[float]] = defaultdict(list)
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(host, port, requests // connections + (i < requests % connections), books, members, writes, latency)
+        for i in range(connections)
+    ))
+    elapsed = time.perf_counter() - start
+
+    latency["all"] = [t for ts in latency.values() for t in ts]
+    print(f"{'endpoint':<10}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, ts in sorted(latency.items()):
+        ts.sort()
+        print(f"{name:<10}{len(ts):>8}{percentile(ts, 50)*1000:>10.2f}{percentile(ts, 99)*1000:>10.2f}{ts[-1]*1000:>10.2f}")
+    print(f"{len(latency['all'])} requests in {elapsed:.2f}s: {len(latency['all']) / elapsed:.0f} requests/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--connections", type=int, default=16, help="Size of the connection pool")
+    parser.add_argument("--requests", type=int, default=2000, help="Total number of requests")
+    parser.add_argument("--writes", type=float, default=0, help="Fraction of requests which checkout or return books")
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port, args.connections, args.requests, args.writes))
@@ -5,12 +5,17 @@ using tkinter to produce the GUI.
 """
 
 
+import cProfile
+import functools
+import os
 import string
+import time
 import tkinter.font
 import tkinter as tk
 from tkinter import ttk
 from collections import defaultdict
-from typing import Any, Callable, Generator, Iterable, Iterator, Literal, TypeAlias, TypeVar
+from datetime import date
+from typing import Any, Callable, Iterable, Iterator, Literal, TypeAlias, TypeVar
 
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import (
@@ -21,13 +26,14 @@ from matplotlib.figure import Figure
 
 import booksearch as search
 import bookcheckout as checkout
-import bookreturn as breturn
 import bookrecommend as recommend
 
 import database.database as db
+import database.instrument as instrument
 from database.database import Member, fmt_id
 
 # Field names for the column headers of tables
+FIELD_SEARCH_GROUP = (*db.FIELD_VISUAL_GROUP, "stock")
 FIELD_SEARCH_BOOK = ("id", "purchase", "member", "date_out", "date_in")
 FIELD_RETCHECK = ("id", "title", "author", "member", "date_out", "date_in")
 FIELD_MEMBER_BOOK = ("id", "days", "title")
@@ -35,6 +41,11 @@ FIELD_MEMBER = ("member",)
 FIELD_REC = ("match", "reads", "title", "author")
 
 WIDTH, HEIGHT = 1280, 720
+POLL = 2000 # Milliseconds between checking for changes by other instances
+PLOT_GENRES = 25 # Most genres in the reads plot
+MEMBER_RESULTS = 1000 # Most members listed while a member is typed
+# Directory to write a profile of every interaction to, F11 toggles profiling
+PROFILE_DIR = os.environ.get("LIBRARIAN_PROFILE", "")
 FONT = 11
 CHAR_SIZE = 1 # Dynamic
 CHAR_HEIGHT = 1 # Dynamic
@@ -61,6 +72,12 @@ state: dict[str, Any] = {
     "retcheck": {},
     "recommend": {},
     "plot": {},
+    "profile": {
+        "on": bool(PROFILE_DIR),
+        "dir": PROFILE_DIR or f"{db.PATH}profiles",
+        "running": False,
+        "count": 0,
+    },
 }
 
 T = TypeVar("T", bound=tk.Widget)
@@ -90,6 +107,51 @@ def variable(name: str, var: V=None) -> V:
         state["var"][name] = var
     return state["var"][name]
 
+# --- Profiling --- #
+def callback_name(func: Callable) -> str:
+    """Return a readable name for a callback.
+
+    Lambdas are named after the first function they call.
+    """
+    if func.__name__ == "<lambda>" and func.__code__.co_names:
+        return func.__code__.co_names[0]
+    return func.__name__
+
+F = TypeVar("F", bound=Callable)
+def profiled(func: F, name: str | None = None) -> F:
+    """Wraps a callback so that while profiling is on,
+    every interaction is written to its own .prof file.
+
+    Callbacks run by another profiled callback are part of its profile.
+    The files can be read with pstats, snakeviz or flameprof.
+    """
+    name = name or callback_name(func)
+    prof = state["profile"]
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not prof["on"] or prof["running"]:
+            return func(*args, **kwargs)
+        profile = cProfile.Profile()
+        prof["running"] = True
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            prof["running"] = False
+            prof["count"] += 1
+            profile.dump_stats(f"{prof['dir']}/{time.strftime('%Y%m%d-%H%M%S')}-{prof['count']:04d}-{name}.prof")
+    return wrapper
+
+def toggle_profiling():
+    """Starts or stops profiling every interaction.
+
+    Bound to the F11 key.
+    """
+    prof = state["profile"]
+    prof["on"] = not prof["on"]
+    if prof["on"]:
+        os.makedirs(prof["dir"], exist_ok=True)
+    show_message(f"Profiling on, writing to {prof['dir']}" if prof["on"] else "Profiling off")
+
 # Global State of Active Selected Components
 active: dict[str, str | db.Book | db.Group | db.Member] = {
     "now": "",
@@ -107,7 +169,7 @@ def on_cb(key: Literal['book', 'group', 'member'], func: Callable[[Any], Any]):
     """Append function to callbacks such that it will be executed
     when the corresponding component is updated.
     """
-    active_callbacks[key].append(func)
+    active_callbacks[key].append(profiled(func, f"on_{key}.{callback_name(func)}"))
 def active_update(key: str, value: Any) -> Any:
     """Updates the requested component or returns it.
     If new, will activate the status updater (for the bottom bar)
@@ -173,6 +235,8 @@ def setup_status_bar(parent: tk.Misc) -> tk.Widget:
     OPT = {"bg":BG, "padx":PAD}
 
     ws: dict[str, tuple[tk.Label, tk.Label]] = state["status"]
+    state["message"] = tk.Label(bar, text="", **OPT)
+    state["message"].pack(side=tk.RIGHT)
 
     for key in STATUS_FIELDS:
         t = ws[key.lower()] = (tk.Label(bar, text=f"{key}:", **OPT),
@@ -189,7 +253,7 @@ def setup_side_bar(parent, height: int):
     bar = tk.Frame(parent, width=100, bg="white", height=height, relief="groove", border=1)
 
     for t,f in (("search",lambda: show_page("search")), ("retcheck",lambda: show_page("retcheck")), ("recommend",lambda: show_page("recommend"))):
-        w = tk.Button(bar, text=ICONS[t], command=f)
+        w = tk.Button(bar, text=ICONS[t], command=profiled(f))
         w.pack(side=tk.TOP, fill=tk.X)
 
     bar.pack(expand=False, fill=tk.BOTH, side=tk.LEFT)
@@ -214,6 +278,7 @@ def setup_main_search(parent: tk.Frame):
     """
     ws: dict[str, Any] = {
         "tree": [],
+        "groups": [], # Shown in the group tree
         # "checkout": tk.Button(),
     }
     state["search"] = ws
@@ -230,7 +295,7 @@ def setup_main_search(parent: tk.Frame):
         lambda e: search_group_list_cb(e.widget),
         "Book Search",
         "group",
-        db.FIELD_VISUAL_GROUP,
+        FIELD_SEARCH_GROUP,
     )
     ws["tree"].append(tree)
     # Set var to empty to execute the callback and fill the treeview
@@ -247,7 +312,7 @@ def setup_main_search(parent: tk.Frame):
     ws["tree"].append(tree)
     var.set("")
 
-    ws["checkout"] = pack("search", tk.Button(frames[1], text="Checkout / Return", command=search_to_retcheck, state=tk.DISABLED), side=tk.TOP)
+    ws["checkout"] = pack("search", tk.Button(frames[1], text="Checkout / Return", command=profiled(search_to_retcheck), state=tk.DISABLED), side=tk.TOP)
     configure_tree(tree, (("id", False), "date", "member", "date", "date"))
 
 def setup_main_retcheck(parent: tk.Frame):
@@ -304,7 +369,7 @@ def setup_main_retcheck(parent: tk.Frame):
     ws["mbtree"] = tree
     on_cb("member", lambda member: variable("member").set(member))
 
-    ws["btn"] = pack(rcr, tk.Button(f_main, text=fmt_retcheck_btn("Checkout / Return"), command=retcheck_btn, state=tk.DISABLED), side=tk.BOTTOM, fill=tk.X)
+    ws["btn"] = pack(rcr, tk.Button(f_main, text=fmt_retcheck_btn("Checkout / Return"), command=profiled(retcheck_btn), state=tk.DISABLED), side=tk.BOTTOM, fill=tk.X)
     retcheck_member_cb()
 
 def setup_main_recommend(parent: tk.Frame):
@@ -318,13 +383,7 @@ def setup_main_recommend(parent: tk.Frame):
     """
     ws: dict[str, Any] = {
         "plot": {},
-        "data": {
-            "member": "",
-            "generator": None,
-            "memory": [],
-            "genres": [],
-            "genre_count": {},
-        },
+        "member": "", # Whose recommendations are shown
     }
     state["recommend"] = ws
 
@@ -337,13 +396,23 @@ def setup_main_recommend(parent: tk.Frame):
     fig, canvas = setup_figure(tab_graph)
     ws["plot"]["canvas"] = canvas
     pack(None, canvas.get_tk_widget(), side=tk.TOP, expand=True, fill=tk.BOTH)
+    # The artists are made once and their data is replaced for each member
     ax: plt.Axes = fig.add_subplot(1, 2, 1)
     ws["plot"]["match"] = ax
-    tab_plot_matches(ax, {101: 0, -1: 0})
+    ws["plot"]["match_line"], = ax.plot([], [], "bo-")
+    ax.set_xlabel("Match %")
+    ax.set_ylabel("Count")
+    ax.invert_xaxis()
+    ax.set_xbound(0, 100)
+    tab_plot_matches(ws["plot"], {})
 
     ax = fig.add_subplot(1, 2, 2)
     ws["plot"]["book_reads"] = ax
-    tab_plot_reads(ax, {"Book Title": 0})
+    ws["plot"]["reads_bars"] = ax.bar(range(PLOT_GENRES), [0] * PLOT_GENRES)
+    ax.tick_params("x", labelrotation=75, labelsize=10)
+    ax.set_xlabel("Genres")
+    ax.set_ylabel("Read Books")
+    tab_plot_reads(ws["plot"], {})
 
     # Table
     notebook.add(tab_table, text="Table 📋")
@@ -382,7 +451,7 @@ def create_search_tree(
     """
     pack(area, tk.Label(parent, text=label_text), side=tk.TOP, fill=tk.X)
     var = variable(var_name, tk.StringVar(parent))
-    var.trace_add("write", entry_cb)
+    var.trace_add("write", profiled(entry_cb))
     pack(area, tk.Entry(parent, textvariable=var), side=tk.TOP, fill=tk.X)
     tree, _ = create_tree(area, parent, tree_cb, fieldnames)
     return var, tree
@@ -396,7 +465,7 @@ def create_tree(area: str | Iterable[str], parent: tk.Frame, tree_cb: Callable[[
     tree = ttk.Treeview(frame, columns=fieldnames, show="headings")
     for key in fieldnames:
         tree.heading(key, text=key.replace("_", " ").title())
-    tree.bind("<<TreeviewSelect>>", tree_cb)
+    tree.bind("<<TreeviewSelect>>", profiled(tree_cb))
 
     for colour in COLOURS.values():
         tree.tag_configure(colour, background=colour)
@@ -425,27 +494,13 @@ def configure_tree(tree: ttk.Treeview, size_names: Iterable[str | tuple[str, boo
 
 # --- Tabs --- #
 
-def iter_rec() -> Generator[recommend.Recommendation, None, None]:
-    """Iterates over the recommendations.
+def iter_rec() -> Iterator[recommend.Recommendation]:
+    """Iterates over the recommendations of the active member.
 
-    Stores the previous recommendations so the engine doesn't have
-    to run every time the data is needed. The results are cached.
+    The engine keeps a session for each of the recent members,
+    so the recommendations are only generated once.
     """
-    data = state["recommend"]["data"]
-    member = active_member()
-    if data["member"] != member:
-        data["member"] = member
-        data["genre_count"], data["genres"], gen = recommend.recommendation(member)
-        data["generator"] = gen
-        memory = data["memory"] = []
-    else:
-        gen = data["generator"]
-        memory = data["memory"]
-
-    yield from memory
-    for item in gen:
-        memory.append(item)
-        yield item
+    return recommend.iter_session(active_member())
 
 def rec_size(size: int) -> Iterator[recommend.Recommendation]:
     """Returns an iterator with a maximum number of recommendation of size."""
@@ -457,19 +512,21 @@ def plot_matches_data(data: Iterator[recommend.Recommendation]):
     matches: dict[float, int] = defaultdict(int)
     for _, percent in data:
         matches[percent] += 1
-    total_genres = len(state["recommend"]["data"]["genres"])
+    total_genres = len(recommend.session(active_member())["genres"])
     return {k / total_genres * 100 : v for k,v in matches.items()}
 
 def tab_plots_new(member: Member):
     """On a new member, redraws the plots with new data."""
-    if not db.valid_member(member) or state["recommend"]["data"]["member"] == member:	return
+    if not db.valid_member(member) or state["recommend"]["member"] == member:	return
+    state["recommend"]["member"] = member
+    session = recommend.session(member)
 
     plots = state["recommend"]["plot"]
-    tab_plot_matches(plots["match"], plot_matches_data(rec_size(100)))
-    tab_plot_reads(plots["book_reads"], state["recommend"]["data"]["genre_count"])
-    plots["canvas"].draw()
+    tab_plot_matches(plots, plot_matches_data(rec_size(100)))
+    tab_plot_reads(plots, plot_reads_data(session))
+    plots["canvas"].draw_idle()
 
-    total_genres = len(state["recommend"]["data"]["genres"])
+    total_genres = len(session["genres"])
     gtable = db.group_table()
     replace_tree_content(state["recommend"]["tree"], FIELD_REC, (
         gtable[gh] | {"match": per / total_genres * 100, "reads": recommend.read[gh]} for gh, per in rec_size(100)
@@ -477,31 +534,40 @@ def tab_plots_new(member: Member):
 
 on_cb("member", tab_plots_new)
 
-def tab_plot_matches(ax: plt.Axes, data: dict[float, int]):
-    """Plots the match percentage chart and gives axis lables."""
-    ax.clear()
-    if data:
-        ax.plot(*zip(*data.items()), "bo-")
+def plot_reads_data(session: recommend.Session) -> dict[str, int]:
+    """Creates the data for the genre reads plot, the reads of the member's most read genres.
+
+    Only the genres read more than the 26th most read are shown.
+    Kept in the session, which is forgotten once the member reads another book.
+    """
+    if "plot_reads" not in session:
+        counts = session["genre_count"]
+        read = [genre for genre, count in enumerate(counts) if count]
+        minsize = sorted((counts[g] for g in read), reverse=True)[PLOT_GENRES] if len(read) > PLOT_GENRES else 0
+        session["plot_reads"] = {db.genre_name(g): counts[g] for g in read if counts[g] > minsize}
+    return session["plot_reads"]
+
+def tab_plot_matches(plots: dict[str, Any], data: dict[float, int]):
+    """Replaces the data of the match percentage chart."""
+    ax: plt.Axes = plots["match"]
+    plots["match_line"].set_data(list(data), list(data.values()))
     ax.set_title(f"{active_member() or 'No Member Selected'}\nNumber of Books with Match Percentage")
-    ax.set_xlabel("Match %")
-    ax.set_ylabel("Count")
-    ax.invert_xaxis()
-    ax.set_xbound(0, 100)
     ax.set_ybound(0, max(1, max(data.values() if data else (0,))+1))
 
-def tab_plot_reads(ax: plt.Axes, data: dict[str, int]):
-    """Plots the read genres and sets axis labels."""
-    ax.clear()
-    minsize = 0
-    while len(data) > 25:
-        minsize += 1
-        data = {k:v for k,v in data.items() if v > minsize}
-    if data:
-        ax.bar(*zip(*data.items()))
-    ax.tick_params("x", labelrotation=75, labelsize=10)
+def tab_plot_reads(plots: dict[str, Any], data: dict[str, int]):
+    """Replaces the data of the read genres chart.
+
+    The bars after the genres are hidden.
+    """
+    ax: plt.Axes = plots["book_reads"]
+    counts = list(data.values())
+    for i, bar in enumerate(plots["reads_bars"]):
+        bar.set_height(counts[i] if i < len(counts) else 0)
+        bar.set_visible(i < len(counts))
+    ax.set_xticks(range(len(data)))
+    ax.set_xticklabels(data)
+    ax.set_xbound(-0.5, max(1, len(data)) - 0.5)
     ax.set_title(f"{active_member() or 'No Member Selected'}\nNumber of Books Read per Genre")
-    ax.set_xlabel("Genres")
-    ax.set_ylabel("Read Books")
     ax.set_ybound(0, max(1, max(data.values() if data else (0,))))
 
 def tab_table_cb(tree: ttk.Treeview):
@@ -549,8 +615,7 @@ COLOURS: dict[str, Colour] = {
 def colour_lookup(book: db.Book) -> Colour:
     """Return a Colour based on the current loan status of a book."""
     try:
-        log = checkout.active_log(book)
-        if checkout.days(book) > 60:
+        if checkout.overdue(book):
             return COLOURS["over"]
         return COLOURS["out"]
     except ValueError:
@@ -571,6 +636,16 @@ def fmt_match(match: float) -> str:
     """Formats the match % to be rounded."""
     return f"{match:.2f}%"
 
+def fmt_stock(stock: tuple[int, int, int]) -> str:
+    """Formats the availability of a group as the copies in stock of the total."""
+    return f"{stock[0]}/{stock[0] + stock[1]}" + (f" ({stock[2]} late)" if stock[2] else "")
+
+def colour_stock(stock: tuple[int, int, int]) -> Colour:
+    """Return a Colour based on the availability of a group."""
+    if stock[0]:
+        return COLOURS["in"]
+    return COLOURS["over"] if stock[2] else COLOURS["out"]
+
 def fmt_retcheck_btn(text: str) -> str:
     """Text on for the checkout / return button.
 
@@ -614,6 +689,7 @@ def get_entry_term(name: str) -> str:
     """Returns the entry data from a tk.variable."""
     return variable(name).get().strip()
 
+@instrument.timed()
 def replace_tree_content(tree: ttk.Treeview, fields: Iterable[str], items: Iterable[dict[str, Any] | tuple[dict[str, Any], str]]):
     """Replaces every element in a tree with new rows.
 
@@ -631,6 +707,46 @@ def replace_tree_content(tree: ttk.Treeview, fields: Iterable[str], items: Itera
             iid = tree.insert("", tk.END, values=tuple(v.get(k, "") for k in fields))
             tree.item(iid, tags=item[1])
 
+# Formatted rows of the books by ID and fields, with the revision of the book and the day they were made
+__book_rows: dict[tuple[int, tuple[str, ...]], tuple[int, int, tuple[str, ...], Colour]] = {}
+def book_row(book: db.Book, fields: tuple[str, ...]) -> tuple[tuple[str, ...], Colour]:
+    """Return the formatted values of the fields of a book, with its log, and the colour of its row.
+
+    They are only made again once the book has changed, or on a new day
+    as how long it has been on loan and whether it is overdue change with the day.
+    """
+    key, today = (book["id"], fields), date.today().toordinal()
+    rev = db.book_revision(book["id"])
+    row = __book_rows.get(key)
+    if row is None or row[0] != rev or row[1] != today:
+        obj = book | checkout.get_log(book)
+        if "days" in fields:
+            obj["days"] = checkout.days(book)
+        v = fmt(obj)
+        row = __book_rows[key] = (rev, today, tuple(v.get(k, "") for k in fields), colour_lookup(book))
+    return row[2], row[3]
+
+# Rows last drawn in each tree of books, by tree name
+__drawn_rows: dict[str, dict[str, tuple[tuple[str, ...], Colour]]] = {}
+@instrument.timed()
+def replace_tree_books(tree: ttk.Treeview, fields: tuple[str, ...], books: Iterable[db.Book]):
+    """Replaces every element in a tree with the rows of the books, coloured by their loan status.
+
+    Each row is named by its book ID.
+    If the tree already shows the same books, only the rows which changed are redrawn.
+    """
+    rows = {str(book["id"]): book_row(book, fields) for book in books}
+    drawn = __drawn_rows.get(str(tree))
+    if drawn is not None and tuple(drawn) == tuple(rows) == tree.get_children():
+        for iid, row in rows.items():
+            if drawn[iid] != row:
+                tree.item(iid, values=row[0], tags=row[1])
+    else:
+        tree.delete(*tree.get_children())
+        for iid, (values, colour) in rows.items():
+            tree.insert("", tk.END, iid=iid, values=values, tags=colour)
+    __drawn_rows[str(tree)] = rows
+
 def get_tree_selection(tree: ttk.Treeview) -> list[str] | None:
     """Returns the currently selected row."""
     try:
@@ -653,7 +769,9 @@ def search_group_input_cb():
     """
     term = get_entry_term("group")
     tree = get_search_tree_side(0)
-    replace_tree_content(tree, db.FIELD_VISUAL_GROUP, search.generate_group(term))
+    state["search"]["groups"] = search.generate_group(term)
+    replace_tree_content(tree, FIELD_SEARCH_GROUP, ((g | {"stock": stock}, colour_stock(stock))
+        for g in state["search"]["groups"] for stock in (db.availability(g),)))
 
 def search_group_list_cb(tree: ttk.Treeview):
     """Callback on group tree selection.
@@ -661,9 +779,9 @@ def search_group_list_cb(tree: ttk.Treeview):
     Sets the active group to the row selected.
     """
     try:
-        value: list[str] = list(map(str, tree.item(tree.selection()[0])["values"]))
+        value: list[str] = list(map(str, tree.item(tree.selection()[0])["values"]))[:len(db.FIELD_VISUAL_GROUP)]
     except IndexError:	return
-    for group in search.active_groups:
+    for group in state["search"]["groups"]:
         v = [fmt_field(k, group[k]) for k in db.FIELD_VISUAL_GROUP]
         if v == value:
             return active_group(group)
@@ -672,13 +790,12 @@ def search_book_input_cb():
     """Callback on book text search.
 
     Replaces the tree content based on the new book ID search term.
-    The ID must be one that is also in the book group.
+    The ID must be one that is also in the book group,
+    so only the copies of the group are searched.
     Active on a new book group.
     """
     term = get_entry_term("book")
-    group_hash = db.hash_group(active_group())
-    replace_tree_content(get_search_tree_side(1), FIELD_SEARCH_BOOK, ((i | checkout.get_log(i), colour_lookup(i)) for i in search.fuzzy_id(term) if \
-        db.hash_group(i) == group_hash))
+    replace_tree_books(get_search_tree_side(1), FIELD_SEARCH_BOOK, (i for i in db.group_books(active_group()) if term in str(i["id"])))
 on_cb("group", lambda group: search_book_input_cb())
 
 def search_book_list_cb(tree: ttk.Treeview):
@@ -729,7 +846,7 @@ def retcheck_input_cb():
     using the entry term.
     """
     term: str = get_entry_term("bookid")
-    replace_tree_content(state["retcheck"]["tree"], FIELD_RETCHECK, ((b | checkout.get_log(b), colour_lookup(b)) for b in search.fuzzy(term)))
+    replace_tree_books(state["retcheck"]["tree"], FIELD_RETCHECK, search.fuzzy(term))
 
 def retcheck_tree_cb(tree: ttk.Treeview):
     """Callback on the main book treeview.
@@ -765,15 +882,13 @@ def retcheck_member_cb():
 
     tree = state["retcheck"]["mbtree"]
     if db.valid_member(term):
-        replace_tree_content(tree, FIELD_MEMBER_BOOK, ((b | checkout.get_log(b) | {"days": checkout.days(b)}, colour_lookup(b))
-            for b in db.books() if b["member"] == term
-        ))
+        replace_tree_books(tree, FIELD_MEMBER_BOOK, (b for b in db.books() if b["member"] == term))
     else:
         replace_tree_content(tree, [], [])
 
     tree: ttk.Treeview = state["retcheck"]["mtree"]
     if not (sel := get_tree_selection(tree)) or sel[0] != term:
-        replace_tree_content(tree, FIELD_MEMBER, ({"member":m} for m in sorted(db.members()) if term in m))
+        replace_tree_content(tree, FIELD_MEMBER, ({"member":m} for m in db.find_members(term, MEMBER_RESULTS)))
 
 def retcheck_members_list_cb(tree: ttk.Treeview):
     """Once a member is selected, update the checked-out book treeview below."""
@@ -833,18 +948,26 @@ on_cb("member", _retcheck_btn_update_cb)
 def retcheck_btn():
     """Checks-out / Returns the active book.
 
+    Writes the change to the database with a single transaction.
     Updates treeviews to update the colour change.
+    If another instance has already lent or returned the book,
+    the trees are redrawn with its changes and the error is shown instead.
     """
     book = active_book()
-    if checkout.checked_out(book):
-        breturn.submit(book)
-    else:
-        checkout.checkout(book, active_member())
-    db.save()
-    db.checkout()
-    recommend.engine_update()
+    try:
+        if checkout.checked_out(book):
+            db.transaction(returns=(book["id"],))
+        else:
+            db.transaction(checkouts=((book["id"], active_member()),))
+    except ValueError as e:
+        db.refresh()
+        redraw_trees()
+        show_message(str(e))
+        return
+    show_message("")
 
     retcheck_input_cb()
+    search_group_input_cb()
     tree: ttk.Treeview = state["retcheck"]["tree"]
     fid = fmt(book)["id"]
     for child in tree.get_children():
@@ -891,16 +1014,67 @@ def update_status(key: str, value=None):
         except KeyError:	pass
         ws[1]["text"] = value
 
+def show_message(text: str):
+    """Shows a message on the right of the status bar."""
+    state["message"]["text"] = text
+
 STATUS_UPDATERS = {
     "book": set_status_book,
     "group": set_status_group,
     "member": set_status_member	,
 }
 
+# --- Other Instances --- #
+def redraw_trees():
+    """Redraws every tree showing books, after the database has changed."""
+    retcheck_input_cb()
+    search_group_input_cb()
+    search_book_input_cb()
+    retcheck_member_cb()
+
+def poll_database():
+    """Loads changes to the database made by other instances.
+
+    If there were any, the trees showing books are refreshed.
+    Reschedules itself to run again after POLL milliseconds,
+    with root.after rather than profiled, so the profiles are only of interactions.
+    """
+    if db.refresh():
+        redraw_trees()
+    root.after(POLL, poll_database)
+
+# --- Statistics --- #
+def show_stats():
+    """Opens a window with the statistics of the hot paths.
+
+    The window updates itself every second while open.
+    Bound to the F12 key.
+    """
+    if (window := state.get("stats")) is not None and window.winfo_exists():
+        window.lift()
+        return
+    window = state["stats"] = tk.Toplevel(root)
+    window.title(f"{TITLE} - Statistics")
+    text = tk.Text(window, width=80, height=30)
+    text.pack(expand=True, fill=tk.BOTH)
+    def update():
+        if not window.winfo_exists():	return
+        text.delete("1.0", tk.END)
+        text.insert(tk.END, instrument.table() if instrument.ENABLED else "Set LIBRARIAN_STATS=1 to collect statistics.")
+        root.after(1000, update)
+    update()
+
 # --- MAIN ENTRY POINT --- #
-root = tk.Tk()
-root.state("zoomed")
-setup_screen(root)
-show_page("search")
-root.update()
-root.mainloop()
+# Guarded, as worker processes spawned to count the logs import this module again
+if __name__ == "__main__":
+    root = tk.Tk()
+    root.state("zoomed")
+    setup_screen(root)
+    show_page("search")
+    root.update()
+    if state["profile"]["on"]:
+        os.makedirs(state["profile"]["dir"], exist_ok=True)
+    root.after(POLL, poll_database)
+    root.bind("<F12>", lambda e: show_stats())
+    root.bind("<F11>", lambda e: toggle_profiling())
+    root.mainloop()
@@ -0,0 +1,296 @@
+"""Local HTTP server for the Librarian software
+
+Serves the catalogue as JSON to kiosks and the web catalogue without Tk.
+Reads are handled concurrently by the connection tasks,
+every checkout and return is queued for a single writer task
+so they are applied to the database one at a time,
+in a thread so the reads do not wait for the file writes.
+
+Endpoints:
+    GET  /search?q=term&limit=50     Books matching the fuzzy search.
+    GET  /groups?q=term&limit=50     Book groups matching the search with their copies in stock.
+    GET  /books/<id>                 A book with its loan status.
+    GET  /recommend/<member>?n=20    Recommendations for a member,
+                                     most popular first by &rank=reads, month, year or trending.
+    POST /checkout {"id", "member"}  Checks-out a book.
+    POST /return {"id"}              Returns a book.
+    GET  /metrics                    Statistics in the Prometheus text format.
+"""
+
+import asyncio
+import json
+from datetime import date
+from typing import Any, Awaitable, Callable, TypeAlias
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import booksearch as search
+import bookcheckout as checkout
+import bookrecommend as recommend
+import database.database as db
+import database.instrument as instrument
+
+HOST = "127.0.0.1"
+PORT = 8080
+POLL = 2 # Seconds between checking for changes by other instances
+LIMIT = 50 # Default number of results for a search
+
+Response: TypeAlias = tuple[int, Any]
+# A HTTP status code and the object to send as JSON
+
+STATUS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+}
+
+class HTTPError(Exception):
+    """Raised by a handler to respond with an error status code."""
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+# --- Data Type Display Formats --- #
+def fmt_status(book: db.Book) -> str:
+    """Return the current loan status of a book."""
+    try:
+        return "overdue" if checkout.overdue(book) else "out"
+    except ValueError:
+        return "in"
+
+def fmt_book(book: db.Book) -> dict[str, Any]:
+    """Returns a book with its latest log and loan status."""
+    return book | {"log": checkout.get_log(book), "status": fmt_status(book)}
+
+def encode(obj: Any) -> bytes:
+    """Converts an object into JSON, dates are in ISO format."""
+    return json.dumps(obj, default=lambda o: o.isoformat() if isinstance(o, date) else list(o)).encode("utf8")
+
+# --- Handlers --- #
+def query_limit(query: dict[str, list[str]], key: str = "limit", default: int = LIMIT) -> int:
+    """Return a positive integer parameter from the query string."""
+    try:
+        return max(0, int(query.get(key, [default])[0]))
+    except ValueError:
+        raise HTTPError(400, f"{key} must be an integer") from None
+
+def get_search(query: dict[str, list[str]]) -> Response:
+    """Books matching the fuzzy search term."""
+    term, limit = query.get("q", [""])[0], query_limit(query)
+    return 200, [fmt_book(book) for book, _ in zip(search.fuzzy(term), range(limit))]
+
+def get_groups(query: dict[str, list[str]]) -> Response:
+    """Book groups matching the search term with how many copies are in stock, out and overdue."""
+    term, limit = query.get("q", [""])[0], query_limit(query)
+    return 200, [g | dict(zip(("in", "out", "overdue"), db.availability(g))) for g in search.generate_group(term)[:limit]]
+
+def get_book(query: dict[str, list[str]], id: str) -> Response:
+    """A book with its loan status."""
+    try:
+        return 200, fmt_book(db.from_id(int(id)))
+    except (KeyError, ValueError):
+        raise HTTPError(404, f"Book {id} does not exist") from None
+
+def get_recommend(query: dict[str, list[str]], member: str) -> Response:
+    """Recommendations for a member with their match percentage."""
+    member = member.upper()
+    if not db.valid_member(member):
+        raise HTTPError(400, f"Member {member} is not valid")
+    size = query_limit(query, "n", 20)
+    ranking = query.get("rank", ["reads"])[0]
+    if ranking not in recommend.RANKINGS:
+        raise HTTPError(400, f"rank must be one of {', '.join(recommend.RANKINGS)}")
+    session = recommend.session(member, ranking)
+    key = recommend.ranking_key(ranking)
+    gtable = db.group_table()
+    return 200, {
+        "member": member,
+        "genres": {db.genre_name(g): n for g, n in enumerate(session["genre_count"]) if n},
+        "recommendations": [gtable[gh] | {"match": match / len(session["genres"]) * 100, "reads": recommend.read[gh], "popularity": key(gh)}
+            for (gh, match), _ in zip(recommend.iter_session(member, ranking), range(size))],
+    }
+
+def body_field(body: dict[str, Any], key: str, cast: Callable[[Any], Any]) -> Any:
+    """Return a required field from the request body."""
+    try:
+        return cast(body[key])
+    except (KeyError, ValueError, TypeError):
+        raise HTTPError(400, f"{key} is required") from None
+
+def post_checkout(body: dict[str, Any]) -> Response:
+    """Checks-out the book to the member."""
+    id, member = body_field(body, "id", int), body_field(body, "member", str).upper()
+    try:
+        new, _ = db.transaction(checkouts=((id, member),))
+    except KeyError:
+        raise HTTPError(404, f"Book {id} does not exist") from None
+    return 200, new[0]
+
+def post_return(body: dict[str, Any]) -> Response:
+    """Returns the book to the library."""
+    id = body_field(body, "id", int)
+    try:
+        _, closed = db.transaction(returns=(id,))
+    except KeyError:
+        raise HTTPError(404, f"Book {id} does not exist") from None
+    return 200, closed[0]
+
+def get_metrics(query: dict[str, list[str]]) -> Response:
+    """Statistics of the hot paths for local scraping, as text."""
+    return 200, instrument.to_prometheus()
+
+ROUTES_GET: dict[str, Callable[..., Response]] = {
+    "search": get_search,
+    "groups": get_groups,
+    "books": get_book,
+    "recommend": get_recommend,
+    "metrics": get_metrics,
+}
+ROUTES_POST: dict[str, Callable[[dict[str, Any]], Response]] = {
+    "checkout": post_checkout,
+    "return": post_return,
+}
+
+# --- Writer --- #
+writes: asyncio.Queue | None = None
+
+async def writer():
+    """Applies the queued checkouts and returns one at a time.
+
+    Each item in the queue is the handler, the request body
+    and a future for the response.
+    The handler runs in a thread, so the event loop keeps serving reads
+    while the journal is written and flushed to the disk.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        handler, body, future = await writes.get()
+        try:
+            future.set_result(await loop.run_in_executor(None, handler, body))
+        except Exception as e:
+            future.set_exception(e)
+
+async def write(handler: Callable[[dict[str, Any]], Response], body: dict[str, Any]) -> Response:
+    """Queues a write for the writer task and waits for its response."""
+    future = asyncio.get_running_loop().create_future()
+    await writes.put((handler, body, future))
+    return await future
+
+async def poller():
+    """Loads changes to the database made by other instances.
+
+    Queued for the writer, so it never changes the database at the same time as a write.
+    """
+    while True:
+        await asyncio.sleep(POLL)
+        await write(lambda body: (200, db.refresh()), {})
+
+# --- HTTP --- #
+async def dispatch(method: str, target: str, body: bytes) -> Response:
+    """Calls the handler for the request and returns its response."""
+    url = urlsplit(target)
+    route, *args = [unquote(p) for p in url.path.strip("/").split("/")]
+    if method == "GET" and route in ROUTES_GET:
+        handler = ROUTES_GET[route]
+        if handler.__code__.co_argcount != 1 + len(args):
+            raise HTTPError(404, f"{url.path} does not exist")
+        return handler(parse_qs(url.query), *args)
+    if method == "POST" and route in ROUTES_POST and not args:
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "Body must be JSON") from None
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Body must be a JSON object")
+        return await write(ROUTES_POST[route], data)
+    if route in ROUTES_GET or route in ROUTES_POST:
+        raise HTTPError(405, f"{method} is not allowed on /{route}")
+    raise HTTPError(404, f"/{route} does not exist")
+
+async def respond(method: str, target: str, body: bytes) -> tuple[int, str, bytes]:
+    """Return the status code, content type and body for a request.
+
+    Text from the handlers is sent as it is, anything else as JSON.
+    Errors from the handlers become error responses.
+    """
+    try:
+        status, obj = await dispatch(method, target, body)
+    except HTTPError as e:
+        status, obj = e.status, {"error": str(e)}
+    except (ValueError, TypeError) as e:
+        status, obj = 409, {"error": str(e)}
+    if isinstance(obj, str):
+        return status, "text/plain; version=0.0.4", obj.encode("utf8")
+    return status, "application/json", encode(obj)
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Serves HTTP/1.1 requests on a connection until it is closed.
+
+    Connections are kept alive so clients can reuse them.
+    """
+    try:
+        while line := await reader.readline():
+            try:
+                method, target, version = line.decode("latin1").split()
+            except ValueError:
+                break
+            headers: dict[str, str] = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                key, _, value = line.decode("latin1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+            try:
+                length = int(headers.get("content-length", 0))
+            except ValueError:
+                length = -1
+            if length < 0:
+                # Where the body ends is unknown, so the connection can not be reused
+                status, content, data = 400, "application/json", encode({"error": "Content-Length must be a whole number of bytes"})
+                close = True
+            else:
+                body = await reader.readexactly(length)
+                status, content, data = await respond(method, target, body)
+                close = headers.get("connection", "").lower() == "close" or version == "HTTP/1.0"
+            writer.write(
+                f"HTTP/1.1 {status} {STATUS[status]}\r\n"
+                f"Content-Type: {content}\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode("latin1") + data
+            )
+            await writer.drain()
+            if close:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):    pass
+    finally:
+        writer.close()
+
+async def serve(host: str = HOST, port: int = PORT, ready: Callable[[], Awaitable[Any]] | None = None):
+    """Runs the server along with the writer and poller tasks.
+
+    ready: Awaited once the server is listening, the server stops after it returns.
+    """
+    global writes
+    writes = asyncio.Queue()
+    tasks = [asyncio.create_task(writer()), asyncio.create_task(poller())]
+    server = await asyncio.start_server(handle, host, port)
+    try:
+        async with server:
+            if ready is None:
+                await server.serve_forever()
+            else:
+                await ready()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:    pass